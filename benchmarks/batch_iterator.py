@@ -0,0 +1,51 @@
+"""
+    This module compares the per batch overhead of ``torch.utils.data.DataLoader``
+    against ``BatchIterator`` when iterating over the crops of a collection
+    plane, without any network forward pass.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/batch_iterator.py [--crop_edge 32] [--batch_size 128]
+    ```
+"""
+import argparse
+from time import time as tm
+import torch
+from dunedn.geometry.pdune import nb_cchannels, nb_tdc_ticks
+from dunedn.networks.utils import BatchIterator
+
+
+def iterate(loader, nb_runs):
+    """Consumes the loader and returns the average time per run."""
+    start = tm()
+    for _ in range(nb_runs):
+        for noisy, _ in loader:
+            pass
+    return (tm() - start) / nb_runs
+
+
+def main(args):
+    nb_crops = (nb_cchannels // args.crop_edge + 1) * (
+        nb_tdc_ticks // args.crop_edge + 1
+    )
+    crops = torch.randn(nb_crops, 1, args.crop_edge, args.crop_edge)
+    dataset = torch.utils.data.TensorDataset(crops, torch.zeros(nb_crops))
+    print(f"Iterating over {nb_crops} crops, batch size {args.batch_size}")
+
+    loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size)
+    loader_time = iterate(loader, args.nb_runs)
+    print(f"DataLoader: {loader_time:.3e} s")
+
+    iterator = BatchIterator(crops, args.batch_size)
+    iterator_time = iterate(iterator, args.nb_runs)
+    print(f"BatchIterator: {iterator_time:.3e} s")
+    print(f"Speedup: {loader_time / iterator_time:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batching overhead benchmark")
+    parser.add_argument("--crop_edge", type=int, default=32)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--nb_runs", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,80 @@
+"""
+    This module compares the GCNN nearest neighbors search strategies on a test
+    event, reporting the inference speedup of the approximate strategy against
+    the change in denoising metrics.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/knn_strategy.py -i <input.npy> -t <target.npy> \
+        --runcard <runcard.yaml> --model_path <ckpt> [--windows 3 5 8]
+    ```
+"""
+import argparse
+from pathlib import Path
+from time import time as tm
+import numpy as np
+import torch
+from dunedn.geometry.helpers import evt2planes
+from dunedn.inference.hitreco import DnModel
+from dunedn.networks.gcnn.gcnn_net_utils import window_neighbours
+from dunedn.training.metrics import DN_METRICS, MetricsList
+from dunedn.utils.utils import load_runcard
+
+
+def set_strategy(model, strategy, window):
+    """Replaces the graph builder search strategy of both networks."""
+    # blocks share the graph builder: updating it switches the whole network
+    for network in [model.inetwork, model.cnetwork]:
+        network.getgraph_fn.strategy = strategy
+        network.getgraph_fn.window = window_neighbours(
+            network.getgraph_fn.crop_size, window
+        )
+
+
+def run(model, evt, target, dev, nb_runs):
+    """Times the inference and computes the denoising metrics."""
+    times = []
+    for _ in range(nb_runs):
+        start = tm()
+        evt_dn = model.predict(evt, dev)
+        times.append(tm() - start)
+
+    metrics_list = MetricsList(DN_METRICS)
+    iout, cout = evt2planes(evt_dn)
+    itarget, ctarget = evt2planes(target)
+    ires = metrics_list.compute_metrics(torch.Tensor(iout), torch.Tensor(itarget))
+    cres = metrics_list.compute_metrics(torch.Tensor(cout), torch.Tensor(ctarget))
+    res = metrics_list.combine_collection_induction_results(ires, cres)
+    return np.mean(times), {name: res[name] for name in metrics_list.names}
+
+
+def main(args):
+    setup = load_runcard(args.runcard)
+    model = DnModel(setup, "gcnn", args.model_path)
+    evt = np.load(args.input)[:, 2:]
+    target = np.load(args.target)[:, 2:]
+
+    set_strategy(model, "exact", args.windows[0])
+    ref_time, ref = run(model, evt, target, args.dev, args.nb_runs)
+    values = ", ".join(f"{name}: {value:.4f}" for name, value in ref.items())
+    print(f"exact: {ref_time:.3f} s, {values}")
+
+    for window in args.windows:
+        set_strategy(model, "window", window)
+        time, res = run(model, evt, target, args.dev, args.nb_runs)
+        deltas = ", ".join(f"d{name}: {res[name] - ref[name]:+.4f}" for name in ref)
+        print(f"window {window}: {time:.3f} s, speedup {ref_time / time:.2f}x")
+        print(f"\t{deltas}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GCNN k-NN strategy benchmark")
+    parser.add_argument("-i", type=Path, required=True, dest="input")
+    parser.add_argument("-t", type=Path, required=True, dest="target")
+    parser.add_argument("--runcard", type=Path, default="runcards/default.yaml")
+    parser.add_argument("--model_path", type=Path, default=None)
+    parser.add_argument("--windows", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--nb_runs", type=int, default=3)
+    parser.add_argument("--dev", default="cpu")
+    main(parser.parse_args())
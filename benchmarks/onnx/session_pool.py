@@ -0,0 +1,91 @@
+"""
+    This module measures the ONNX inference scaling with the number of cores,
+    splitting each core budget between pooled sessions and intra-op threads.
+
+    For every core count, all the (sessions, threads per session) splits are
+    timed on the same event: the fastest split shows wether adding sessions
+    beats adding intra-op threads.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/onnx/session_pool.py -m <modeltype> --model_path <ckpt> \
+        [-i <input.npy>] [--runcard <runcard.yaml>] [--cores 1 2 4 8]
+    ```
+"""
+import argparse
+from copy import deepcopy
+from pathlib import Path
+from time import time as tm
+import numpy as np
+from dunedn.geometry.pdune import nb_event_channels, nb_tdc_ticks
+from dunedn.inference.hitreco import DnModel
+from dunedn.utils.utils import load_runcard
+
+
+def splits(nb_cores):
+    """Yields the (sessions, threads per session) pairs using nb_cores."""
+    for nb_sessions in range(1, nb_cores + 1):
+        if nb_cores % nb_sessions == 0:
+            yield nb_sessions, nb_cores // nb_sessions
+
+
+def run(setup, modeltype, ckpt, evt, nb_sessions, nb_threads, nb_runs):
+    """Returns the average event inference time with the given split."""
+    setup = deepcopy(setup)
+    osetup = setup.setdefault("onnx", {})
+    osetup.update({"pool_size": nb_sessions, "session_threads": nb_threads})
+    # the global thread budget is set by the pool split only
+    osetup.setdefault("session_options", {})["inter_op_num_threads"] = 1
+    osetup["session_options"]["intra_op_num_threads"] = nb_threads
+    model = DnModel(setup, modeltype, ckpt, should_use_onnx=True)
+    model.verbose = 0
+
+    # warm up
+    model.predict(evt)
+    start = tm()
+    for _ in range(nb_runs):
+        model.predict(evt)
+    return (tm() - start) / nb_runs
+
+
+def main(args):
+    setup = load_runcard(args.runcard)
+    if args.input is None:
+        evt = np.random.randn(nb_event_channels, nb_tdc_ticks).astype(np.float32)
+    else:
+        evt = np.load(args.input)[:, 2:]
+
+    print("cores\tsessions\tthreads\ttime [s]\tspeedup")
+    ref = None
+    for nb_cores in args.cores:
+        times = {}
+        for nb_sessions, nb_threads in splits(nb_cores):
+            time = run(
+                setup,
+                args.modeltype,
+                args.model_path,
+                evt,
+                nb_sessions,
+                nb_threads,
+                args.nb_runs,
+            )
+            ref = time if ref is None else ref
+            times[(nb_sessions, nb_threads)] = time
+            print(
+                f"{nb_cores}\t{nb_sessions}\t\t{nb_threads}\t"
+                f"{time:.3f}\t\t{ref / time:.2f}x"
+            )
+        best = min(times, key=times.get)
+        print(f"{nb_cores} cores: best split {best[0]} sessions x {best[1]} threads")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ONNX session pool benchmark")
+    parser.add_argument("-m", required=True, dest="modeltype")
+    parser.add_argument("--model_path", type=Path, required=True)
+    parser.add_argument("-i", type=Path, default=None, dest="input")
+    parser.add_argument("--runcard", type=Path, default="runcards/default.yaml")
+    parser.add_argument("--cores", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--nb_runs", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,59 @@
+"""
+    This module exports a USCG network to ONNX, checks the ONNX Runtime outputs
+    against the eager PyTorch model and compares their inference times on a
+    batch of time windows.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/onnx/uscg_onnx.py --onnx <path.onnx> [--channel collection]
+    ```
+"""
+from pathlib import Path
+import argparse
+from time import time as tm
+import numpy as np
+import torch
+import onnxruntime as ort
+from dunedn.networks.uscg.uscg_net import UscgNet
+
+
+def timeit(fn, nb_runs):
+    """Returns the function output and its average run time."""
+    start = tm()
+    for _ in range(nb_runs):
+        out = fn()
+    return out, (tm() - start) / nb_runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--onnx", type=Path, help="the output onnx file", default="uscg.onnx"
+    )
+    parser.add_argument(
+        "--channel", help="induction | collection", default="collection"
+    )
+    parser.add_argument("--w", type=int, help="time window width", default=2000)
+    parser.add_argument("--batch_size", type=int, default=3)
+    parser.add_argument("--nb_runs", type=int, default=5)
+    args = parser.parse_args()
+
+    network = UscgNet(args.channel, w=args.w, pretrained=False)
+    network.eval()
+    network.onnx_export(args.onnx)
+    print(f"Exported onnx network at {args.onnx}")
+
+    inputs = torch.randn(args.batch_size, *network.input_shape)
+    with torch.no_grad():
+        expected, pyt_time = timeit(lambda: network(inputs), args.nb_runs)
+
+    ort_session = ort.InferenceSession(args.onnx.as_posix())
+    feed = {"input": inputs.numpy().astype(np.float32)}
+    outputs, onnx_time = timeit(lambda: ort_session.run(None, feed)[0], args.nb_runs)
+
+    diff = np.abs(outputs - expected.numpy())
+    print(f"Max absolute difference: {diff.max():.3e}, mean: {diff.mean():.3e}")
+    print(f"PyTorch inference done in {pyt_time:.3f} s")
+    print(f"ONNX inference done in {onnx_time:.3f} s")
+    print(f"ONNX speedup: {pyt_time / onnx_time:.2f}x")
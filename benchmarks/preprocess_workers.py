@@ -0,0 +1,68 @@
+"""
+    This module measures the ``dunedn preprocess`` event decoding scaling with
+    the number of worker processes, on a synthetic event set.
+
+    Random events are saved in a temporary dataset folder, then the planes are
+    dumped once for each number of workers. Outputs are checked against the
+    single process ones.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/preprocess_workers.py [--nb_events 16] [--nb_ticks 6000] \
+        [--workers 1 2 4 8]
+    ```
+"""
+import argparse
+import tempfile
+from pathlib import Path
+from time import time as tm
+import numpy as np
+from dunedn.geometry.pdune import nb_event_channels
+from dunedn.preprocessing.putils import EVENT_FILE_PREFIXES, get_planes_and_dump
+
+
+def make_dataset(dname, nb_events, nb_ticks):
+    """Saves random events in ``<dname>/evts``."""
+    rng = np.random.default_rng(0)
+    (dname / "evts").mkdir(parents=True)
+    for i in range(nb_events):
+        for prefix in EVENT_FILE_PREFIXES.values():
+            event = rng.normal(size=(nb_event_channels, nb_ticks + 2))
+            np.save(dname / f"evts/{prefix}_evt{i}.npy", event.astype(np.float32))
+
+
+def run(dname, nb_workers):
+    """Returns the planes dumping time and the collection noisy planes."""
+    planes_dir = dname / "planes"
+    planes_dir.mkdir(exist_ok=True)
+    for fname in planes_dir.iterdir():
+        fname.unlink()
+    start = tm()
+    get_planes_and_dump(dname, save_sample=False, nb_workers=nb_workers)
+    time = tm() - start
+    return time, np.load(planes_dir / "collection_noisy.npy", mmap_mode="r")
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dname = Path(tmpdir)
+        make_dataset(dname, args.nb_events, args.nb_ticks)
+
+        print("workers\ttime [s]\tspeedup")
+        ref, ref_planes = None, None
+        for nb_workers in args.workers:
+            time, planes = run(dname, nb_workers)
+            if ref is None:
+                ref, ref_planes = time, np.array(planes)
+            else:
+                np.testing.assert_array_equal(planes, ref_planes)
+            print(f"{nb_workers}\t{time:.3f}\t\t{ref / time:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preprocessing workers benchmark")
+    parser.add_argument("--nb_events", type=int, default=16)
+    parser.add_argument("--nb_ticks", type=int, default=6000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    main(parser.parse_args())
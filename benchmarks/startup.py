@@ -0,0 +1,71 @@
+"""
+    This module measures the networks construction time, as paid by inference
+    workers at start-up, with and without parameters initialization.
+
+    Checkpointed networks are built skipping the initialization, since their
+    weights are overwritten right after. The pretrained ResNeXt download, that
+    was performed before for USCG networks, can be included in the reference
+    timing with the ``--pretrained`` flag.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/startup.py [--runcard runcards/default.yaml] [--pretrained]
+    ```
+"""
+import argparse
+from pathlib import Path
+from time import time as tm
+from dunedn.networks.gcnn.gcnn_net import GcnnNet
+from dunedn.networks.uscg.uscg_net import UscgNet
+from dunedn.networks.utils import no_weight_init
+from dunedn.utils.utils import load_runcard
+
+
+def timeit(build_fn, nb_runs):
+    """Returns the average network construction time."""
+    start = tm()
+    for _ in range(nb_runs):
+        build_fn()
+    return (tm() - start) / nb_runs
+
+
+def skip_init(build_fn):
+    """Wraps build_fn to run in the no_weight_init context."""
+
+    def wrapper():
+        with no_weight_init():
+            return build_fn()
+
+    return wrapper
+
+
+def main(args):
+    setup = load_runcard(args.runcard)
+    uscg_dict = setup["model"]["uscg"]["net_dict"]
+    builders = {
+        "cnn": lambda: GcnnNet(**setup["model"]["cnn"]["net_dict"]),
+        "gcnn": lambda: GcnnNet(**setup["model"]["gcnn"]["net_dict"]),
+        "uscg": lambda: UscgNet(**dict(uscg_dict, pretrained=args.pretrained)),
+    }
+    fast_builders = {
+        "cnn": builders["cnn"],
+        "gcnn": builders["gcnn"],
+        "uscg": lambda: UscgNet(**dict(uscg_dict, pretrained=False)),
+    }
+    for name, build_fn in builders.items():
+        before = timeit(build_fn, args.nb_runs)
+        after = timeit(skip_init(fast_builders[name]), args.nb_runs)
+        print(f"{name}: {before:.3f} s -> {after:.3f} s, {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Networks start-up benchmark")
+    parser.add_argument("--runcard", type=Path, default="runcards/default.yaml")
+    parser.add_argument(
+        "--pretrained",
+        action="store_true",
+        help="load the pretrained resnext weights in the reference timing",
+    )
+    parser.add_argument("--nb_runs", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,87 @@
+"""
+    This module times the CNN and GCNN planes to tiles conversion on pDUNE event
+    planes, comparing the strided ``Converter`` against the split and stack
+    implementation it replaced.
+
+    Usage: (assuming being in DUNEdn root folder)
+
+    ```
+    python benchmarks/tiling.py [--crop_edge 32] [--nb_runs 10]
+    ```
+"""
+import argparse
+from time import time as tm
+import torch
+import torch.nn.functional as F
+from dunedn.geometry.pdune import nb_apas, nb_cchannels, nb_ichannels, nb_tdc_ticks
+from dunedn.networks.gcnn.gcnn_net_utils import Converter, calculate_pad
+
+
+def split_planes2tiles(planes, crop_size):
+    """Previous planes to tiles implementation, for reference."""
+    edge_h, edge_w = crop_size
+    nb_channels = planes.shape[1]
+    pad = calculate_pad(planes.shape, crop_size)
+    means = planes.mean(dim=(1, 2, 3))
+    planes = torch.cat(
+        [
+            F.pad(plane[None], pad, mode="constant", value=mean.item())
+            for plane, mean in zip(planes, means)
+        ]
+    )
+    splits = torch.stack(torch.split(planes, edge_w, -1), 1)
+    splits = torch.stack(torch.split(splits, edge_h, -2), 1)
+    return splits.view(-1, nb_channels, edge_h, edge_w), splits.shape, pad
+
+
+def split_tiles2planes(splits, splits_shape, pad):
+    """Previous tiles to planes implementation, for reference."""
+    b, a_x, a_y, nb_channels, p_x, p_y = splits_shape
+    splits = splits.reshape(splits_shape)
+    splits = splits.permute(0, 1, 4, 3, 2, 5)
+    img = splits.reshape(-1, a_x * p_x, nb_channels, a_y * p_y)
+    img = img.permute(0, 2, 1, 3)
+    return img[:, :, pad[-2] : -pad[-1], pad[0] : -pad[1]]
+
+
+def timeit(fn, nb_runs):
+    """Returns the function output and its average run time."""
+    start = tm()
+    for _ in range(nb_runs):
+        out = fn()
+    return out, (tm() - start) / nb_runs
+
+
+def main(args):
+    crop_size = (args.crop_edge,) * 2
+    converter = Converter(crop_size)
+    shapes = {
+        "induction": (2 * nb_apas, 1, nb_ichannels, nb_tdc_ticks),
+        "collection": (nb_apas, 1, nb_cchannels, nb_tdc_ticks),
+    }
+    for name, shape in shapes.items():
+        planes = torch.randn(shape)
+        print(f"{name} planes, shape={shape}")
+
+        (tiles, splits_shape, pad), old = timeit(
+            lambda: split_planes2tiles(planes, crop_size), args.nb_runs
+        )
+        new_tiles, new = timeit(lambda: converter.planes2tiles(planes), args.nb_runs)
+        assert torch.equal(tiles, new_tiles)
+        print(f"\tplanes2tiles: {old:.3e} s -> {new:.3e} s, {old / new:.2f}x")
+
+        old_planes, old = timeit(
+            lambda: split_tiles2planes(tiles, splits_shape, pad), args.nb_runs
+        )
+        new_planes, new = timeit(
+            lambda: converter.tiles2planes(tiles, planes.shape), args.nb_runs
+        )
+        assert torch.equal(old_planes, new_planes)
+        print(f"\ttiles2planes: {old:.3e} s -> {new:.3e} s, {old / new:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Planes tiling benchmark")
+    parser.add_argument("--crop_edge", type=int, default=32)
+    parser.add_argument("--nb_runs", type=int, default=10)
+    main(parser.parse_args())
@@ -41,7 +41,9 @@ def evt2planes(event: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     return np.stack(inductions)[:, None], np.stack(collections)[:, None]
 
 
-def planes2evt(inductions: np.ndarray, collections: np.ndarray) -> np.ndarray:
+def planes2evt(
+    inductions: np.ndarray, collections: np.ndarray, out: np.ndarray = None
+) -> np.ndarray:
     """
     Converts planes back to event.
 
@@ -51,6 +53,9 @@ def planes2evt(inductions: np.ndarray, collections: np.ndarray) -> np.ndarray:
         Induction planes, of shape=(N,C,H,W).
     collections: np.array
         Collection planes, of shape=(N,C,H,W).
+    out: np.array
+        If given, the event is written into this pre-allocated array, of
+        shape=(nb_event_channels, nb_tdc_ticks).
 
     Returns
     -------
@@ -62,4 +67,4 @@ def planes2evt(inductions: np.ndarray, collections: np.ndarray) -> np.ndarray:
     event = []
     for i, c in zip(inductions, collections):
         event.extend([i, c])
-    return np.concatenate(event)
+    return np.concatenate(event, out=out)
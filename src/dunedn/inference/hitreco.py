@@ -2,20 +2,62 @@
     This module contains utility functions for the inference step.
 """
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Tuple
 import numpy as np
+import torch
+from torch.utils.data import Dataset
 from dunedn.configdn import PACKAGE
 from dunedn.networks.gcnn.training import load_and_compile_gcnn_network
 from dunedn.networks.gcnn.gcnn_dataloading import GcnnPlanesDataset
 from dunedn.geometry.helpers import evt2planes, planes2evt
+from dunedn.geometry.pdune import (
+    nb_cchannels,
+    nb_event_channels,
+    nb_ichannels,
+    nb_tdc_ticks,
+)
 from dunedn.networks.uscg.training import load_and_compile_uscg_network
 from dunedn.networks.uscg.uscg_dataloading import UscgPlanesDataset
+from dunedn.networks.backends import set_backend
 from dunedn.networks.utils import BatchProfiler
 from dunedn.training.metrics import DN_METRICS
 
 logger = logging.getLogger(PACKAGE + ".inference")
 
 
-def get_models(task, modeltype, ckpt, msetup):
+def get_models(task, modeltype, ckpt, msetup, backend="eager"):
+    """Loads the PyTorch induction and collection networks.
+
+    Parameters
+    ----------
+    task: str
+        Available options dn | roi.
+    modeltype: str
+        Available options cnn | gcnn | uscg.
+    ckpt: Path
+        The directory containing the `.pth` files. If None, un-trained networks
+        are used.
+    msetup: dict
+        The model settings dictionary.
+    backend: str
+        The inference backend. Available options eager | torchscript | compile.
+        Torchscript modules are cached in the ``ckpt/torchscript`` folder.
+
+    Note
+    ----
+
+    Unless the ``fuse_bn`` model setting is False, batch normalization layers
+    are folded into the network weights: the networks are not trainable.
+
+    Returns
+    -------
+    inetwork: AbstractNet
+        The induction network.
+    cnetwork: AbstractNet
+        The collection network.
+    """
     load_fn = (
         load_and_compile_uscg_network
         if modeltype == "uscg"
@@ -29,27 +71,118 @@ def get_models(task, modeltype, ckpt, msetup):
         ckpt_collection = None
     inetwork = load_fn("induction", msetup, ckpt_induction)
     cnetwork = load_fn("collection", msetup, ckpt_collection)
-    return inetwork, cnetwork
 
+    # inference only networks: applies to eager, traced and onnx exported ones
+    if msetup.get("fuse_bn", True):
+        inetwork.fuse_for_inference()
+        cnetwork.fuse_for_inference()
+
+    if backend != "eager":
+        cache_dir = None if ckpt is None else ckpt / "torchscript"
+        batch_size = msetup["test_batch_size"]
+        networks = [(inetwork, ckpt_induction), (cnetwork, ckpt_collection)]
+        for network, fname in networks:
+            # tiles for cnn and gcnn, time windows of whole planes for uscg
+            input_shape = (batch_size, *network.input_shape)
+            # k-NN settings are not in the network layers: key the cache on them
+            set_backend(
+                network,
+                backend,
+                input_shape,
+                fname,
+                cache_dir,
+                settings=msetup.get("net_dict"),
+            )
+    return inetwork, cnetwork
 
-def get_onnx_models(task, modeltype, ckpt):
-    from dunedn.networks.onnx.onnx_gcnn_net import OnnxGcnnNetwork
 
-    fname = ckpt / f"induction/{modeltype}_{task}.onnx"
-    logger.info(f"Loading onnx model at {fname}")
-    inetwork = OnnxGcnnNetwork(
-        fname.as_posix(),
-        DN_METRICS,
-        # providers=["CUDAExecutionProvider", "CPUExecutionProvider"],
-    )
-    fname = ckpt / f"collection/{modeltype}_{task}.onnx"
-    logger.info(f"Loading onnx model at {fname}")
-    cnetwork = OnnxGcnnNetwork(
-        fname.as_posix(),
-        DN_METRICS,
-        # providers=["CUDAExecutionProvider", "CPUExecutionProvider"],
+def get_onnx_models(task, modeltype, ckpt, msetup, osetup=None, nb_threads=None):
+    """Loads the ONNX induction and collection networks.
+
+    Parameters
+    ----------
+    task: str
+        Available options dn | roi.
+    modeltype: str
+        Available options cnn | gcnn | uscg.
+    ckpt: Path
+        The directory containing the `.onnx` files.
+    msetup: dict
+        The model settings dictionary.
+    osetup: dict
+        The onnxruntime settings dictionary, with the optional keys
+        ``providers``, ``session_options``, ``cache_optimized_graph``,
+        ``variant``, ``pool_size`` and ``session_threads``.
+    nb_threads: Tuple[int, int]
+        If given, the intra-op threads of the induction and collection
+        sessions, overriding the ``session_options`` setting. None entries keep
+        the setting.
+
+    Returns
+    -------
+    inetwork: OnnxNetwork | OnnxSessionPool
+        The induction network.
+    cnetwork: OnnxNetwork | OnnxSessionPool
+        The collection network.
+    """
+    from dunedn.networks.onnx.onnx_pool import OnnxSessionPool
+    from dunedn.networks.onnx.onnx_gcnn_net import (
+        OnnxGcnnNetwork,
+        OnnxGcnnPlanesNetwork,
     )
-    return inetwork, cnetwork
+    from dunedn.networks.onnx.onnx_uscg_net import OnnxUscgNetwork
+
+    osetup = {} if osetup is None else osetup
+    kwargs = {
+        # e.g. ["CUDAExecutionProvider", "CPUExecutionProvider"]
+        "providers": osetup.get("providers"),
+        "session_options": osetup.get("session_options"),
+        "cache_optimized_graph": osetup.get("cache_optimized_graph", False),
+    }
+    if modeltype == "uscg":
+        network_cls = OnnxUscgNetwork
+        # the time windows the network was exported with
+        net_dict = msetup["net_dict"]
+        kwargs.update({"w": net_dict["w"], "stride": net_dict["stride"]})
+    else:
+        network_cls = OnnxGcnnNetwork
+
+    # int8 quantized variants are produced by `dunedn quantize`, whole-plane
+    # networks by `dunedn inference --onnx_export --onnx_planes`
+    variant = osetup.get("variant", "fp32")
+    if variant == "fp32":
+        suffix = ""
+    elif variant in ["dynamic", "static", "planes"] and modeltype != "uscg":
+        suffix = f"_{variant}"
+        if variant == "planes":
+            network_cls = OnnxGcnnPlanesNetwork
+    else:
+        raise NotImplementedError(
+            f"Onnx variant {variant} not implemented for {modeltype} model"
+        )
+
+    pool_size = osetup.get("pool_size", 1)
+    if pool_size > 1:
+        # planes are dispatched round-robin to concurrent sessions
+        kwargs.update({"session_threads": osetup.get("session_threads")})
+        load_fn = partial(OnnxSessionPool, network_cls, pool_size=pool_size)
+    else:
+        load_fn = network_cls
+
+    networks = []
+    nb_threads = (None, None) if nb_threads is None else nb_threads
+    for channel, threads in zip(["induction", "collection"], nb_threads):
+        channel_kwargs = dict(kwargs)
+        if threads is not None:
+            # each branch owns the intra-op thread pool of its sessions
+            session_options = dict(kwargs["session_options"] or {})
+            session_options["intra_op_num_threads"] = threads
+            channel_kwargs["session_options"] = session_options
+            channel_kwargs.pop("session_threads", None)
+        fname = ckpt / f"{channel}/{modeltype}_{task}{suffix}.onnx"
+        logger.info(f"Loading onnx model at {fname}")
+        networks.append(load_fn(fname.as_posix(), DN_METRICS, **channel_kwargs))
+    return tuple(networks)
 
 
 class BaseModel:
@@ -57,7 +190,18 @@ class BaseModel:
     Mother class for inference model.
     """
 
-    def __init__(self, setup, modeltype, task, ckpt=None, should_use_onnx=False):
+    def __init__(
+        self,
+        setup,
+        modeltype,
+        task,
+        ckpt=None,
+        should_use_onnx=False,
+        should_run_concurrently=False,
+        nb_threads=None,
+        torch_threads=None,
+        backend=None,
+    ):
         """
         Parameters
         ----------
@@ -71,28 +215,74 @@ class BaseModel:
             Saved checkpoint path. If None, an un-trained model will be used.
         should_use_onnx: bool
             Wether to use ONNX exported model.
+        should_run_concurrently: bool
+            Wether to run the induction and collection networks concurrently
+            on a thread pool.
+        nb_threads: Tuple[int, int]
+            Intra-op threads of the induction and collection ONNX sessions.
+            Ignored by PyTorch networks, see ``torch_threads``. If None, the
+            runcard settings are kept.
+        torch_threads: int
+            Total intra-op threads of the PyTorch networks. The PyTorch thread
+            pool is process-wide, so this is a single budget shared by the
+            induction and collection branches, set while forwarding events.
+            If None, the PyTorch default is kept.
+        backend: str
+            The PyTorch networks inference backend. Available options
+            eager | torchscript | compile. If None, the model ``backend``
+            runcard key is used, eager by default.
         """
         self.setup = setup
         self.modeltype = modeltype
         self.task = task
         self.ckpt = ckpt
         self.should_use_onnx = should_use_onnx
+        self.should_run_concurrently = should_run_concurrently
+        self.nb_threads = (None, None) if nb_threads is None else tuple(nb_threads)
+        self.torch_threads = torch_threads
+        if not should_use_onnx and nb_threads is not None:
+            logger.warning(
+                "Per branch threads only apply to ONNX sessions, "
+                "use torch_threads to bound the PyTorch threads"
+            )
+        self.verbose = 1
+
+        # torch and onnxruntime release the GIL, threads are enough
+        self.executor = (
+            ThreadPoolExecutor(max_workers=2, thread_name_prefix="dunedn-branch")
+            if should_run_concurrently
+            else None
+        )
 
         msetup = setup["model"][self.modeltype]
+        self.backend = msetup.get("backend", "eager") if backend is None else backend
+        self.test_batch_size = msetup["test_batch_size"]
 
         if should_use_onnx:
-            if modeltype == "uscg":
-                raise NotImplementedError(
-                    "Cannot call with onnx inference with USCG network."
-                )
             self.inetwork, self.cnetwork = get_onnx_models(
-                self.task, self.modeltype, self.ckpt
+                self.task,
+                self.modeltype,
+                self.ckpt,
+                msetup,
+                setup.get("onnx"),
+                nb_threads=self.nb_threads,
             )
         else:
             self.inetwork, self.cnetwork = get_models(
-                self.task, self.modeltype, self.ckpt, msetup
+                self.task, self.modeltype, self.ckpt, msetup, self.backend
             )
 
+        # network specific inference options
+        if modeltype == "uscg":
+            self.predict_kwargs = {"batch_windows": msetup.get("batch_windows", False)}
+        elif should_use_onnx:
+            self.predict_kwargs = {}
+        else:
+            self.predict_kwargs = {
+                "gate_threshold": msetup.get("gate_threshold"),
+                "gate_statistic": msetup.get("gate_statistic", "max"),
+            }
+
         gen_kwargs = {
             "task": setup["task"],
             "dsetup": setup["dataset"],
@@ -131,28 +321,156 @@ class BaseModel:
             Denoised event of shape=(nb wires, nb tdc ticks).
         """
         logger.debug("Starting inference on event")
-        iplanes, cplanes = evt2planes(event)
+        idataset, cdataset = self.preprocess(event)
+        return self.predict_datasets(idataset, cdataset, dev, profiler=profiler)
+
+    def preprocess(self, event: np.ndarray) -> Tuple[Dataset, Dataset]:
+        """Splits the event into planes and builds the inference datasets.
+
+        The datasets apply median subtraction to the planes. This step does not
+        involve the networks, hence it can overlap with the forward pass of a
+        different event.
 
+        Parameters
+        ----------
+        event: np.ndarray
+            Event input array of shape=(nb wires, nb tdc ticks).
+
+        Returns
+        -------
+        idataset: Dataset
+            The induction planes dataset.
+        cdataset: Dataset
+            The collection planes dataset.
+        """
+        iplanes, cplanes = evt2planes(event)
         idataset = self.induction_generator(iplanes)
         cdataset = self.collection_generator(cplanes)
+        return idataset, cdataset
 
-        if self.should_use_onnx:
-            iout = self.inetwork.predict(idataset, profiler=profiler)
-            cout = self.cnetwork.predict(cdataset, profiler=profiler)
-        else:
-            iout = self.inetwork.predict(
-                idataset, dev, no_metrics=True, profiler=profiler
-            )
-            cout = self.cnetwork.predict(
-                cdataset, dev, no_metrics=True, profiler=profiler
+    def predict_datasets(
+        self,
+        idataset: Dataset,
+        cdataset: Dataset,
+        dev="cpu",
+        profiler: BatchProfiler = None,
+        out: np.ndarray = None,
+    ) -> np.ndarray:
+        """Forwards preprocessed datasets through the networks.
+
+        Parameters
+        ----------
+        idataset: Dataset
+            The induction planes dataset.
+        cdataset: Dataset
+            The collection planes dataset.
+        dev: str
+            Device hosting computation.
+        profiler: BatchProfiler
+            The profiler object to record batch inference time.
+        out: np.ndarray
+            If given, the denoised event is written into this pre-allocated
+            array, of shape=(nb wires, nb tdc ticks).
+
+        Returns
+        -------
+        np.ndarray
+            Denoised event of shape=(nb wires, nb tdc ticks).
+        """
+        if self.should_run_concurrently and profiler is not None:
+            logger.warning(
+                "Batch profiling is not thread safe, running networks sequentially"
             )
-        out_evt = planes2evt(iout, cout)
+
+        previous_threads = torch.get_num_threads()
+        if not self.should_use_onnx and self.torch_threads is not None:
+            # the intra-op thread pool is process-wide: set it once for both
+            # branches, before dispatching them
+            torch.set_num_threads(self.torch_threads)
+        try:
+            if self.should_run_concurrently and profiler is None:
+                ifuture = self.executor.submit(
+                    self.predict_branch, self.inetwork, idataset, dev
+                )
+                cfuture = self.executor.submit(
+                    self.predict_branch, self.cnetwork, cdataset, dev
+                )
+                iout, cout = ifuture.result(), cfuture.result()
+            else:
+                iout = self.predict_branch(
+                    self.inetwork, idataset, dev, profiler=profiler
+                )
+                cout = self.predict_branch(
+                    self.cnetwork, cdataset, dev, profiler=profiler
+                )
+        finally:
+            torch.set_num_threads(previous_threads)
+        out_evt = planes2evt(iout, cout, out=out)
 
         if profiler is not None:
             return out_evt, profiler
         return out_evt
 
-    def onnx_export(self, output_dir=None):
+    def predict_branch(
+        self,
+        network,
+        dataset,
+        dev: str = "cpu",
+        profiler: BatchProfiler = None,
+    ):
+        """Makes inference on the planes of a single readout type.
+
+        Parameters
+        ----------
+        network: AbstractNet | OnnxNetwork
+            The induction or collection network.
+        dataset: torch.utils.data.Dataset
+            The planes dataset.
+        dev: str
+            Device hosting computation.
+        profiler: BatchProfiler
+            The profiler object to record batch inference time.
+
+        Returns
+        -------
+        torch.Tensor
+            Denoised planes, of shape=(N,1,H,W).
+        """
+        is_torchscript = not self.should_use_onnx and self.backend == "torchscript"
+        if is_torchscript and dev != "cpu":
+            raise NotImplementedError("Torchscript backend supports cpu inference only")
+
+        # grad mode is thread local: enter inference mode in the calling thread
+        with torch.inference_mode():
+            if self.should_use_onnx:
+                return network.predict(
+                    dataset, profiler=profiler, **self.predict_kwargs
+                )
+            return network.predict(
+                dataset,
+                dev,
+                no_metrics=True,
+                verbose=self.verbose,
+                profiler=profiler,
+                **self.predict_kwargs,
+            )
+
+    def inference_session(self, dev: str = "cpu") -> "InferenceSession":
+        """Creates a session to run repeated inference on the given device.
+
+        Parameters
+        ----------
+        dev: str
+            Device hosting computation.
+
+        Returns
+        -------
+        InferenceSession
+            The inference session wrapping the model.
+        """
+        return InferenceSession(self, dev)
+
+    def onnx_export(self, output_dir=None, planes=False, threshold=None):
         """
         Exports the model to onnx format.
 
@@ -160,9 +478,24 @@ class BaseModel:
         ----------
         output_dir: Path
             The directory to save the onnx files.
+        planes: bool
+            Wether to export the whole-plane networks, saved with the
+            ``_planes`` suffix. Available for cnn and gcnn models only.
+        threshold: float
+            The whole-plane networks output threshold.
+
+        Note
+        ----
+
+        Whole-plane networks take a single plane and process its tiles in
+        batches of ``test_batch_size``.
         """
         if output_dir is None:
             output_dir = self.ckpt
+        if planes and self.modeltype == "uscg":
+            raise NotImplementedError(
+                "Whole-plane onnx export not implemented for uscg model"
+            )
 
         # create directory
         output_dir.joinpath("induction").mkdir(exist_ok=True)
@@ -170,21 +503,109 @@ class BaseModel:
 
         logger.debug(f"Exporting onnx model")
 
-        # export induction
-        fname = output_dir / f"induction/{self.modeltype}_{self.task}.onnx"
-        self.inetwork.onnx_export(fname)
-        logger.info(f"Saved onnx module at: {fname}")
+        suffix = "_planes" if planes else ""
+        for channel, network, nb_channels in [
+            ("induction", self.inetwork, nb_ichannels),
+            ("collection", self.cnetwork, nb_cchannels),
+        ]:
+            name = f"{self.modeltype}_{self.task}{suffix}.onnx"
+            fname = output_dir / channel / name
+            if planes:
+                planes_shape = (1, 1, nb_channels, nb_tdc_ticks)
+                network.onnx_export(
+                    fname, planes_shape, threshold, self.test_batch_size
+                )
+            else:
+                network.onnx_export(fname)
+            logger.info(f"Saved onnx module at: {fname}")
+
+
+class InferenceSession:
+    """Device-resident inference on a stream of events.
 
-        # export collection
-        fname = output_dir / f"collection/{self.modeltype}_{self.task}.onnx"
-        self.cnetwork.onnx_export(fname)
-        logger.info(f"Saved onnx module at: {fname}")
+    The session pins the networks on their device in evaluation mode once,
+    instead of moving them back and forth at every prediction. Denoised events
+    are written into a pre-allocated buffer, reused by every call: copy the
+    output if it has to outlive the next call.
+
+    Example
+    -------
+
+    >>> from dunedn.inference.hitreco import DnModel
+    >>> session = DnModel(setup, "gcnn", ckpt).inference_session("cuda:0")
+    >>> for event in events:
+    ...     evt_dn = session.predict(event)
+    """
+
+    def __init__(self, model: BaseModel, dev: str = "cpu"):
+        """
+        Parameters
+        ----------
+        model: BaseModel
+            The inference model. The session takes ownership of its networks.
+        dev: str
+            Device hosting computation.
+        """
+        self.model = model
+        self.dev = dev
+        self.model.verbose = 0
+        self.buffer = np.empty((nb_event_channels, nb_tdc_ticks), dtype=np.float32)
+
+        if not model.should_use_onnx:
+            for network in [model.inetwork, model.cnetwork]:
+                network.to(dev)
+                network.eval()
+
+    def predict(self, event: np.ndarray) -> np.ndarray:
+        """Denoises an event.
+
+        Parameters
+        ----------
+        event: np.ndarray
+            Event input array of shape=(nb wires, nb tdc ticks).
+
+        Returns
+        -------
+        np.ndarray
+            Denoised event of shape=(nb wires, nb tdc ticks).
+        """
+        idataset, cdataset = self.model.preprocess(event)
+        return self.predict_datasets(idataset, cdataset)
+
+    def predict_datasets(self, idataset: Dataset, cdataset: Dataset) -> np.ndarray:
+        """Forwards datasets returned by the model ``preprocess`` method.
+
+        Parameters
+        ----------
+        idataset: Dataset
+            The induction planes dataset.
+        cdataset: Dataset
+            The collection planes dataset.
+
+        Returns
+        -------
+        np.ndarray
+            Denoised event of shape=(nb wires, nb tdc ticks).
+        """
+        return self.model.predict_datasets(
+            idataset, cdataset, self.dev, out=self.buffer
+        )
 
 
 class DnModel(BaseModel):
     """Wrapper class for denoising model."""
 
-    def __init__(self, setup, modeltype, ckpt=None, should_use_onnx=False):
+    def __init__(
+        self,
+        setup,
+        modeltype,
+        ckpt=None,
+        should_use_onnx=False,
+        should_run_concurrently=False,
+        nb_threads=None,
+        torch_threads=None,
+        backend=None,
+    ):
         """
         Parameters
         ----------
@@ -196,14 +617,43 @@ class DnModel(BaseModel):
             model will be used.
         should_use_onnx: bool
             Wether to use ONNX exported model.
+        should_run_concurrently: bool
+            Wether to run the induction and collection networks concurrently.
+        nb_threads: Tuple[int, int]
+            Intra-op threads of the induction and collection ONNX sessions.
+        torch_threads: int
+            Total intra-op threads of the PyTorch networks.
+        backend: str
+            The PyTorch networks inference backend: eager | torchscript |
+            compile. If None, the runcard setting is used.
         """
-        super(DnModel, self).__init__(setup, modeltype, "dn", ckpt, should_use_onnx)
+        super(DnModel, self).__init__(
+            setup,
+            modeltype,
+            "dn",
+            ckpt,
+            should_use_onnx,
+            should_run_concurrently=should_run_concurrently,
+            nb_threads=nb_threads,
+            torch_threads=torch_threads,
+            backend=backend,
+        )
 
 
 class RoiModel(BaseModel):
     """Wrapper class for ROI selection model."""
 
-    def __init__(self, setup, modeltype, ckpt=None, should_use_onnx=False):
+    def __init__(
+        self,
+        setup,
+        modeltype,
+        ckpt=None,
+        should_use_onnx=False,
+        should_run_concurrently=False,
+        nb_threads=None,
+        torch_threads=None,
+        backend=None,
+    ):
         """
         Parameters
         ----------
@@ -213,8 +663,27 @@ class RoiModel(BaseModel):
             Saved checkpoint path. If None, an un-trained model will be used.
         should_use_onnx: bool
             Wether to use ONNX exported model.
+        should_run_concurrently: bool
+            Wether to run the induction and collection networks concurrently.
+        nb_threads: Tuple[int, int]
+            Intra-op threads of the induction and collection ONNX sessions.
+        torch_threads: int
+            Total intra-op threads of the PyTorch networks.
+        backend: str
+            The PyTorch networks inference backend: eager | torchscript |
+            compile. If None, the runcard setting is used.
         """
-        super(RoiModel, self).__init__(setup, modeltype, "roi", ckpt, should_use_onnx)
+        super(RoiModel, self).__init__(
+            setup,
+            modeltype,
+            "roi",
+            ckpt,
+            should_use_onnx,
+            should_run_concurrently=should_run_concurrently,
+            nb_threads=nb_threads,
+            torch_threads=torch_threads,
+            backend=backend,
+        )
 
 
 class DnRoiModel:
@@ -10,28 +10,41 @@
     .. code-block:: text
 
         $ dunedn inference --help
-        usage: dunedn inference [-h] [-i INPUT] [-o OUTPUT] -m MODEL [--model_path CKPT] [--onnx] [--onnx_export] runcard
+        usage: dunedn inference [-h] [-i INPUT [INPUT ...]] [--output OUTPUT] -m MODEL [--model_path CKPT] [--onnx] [--onnx_export] [--onnx_planes] [--concurrent] [--threads ITHREADS CTHREADS] [--torch_threads TORCH_THREADS] [--prefetch] [--queue_size QUEUE_SIZE] [--dev DEV] [--backend BACKEND]
 
         Load event and make inference with saved model.
 
-        positional arguments:
-          runcard            yaml configcard path
-
         optional arguments:
-          -h, --help         show this help message and exit
-          -i INPUT           path to the input event file
-          -o OUTPUT          path to the output event file
-          -m MODEL           model name. Valid options: (uscg|gcnn|cnn|id)
-          --model_path CKPT  (optional) path to directory with saved model
-          --onnx             wether to use ONNX exported model
-          --onnx_export      wether to export models to ONNX
+          -h, --help            show this help message and exit
+          -i INPUT [INPUT ...]  input event files, directories or glob patterns
+          --output OUTPUT, -o OUTPUT
+                                output folder, denoised events saved in its models/MODEL
+          -m MODEL              model name. Valid options: (uscg|gcnn|cnn|id)
+          --model_path CKPT     (optional) path to directory with saved model
+          --onnx                wether to use ONNX exported model
+          --onnx_export         wether to export models to ONNX
+          --onnx_planes         export whole-plane cnn|gcnn networks with --onnx_export
+          --concurrent          run induction and collection networks concurrently
+          --threads ITHREADS CTHREADS
+                                ONNX intra-op threads of induction and collection
+          --torch_threads TORCH_THREADS
+                                total pytorch intra-op threads, shared by both branches
+          --prefetch            overlap event loading, inference and saving
+          --queue_size QUEUE_SIZE
+                                events buffered between pipeline stages
+          --dev DEV             device hosting computation
+          --backend BACKEND     pytorch inference backend: (eager|torchscript|compile)
 """
 import logging
 from copy import deepcopy
+from glob import glob
+from time import time as tm
 import numpy as np
 from pathlib import Path
 from .hitreco import DnModel
+from .pipeline import EventPipeline
 from dunedn.configdn import PACKAGE
+from dunedn.networks.utils import throughput_summary
 from dunedn.utils.utils import load_runcard, add_info_columns
 
 THRESHOLD = 3.5  # the ADC threshold below which the output is put to zero
@@ -52,11 +65,17 @@ def add_arguments_inference(parser):
     parser.add_argument(
         "-i",
         type=Path,
-        help="path to the input event file",
+        nargs="+",
+        help="input event files, directories or glob patterns",
         metavar="INPUT",
-        dest="input_path",
+        dest="input_paths",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=Path,
+        help="output folder, denoised events saved in its models/MODEL",
     )
-    parser.add_argument("--output", "-o", type=Path, help="the output folder")
     parser.add_argument(
         "-m",
         help="model name. Valid options: (uscg|gcnn|cnn|id)",
@@ -83,6 +102,51 @@ def add_arguments_inference(parser):
         help="wether to export models to ONNX",
         dest="should_export_to_onnx",
     )
+    parser.add_argument(
+        "--onnx_planes",
+        action="store_true",
+        help="export whole-plane cnn|gcnn networks with --onnx_export",
+        dest="should_export_planes",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="run induction and collection networks concurrently",
+        dest="should_run_concurrently",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs=2,
+        help="ONNX intra-op threads of induction and collection",
+        default=None,
+        metavar=("ITHREADS", "CTHREADS"),
+        dest="nb_threads",
+    )
+    parser.add_argument(
+        "--torch_threads",
+        type=int,
+        help="total pytorch intra-op threads, shared by both branches",
+        default=None,
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="overlap event loading, inference and saving",
+        dest="should_prefetch",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        help="events buffered between pipeline stages",
+        default=2,
+    )
+    parser.add_argument("--dev", help="device hosting computation", default="cpu")
+    parser.add_argument(
+        "--backend",
+        help="pytorch inference backend: (eager|torchscript|compile)",
+        default=None,
+    )
     parser.set_defaults(func=inference)
 
 
@@ -106,35 +170,114 @@ def inference(args):
 
     return inference_main(
         setup,
-        args.input_path,
+        args.input_paths,
         output_folder,
         args.modeltype,
         args.ckpt,
         should_use_onnx=args.should_use_onnx,
         should_export_to_onnx=args.should_export_to_onnx,
+        should_export_planes=args.should_export_planes,
+        should_run_concurrently=args.should_run_concurrently,
+        nb_threads=args.nb_threads,
+        torch_threads=args.torch_threads,
+        should_prefetch=args.should_prefetch,
+        queue_size=args.queue_size,
+        dev=args.dev,
+        backend=args.backend,
     )
 
 
+def get_input_paths(inputs: list[Path]) -> list[Path]:
+    """Expands the inference inputs into a list of event files.
+
+    Each input can be a ``.npy`` event file, a directory containing ``.npy``
+    event files or a glob pattern.
+
+    Parameters
+    ----------
+    inputs: list[Path]
+        The input files, directories or glob patterns.
+
+    Returns
+    -------
+    paths: list[Path]
+        The sorted event files, without duplicates.
+
+    Raises
+    ------
+    FileNotFoundError
+        If an input does not match any event file.
+    """
+    paths = []
+    for path in inputs:
+        if path.is_dir():
+            matches = sorted(path.glob("*.npy"))
+        elif path.is_file():
+            matches = [path]
+        else:
+            matches = sorted(map(Path, glob(path.as_posix())))
+        if not matches:
+            raise FileNotFoundError(f"No event file found at {path}")
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+
+def get_output_fname(input_path: Path, output_folder: Path) -> Path:
+    """Builds the denoised event file name from the input one.
+
+    Parameters
+    ----------
+    input_path: Path
+        Path to the input event file.
+    output_folder: Path
+        Path to the output folder.
+
+    Returns
+    -------
+    fname: Path
+        The output file name, with ``dn`` inserted before the last ``_``
+        separated field of the input name.
+    """
+    name = (input_path.name).split("_")
+    name.insert(-1, "dn")
+    name = "_".join(name)
+    return output_folder / name
+
+
 def inference_main(
     setup,
-    input_path,
+    input_paths,
     output_folder,
     modeltype,
     ckpt,
     should_use_onnx=False,
     should_export_to_onnx=False,
+    should_export_planes=False,
+    should_run_concurrently=False,
+    nb_threads=None,
+    torch_threads=None,
+    should_prefetch=False,
+    queue_size=2,
+    dev="cpu",
+    backend=None,
 ):
     """Inference main function.
 
-    Loads an input event from file, makes inference and saves the ouptut.
-    Eventually returns the output array.
+    Loads the models once, then loads every input event from file, makes
+    inference and saves the ouptut. Logs a throughput summary at the end of
+    the run.
+
+    With ``should_prefetch``, events flow through a load, forward and save
+    pipeline, so that disk I/O and preprocessing of neighbouring events
+    overlap with the forward pass. Stage occupancies are logged as well.
 
     Parameters
     ----------
     setup: dict
         Settings dictionary.
-    input_path: Path
-        Path to the input event file.
+    input_paths: list[Path]
+        Input event files, directories or glob patterns. A single Path is
+        accepted as well.
     output_folder: Path
         Path to the output folder.
     modeltype: str
@@ -143,31 +286,96 @@ def inference_main(
         Directory with saved model.
     should_use_onnx: bool
         Wether to use onnx format.
+    should_export_to_onnx: bool
+        Wether to export the models to onnx format and exit.
+    should_export_planes: bool
+        Wether to export the whole-plane networks. Denoising outputs are
+        thresholded in the graph.
+    should_run_concurrently: bool
+        Wether to run induction and collection networks concurrently.
+    nb_threads: list[int]
+        Intra-op threads for induction and collection ONNX sessions.
+    torch_threads: int
+        Total intra-op threads for PyTorch networks, shared by both branches.
+    should_prefetch: bool
+        Wether to run the inference steps in a pipeline.
+    queue_size: int
+        The number of events buffered between pipeline stages.
+    dev: str
+        Device hosting computation.
+    backend: str
+        The PyTorch networks inference backend. If None, the runcard setting is
+        used.
     """
-    model = DnModel(setup, modeltype, ckpt, should_use_onnx=should_use_onnx)
+    model = DnModel(
+        setup,
+        modeltype,
+        ckpt,
+        should_use_onnx=should_use_onnx,
+        should_run_concurrently=should_run_concurrently,
+        nb_threads=nb_threads,
+        torch_threads=torch_threads,
+        backend=backend,
+    )
 
     if should_export_to_onnx:
-        model.onnx_export(ckpt)
+        # only denoising outputs are thresholded
+        is_dn = should_export_planes and model.task == "dn"
+        threshold = THRESHOLD if is_dn else None
+        model.onnx_export(ckpt, planes=should_export_planes, threshold=threshold)
         exit(-1)
 
-    logger.info(f"Denoising event at {input_path}")
-    evt = np.load(input_path)[:, 2:]
-    evt_dn = model.predict(evt)
+    if isinstance(input_paths, Path):
+        input_paths = [input_paths]
+    # networks stay on `dev` for the whole run
+    session = model.inference_session(dev)
 
-    # comment the following line to avoid thresholding
-    evt_dn = thresholding_dn(evt_dn)
+    paths = get_input_paths(input_paths)
+    logger.info(f"Denoising {len(paths)} events")
 
-    name = (input_path.name).split("_")
-    name.insert(-1, "dn")
-    name = "_".join(name)
-    fname = output_folder / name
+    def load(input_path):
+        logger.info(f"Denoising event at {input_path}")
+        evt = np.load(input_path)[:, 2:]
+        return input_path, model.preprocess(evt)
+
+    def forward(inputs):
+        input_path, (idataset, cdataset) = inputs
+        evt_dn = session.predict_datasets(idataset, cdataset)
+
+        # comment the following line to avoid thresholding
+        # note: the session output buffer is reused, do not keep references
+        evt_dn = thresholding_dn(evt_dn)
+        return input_path, evt_dn
+
+    def save(outputs):
+        input_path, evt_dn = outputs
+        fname = get_output_fname(input_path, output_folder)
+
+        # add info columns
+        evt_dn = add_info_columns(evt_dn)
+
+        # save reco array
+        np.save(fname, evt_dn)
+        logger.info(f"Saved output event at {fname}")
+
+    stages = [("load", load), ("forward", forward), ("save", save)]
 
-    # add info columns
-    evt_dn = add_info_columns(evt_dn)
+    if should_prefetch:
+        pipeline = EventPipeline(stages, queue_size=queue_size)
+        latencies = pipeline.run(paths)
+        wall_time = pipeline.wall_time
+        logger.info(pipeline.print_occupancy())
+    else:
+        latencies = []
+        start = tm()
+        for input_path in paths:
+            evt_start = tm()
+            save(forward(load(input_path)))
+            latencies.append(tm() - evt_start)
+        latencies = np.array(latencies)
+        wall_time = tm() - start
 
-    # save reco array
-    np.save(fname, evt_dn)
-    logger.info(f"Saved output event at {fname}")
+    logger.info(throughput_summary(latencies, wall_time))
 
 
 def thresholding_dn(evt, t=THRESHOLD):
@@ -0,0 +1,181 @@
+"""
+    This module implements a staged producer/consumer pipeline to overlap the
+    inference steps of consecutive events.
+
+    Example
+    -------
+
+    >>> from dunedn.inference.pipeline import EventPipeline
+    >>> stages = [("load", load_fn), ("forward", forward_fn), ("save", save_fn)]
+    >>> pipeline = EventPipeline(stages, queue_size=2)
+    >>> latencies = pipeline.run(paths)
+    >>> print(pipeline.print_occupancy())
+"""
+import logging
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+from time import time as tm
+from typing import Any, Callable, Iterable, Tuple
+import numpy as np
+from dunedn.configdn import PACKAGE
+
+logger = logging.getLogger(PACKAGE + ".inference")
+
+# marks the end of the stream in the stage queues
+_SENTINEL = object()
+
+# polling interval to check for failures in other stages
+_TIMEOUT = 0.1
+
+
+class EventPipeline:
+    """Runs a sequence of stages on a stream of items.
+
+    Each stage runs in its own thread and communicates with the next one
+    through a bounded queue. While stage ``i`` processes item ``N``, stage
+    ``i-1`` is allowed to work on item ``N+1`` and stage ``i+1`` on item
+    ``N-1``. The queue size bounds the number of items buffered between two
+    stages, hence the memory footprint of the pipeline.
+
+    Items are processed in order. If a stage raises, the pipeline is stopped
+    and the exception is re-raised by :meth:`run`.
+    """
+
+    def __init__(self, stages: list[Tuple[str, Callable]], queue_size: int = 2):
+        """
+        Parameters
+        ----------
+        stages: list[Tuple[str, Callable]]
+            The (name, function) stage pairs. Each function takes the output of
+            the previous stage and returns the input of the next one.
+        queue_size: int
+            The maximum number of items waiting between two stages.
+        """
+        self.names = [name for name, _ in stages]
+        self.fns = [fn for _, fn in stages]
+        self.queue_size = queue_size
+        self.busy_times = [0.0] * len(self.fns)
+        self.wall_time = 0.0
+
+    def run(self, items: Iterable[Any]) -> np.ndarray:
+        """Streams the items through the pipeline stages.
+
+        Parameters
+        ----------
+        items: Iterable[Any]
+            The inputs to the first stage.
+
+        Returns
+        -------
+        latencies: np.ndarray
+            The time elapsed between the first stage start and the last stage
+            end for each item, of shape=(nb items,).
+        """
+        nb_stages = len(self.fns)
+        queues = [Queue(maxsize=self.queue_size) for _ in range(nb_stages - 1)]
+        self.busy_times = [0.0] * nb_stages
+        self._stop = Event()
+        self._errors = []
+        latencies = []
+
+        threads = [
+            Thread(
+                target=self._work,
+                args=(i, items, queues, latencies),
+                name=f"dunedn-{self.names[i]}",
+            )
+            for i in range(nb_stages)
+        ]
+
+        start = tm()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall_time = tm() - start
+
+        if self._errors:
+            raise self._errors[0]
+        return np.array(latencies)
+
+    def _work(self, i: int, items: Iterable[Any], queues: list[Queue], latencies):
+        """Consumes the ``i``-th stage input stream."""
+        fn = self.fns[i]
+        is_last = i == len(self.fns) - 1
+        if i == 0:
+            source = ((tm(), item) for item in items)
+        else:
+            source = self._get(queues[i - 1])
+        try:
+            for t0, payload in source:
+                start = tm()
+                output = fn(payload)
+                self.busy_times[i] += tm() - start
+                if is_last:
+                    latencies.append(tm() - t0)
+                elif not self._put(queues[i], (t0, output)):
+                    break
+        except Exception as error:
+            logger.error(f"Pipeline stage '{self.names[i]}' failed")
+            self._errors.append(error)
+            self._stop.set()
+        finally:
+            if not is_last:
+                self._put(queues[i], _SENTINEL)
+
+    def _get(self, queue: Queue):
+        """Yields packets from queue until the end of the stream."""
+        while not self._stop.is_set():
+            try:
+                packet = queue.get(timeout=_TIMEOUT)
+            except Empty:
+                continue
+            if packet is _SENTINEL:
+                return
+            yield packet
+
+    def _put(self, queue: Queue, packet) -> bool:
+        """Puts packet in queue, unless the pipeline is stopped.
+
+        Returns
+        -------
+        bool
+            Wether the packet was enqueued.
+        """
+        while not self._stop.is_set():
+            try:
+                queue.put(packet, timeout=_TIMEOUT)
+                return True
+            except Full:
+                continue
+        return False
+
+    def occupancy(self) -> dict:
+        """Computes the fraction of the wall time each stage was busy.
+
+        The stage with the highest occupancy is the pipeline bottleneck.
+
+        Returns
+        -------
+        dict
+            The stage names as keys and occupancies in the [0,1] range as values.
+        """
+        wall_time = self.wall_time if self.wall_time > 0 else 1.0
+        return {
+            name: busy / wall_time for name, busy in zip(self.names, self.busy_times)
+        }
+
+    def print_occupancy(self) -> str:
+        """Human-readable message on stage occupancies.
+
+        Returns
+        -------
+        message: str
+            The message with per stage occupancy and the bottleneck stage.
+        """
+        occupancy = self.occupancy()
+        bottleneck = max(occupancy, key=occupancy.get)
+        stages = ", ".join(
+            f"{name}: {100 * occ:.1f}%" for name, occ in occupancy.items()
+        )
+        return f"Stage occupancy: {stages}. Bottleneck: {bottleneck}"
@@ -0,0 +1,352 @@
+"""
+    This module contains the wrapper function for the ``dunedn quantize``
+    command.
+
+    The fp32 ONNX models are quantized to int8 with onnxruntime post-training
+    quantization:
+
+    - ``dynamic``: weights are quantized offline, activations on the fly.
+    - ``static``: activations ranges are calibrated on the planes of the input
+      event.
+
+    The quantized variants are saved next to the fp32 ones, as
+    ``{modeltype}_{task}_{variant}.onnx``, and are loaded by ``DnModel`` with
+    ``should_use_onnx=True`` setting the ``onnx.variant`` runcard key.
+
+    Example
+    -------
+
+    Quantize help output:
+
+    .. code-block:: text
+
+        $ dunedn quantize --help
+        usage: dunedn quantize [-h] [--output OUTPUT] -i INPUT -t TARGET -m MODEL --model_path CKPT [--variants VARIANTS [VARIANTS ...]] [--nb_calibration_batches NB_CALIBRATION_BATCHES] [--nb_runs NB_RUNS]
+
+        Quantize ONNX models to int8 and compare them against fp32 ones.
+
+        optional arguments:
+          -h, --help            show this help message and exit
+          --output OUTPUT, -o OUTPUT
+                                the output folder
+          -i INPUT              path to the input event file
+          -t TARGET             path to the target event file
+          -m MODEL              model name. Valid options: (gcnn|cnn)
+          --model_path CKPT     path to directory with saved model
+          --variants VARIANTS [VARIANTS ...]
+                                quantization variants: (dynamic|static)
+          --nb_calibration_batches NB_CALIBRATION_BATCHES
+                                batches of tiles used for static calibration
+          --nb_runs NB_RUNS     inference runs to be profiled for each variant
+"""
+import logging
+from copy import deepcopy
+from pathlib import Path
+import numpy as np
+import torch
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from .hitreco import DnModel
+from dunedn.configdn import PACKAGE
+from dunedn.geometry.helpers import evt2planes
+from dunedn.networks.onnx.onnx_gcnn_net import OnnxGcnnNetwork
+from dunedn.networks.onnx.utils import np_planes2tiles
+from dunedn.networks.utils import BatchProfiler
+from dunedn.training.metrics import DN_METRICS, MetricsList
+from dunedn.utils.utils import load_runcard, median_subtraction
+
+logger = logging.getLogger(PACKAGE + ".inference")
+
+QUANTIZATION_VARIANTS = ["dynamic", "static"]
+
+
+def add_arguments_quantize(parser):
+    """
+    Adds quantize subparser arguments.
+
+    Parameters
+    ----------
+        - parser: ArgumentParser, quantize subparser object
+    """
+    parser.add_argument("--output", "-o", type=Path, help="the output folder")
+    parser.add_argument(
+        "-i",
+        type=Path,
+        help="path to the input event file",
+        required=True,
+        metavar="INPUT",
+        dest="input_path",
+    )
+    parser.add_argument(
+        "-t",
+        type=Path,
+        help="path to the target event file",
+        required=True,
+        metavar="TARGET",
+        dest="target_path",
+    )
+    parser.add_argument(
+        "-m",
+        help="model name. Valid options: (gcnn|cnn)",
+        required=True,
+        metavar="MODEL",
+        dest="modeltype",
+    )
+    parser.add_argument(
+        "--model_path",
+        type=Path,
+        help="path to directory with saved model",
+        required=True,
+        dest="ckpt",
+    )
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        help="quantization variants: (dynamic|static)",
+        default=QUANTIZATION_VARIANTS,
+    )
+    parser.add_argument(
+        "--nb_calibration_batches",
+        type=int,
+        help="batches of tiles used for static calibration",
+        default=8,
+    )
+    parser.add_argument(
+        "--nb_runs",
+        type=int,
+        help="inference runs to be profiled for each variant",
+        default=3,
+    )
+    parser.set_defaults(func=quantize)
+
+
+def quantize(args):
+    """Wrapper quantize function.
+
+    Parameters
+    ----------
+    args: NameSpace
+        Parsed from command line or from code.
+
+    Returns
+    -------
+    dict
+        The fp32 and quantized variants metrics and timings.
+    """
+    setup = load_runcard(args.output / "cards/runcard.yaml")
+    return quantize_main(
+        setup,
+        args.input_path,
+        args.target_path,
+        args.modeltype,
+        args.ckpt,
+        variants=args.variants,
+        nb_calibration_batches=args.nb_calibration_batches,
+        nb_runs=args.nb_runs,
+    )
+
+
+class PlanesCalibrationReader(CalibrationDataReader):
+    """Feeds batches of tiles to the static quantization calibration."""
+
+    def __init__(self, tiles: np.ndarray, batch_size: int, nb_batches: int):
+        """
+        Parameters
+        ----------
+        tiles: np.ndarray
+            The calibration tiles, of shape=(N,C,H,W).
+        batch_size: int
+            The number of tiles in each batch.
+        nb_batches: int
+            The maximum number of calibration batches.
+        """
+        tiles = tiles[: batch_size * nb_batches].astype(np.float32)
+        self.batches = iter(
+            tiles[start : start + batch_size]
+            for start in range(0, len(tiles), batch_size)
+        )
+
+    def get_next(self) -> dict:
+        batch = next(self.batches, None)
+        return None if batch is None else {"input": batch}
+
+
+def quantize_model(
+    fname: Path,
+    variant: str,
+    planes: np.ndarray = None,
+    batch_size: int = None,
+    nb_calibration_batches: int = None,
+) -> Path:
+    """Quantizes a fp32 ONNX model.
+
+    Parameters
+    ----------
+    fname: Path
+        The fp32 `.onnx` file path.
+    variant: str
+        Available options dynamic | static.
+    planes: np.ndarray
+        The calibration planes, of shape=(N,C,H,W). Static variant only.
+    batch_size: int
+        The calibration batch size. Static variant only.
+    nb_calibration_batches: int
+        The maximum number of calibration batches. Static variant only.
+
+    Returns
+    -------
+    Path
+        The quantized `.onnx` file path.
+    """
+    output = fname.with_name(f"{fname.stem}_{variant}.onnx")
+    if variant == "dynamic":
+        # the onnxruntime cpu ConvInteger kernel takes uint8 weights only
+        quantize_dynamic(fname, output, weight_type=QuantType.QUInt8)
+    elif variant == "static":
+        crop_size = OnnxGcnnNetwork(fname.as_posix(), DN_METRICS).crop_size
+        tiles = np_planes2tiles(median_subtraction(planes), crop_size)
+        reader = PlanesCalibrationReader(tiles, batch_size, nb_calibration_batches)
+        quantize_static(fname, output, reader, weight_type=QuantType.QInt8)
+    else:
+        raise NotImplementedError(f"Quantization variant {variant} not implemented")
+    logger.info(f"Saved {variant} quantized onnx model at: {output}")
+    return output
+
+
+def evaluate_variant(
+    setup: dict,
+    modeltype: str,
+    ckpt: Path,
+    variant: str,
+    event: np.ndarray,
+    target: np.ndarray,
+    nb_runs: int,
+) -> dict:
+    """Computes the denoising metrics and the batch inference time of a variant.
+
+    Parameters
+    ----------
+    setup: dict
+        Settings dictionary.
+    modeltype: str
+        Model name. Available options: gcnn|cnn.
+    ckpt: Path
+        Directory with saved model.
+    variant: str
+        Available options fp32 | dynamic | static.
+    event: np.ndarray
+        The input event, of shape=(nb wires, nb tdc ticks).
+    target: np.ndarray
+        The target event, of shape=(nb wires, nb tdc ticks).
+    nb_runs: int
+        The number of profiled inference runs.
+
+    Returns
+    -------
+    dict
+        The denoising metrics and the ``time`` batch inference time.
+    """
+    setup = deepcopy(setup)
+    setup.setdefault("onnx", {})["variant"] = variant
+    model = DnModel(setup, modeltype, ckpt, should_use_onnx=True)
+
+    times = []
+    for _ in range(nb_runs):
+        evt_dn, profiler = model.predict(event, profiler=BatchProfiler())
+        times.append(profiler.get_stats()[0])
+
+    metrics_list = MetricsList(DN_METRICS)
+    iout, cout = evt2planes(evt_dn)
+    itarget, ctarget = evt2planes(target)
+    ires = metrics_list.compute_metrics(torch.Tensor(iout), torch.Tensor(itarget))
+    cres = metrics_list.compute_metrics(torch.Tensor(cout), torch.Tensor(ctarget))
+    res = metrics_list.combine_collection_induction_results(ires, cres)
+    results = {name: res[name] for name in metrics_list.names}
+    results["time"] = np.mean(times)
+    return results
+
+
+def quantize_main(
+    setup: dict,
+    input_path: Path,
+    target_path: Path,
+    modeltype: str,
+    ckpt: Path,
+    variants: list[str] = QUANTIZATION_VARIANTS,
+    nb_calibration_batches: int = 8,
+    nb_runs: int = 3,
+) -> dict:
+    """Quantize main function.
+
+    Exports the fp32 models to ONNX if needed, quantizes the induction and
+    collection models and logs the denoising metrics deltas and the inference
+    speedup of each variant with respect to the fp32 models.
+
+    Parameters
+    ----------
+    setup: dict
+        Settings dictionary.
+    input_path: Path
+        Path to the input event file, used for calibration and evaluation.
+    target_path: Path
+        Path to the target event file.
+    modeltype: str
+        Model name. Available options: gcnn|cnn.
+    ckpt: Path
+        Directory with saved model.
+    variants: list[str]
+        The quantization variants. Available options: dynamic|static.
+    nb_calibration_batches: int
+        The maximum number of batches of tiles used for static calibration.
+    nb_runs: int
+        The number of profiled inference runs for each variant.
+
+    Returns
+    -------
+    dict
+        The fp32 and quantized variants metrics and timings.
+    """
+    if modeltype not in ["gcnn", "cnn"]:
+        raise NotImplementedError(f"Quantization of {modeltype} model not implemented")
+
+    event = np.load(input_path)[:, 2:]
+    target = np.load(target_path)[:, 2:]
+
+    model = DnModel(setup, modeltype, ckpt)
+    task = model.task
+    if not all(
+        (ckpt / f"{channel}/{modeltype}_{task}.onnx").is_file()
+        for channel in ["induction", "collection"]
+    ):
+        model.onnx_export(ckpt)
+    del model
+
+    batch_size = setup["model"][modeltype]["test_batch_size"]
+    for channel, planes in zip(["induction", "collection"], evt2planes(event)):
+        fname = ckpt / f"{channel}/{modeltype}_{task}.onnx"
+        for variant in variants:
+            quantize_model(
+                fname, variant, planes, batch_size, nb_calibration_batches
+            )
+
+    results = {}
+    for variant in ["fp32"] + variants:
+        results[variant] = evaluate_variant(
+            setup, modeltype, ckpt, variant, event, target, nb_runs
+        )
+
+    ref = results["fp32"]
+    values = ", ".join(f"{name}: {value:.4f}" for name, value in ref.items())
+    logger.info(f"fp32: {values}")
+    for variant in variants:
+        res = results[variant]
+        deltas = ", ".join(
+            f"d{name}: {res[name] - ref[name]:+.4f}" for name in ref if name != "time"
+        )
+        speedup = ref["time"] / res["time"]
+        logger.info(f"{variant}: {deltas}, speedup {speedup:.2f}x")
+    return results
@@ -40,6 +40,7 @@ class AbstractNet(torch.nn.Module, ABC):
         super().__init__(**kwargs)
         self.__is_compiled = False
         self.history = History()
+        self._inference_module = None
 
     @property
     def is_compiled(self):
@@ -49,6 +50,30 @@ class AbstractNet(torch.nn.Module, ABC):
     def is_compiled(self, value):
         self.__is_compiled = value
 
+    @property
+    def inference_module(self) -> torch.nn.Module:
+        """The module called by the inference passes.
+
+        The network itself, unless a different backend is set, see
+        ``dunedn.networks.backends.set_backend``.
+        """
+        if self._inference_module is None:
+            return self
+        return self._inference_module
+
+    def set_inference_module(self, module: torch.nn.Module = None):
+        """Sets the module called by the inference passes.
+
+        The module is not registered as a submodule: it either wraps the network
+        itself or holds a separate copy of its weights.
+
+        Parameters
+        ----------
+        module: torch.nn.Module
+            The inference module. If None, the network itself is used.
+        """
+        object.__setattr__(self, "_inference_module", module)
+
     def to_data_parallel(self, device_ids: list) -> MyDataParallel:
         """Returns the model wrapped by MyDataParallel class.
 
@@ -107,6 +132,7 @@ class AbstractNet(torch.nn.Module, ABC):
         val_generator: torch.utils.data.Dataset = None,
         dev: str = "cpu",
         callbacks: list[Callback] = None,
+        num_workers: int = 0,
     ):
         """Main training function.
 
@@ -146,6 +172,11 @@ class AbstractNet(torch.nn.Module, ABC):
             The validation dataset generator.
         dev: str
             The device hosting the computation. Defaults is "cpu".
+        callbacks: list[Callback]
+            The callbacks called during training.
+        num_workers: int
+            The number of processes loading the training batches. Workers are
+            kept alive across epochs.
 
         Returns
         -------
@@ -159,6 +190,8 @@ class AbstractNet(torch.nn.Module, ABC):
             shuffle=True,
             # sampler=train_sampler,
             batch_size=train_generator.batch_size,
+            num_workers=num_workers,
+            persistent_workers=num_workers > 0,
         )
 
         # create CallbackList object, add History object to it
@@ -0,0 +1,226 @@
+"""
+    This module implements the inference backends of the PyTorch networks.
+
+    Available backends:
+
+    - ``eager``: the network python forward pass.
+    - ``torchscript``: the network traced on CPU with ``torch.jit.trace``.
+      Traced modules are saved on disk and reloaded by later runs, skipping
+      tracing. They run on CPU only.
+    - ``compile``: the network optimized by ``torch.compile``, if available in
+      the installed torch version. Compiled modules are not saved on disk.
+
+    Example
+    -------
+
+    >>> from dunedn.networks.backends import set_backend
+    >>> network = set_backend(network, "torchscript", (32, 1, 32, 32), ckpt)
+    >>> output = network.inference_module(inputs)
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Tuple
+import torch
+from torch import nn
+import torch.nn.functional as F
+from .abstract_net import AbstractNet
+from dunedn import PACKAGE
+
+logger = logging.getLogger(PACKAGE + ".inference")
+
+BACKENDS = ["eager", "torchscript", "compile"]
+
+
+class FixedBatchModule(nn.Module):
+    """Runs a module traced with a fixed batch size on any batch size.
+
+    Inputs are split in chunks of the traced batch size, the last chunk is zero
+    padded. Examples do not interact in evaluation mode, so padding does not
+    change the outputs.
+    """
+
+    def __init__(self, module: nn.Module, batch_size: int):
+        """
+        Parameters
+        ----------
+        module: nn.Module
+            The traced module.
+        batch_size: int
+            The batch size the module was traced with.
+        """
+        super().__init__()
+        self.module = module
+        self.batch_size = batch_size
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Parameters
+        ----------
+        x: torch.Tensor
+            Input tensor of shape=(N,C,H,W).
+
+        Returns
+        -------
+        torch.Tensor
+            Output tensor of shape=(N,C',H,W).
+        """
+        if len(x) == self.batch_size:
+            return self.module(x)
+        outs = []
+        for start in range(0, len(x), self.batch_size):
+            chunk = x[start : start + self.batch_size]
+            nb_examples = len(chunk)
+            chunk = F.pad(chunk, (0, 0, 0, 0, 0, 0, 0, self.batch_size - nb_examples))
+            outs.append(self.module(chunk)[:nb_examples])
+        return torch.cat(outs)
+
+
+def get_cache_key(
+    checkpoint_filepath: Path,
+    input_shape: Tuple[int],
+    architecture: str = "",
+    settings: dict = None,
+) -> str:
+    """Computes the key of a traced module in the on-disk cache.
+
+    Parameters
+    ----------
+    checkpoint_filepath: Path
+        The `.pth` checkpoint containing the network weights.
+    input_shape: Tuple[int]
+        The traced input shape.
+    architecture: str
+        The network layers description, to tell apart networks with and
+        without folded batch normalization layers.
+    settings: dict
+        The network settings, such as the k-NN ones, that shape the traced
+        graph but do not appear in the network layers description.
+
+    Returns
+    -------
+    str
+        The hash of the checkpoint content, input shape, architecture, settings
+        and torch version.
+    """
+    sha = hashlib.sha256()
+    with open(checkpoint_filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            sha.update(chunk)
+    sha.update(str(tuple(input_shape)).encode())
+    sha.update(architecture.encode())
+    sha.update(json.dumps(settings or {}, sort_keys=True, default=str).encode())
+    sha.update(torch.__version__.encode())
+    return sha.hexdigest()[:16]
+
+
+def trace_network(
+    network: AbstractNet,
+    input_shape: Tuple[int],
+    checkpoint_filepath: Path = None,
+    cache_dir: Path = None,
+    settings: dict = None,
+) -> torch.jit.ScriptModule:
+    """Traces the network on CPU, loading it from the cache if possible.
+
+    Parameters
+    ----------
+    network: AbstractNet
+        The network to be traced.
+    input_shape: Tuple[int]
+        The input shape: (N,C,H,W).
+    checkpoint_filepath: Path
+        The `.pth` checkpoint containing the network weights. If None, the
+        traced module is not cached.
+    cache_dir: Path
+        The directory containing the traced modules. If None, the traced module
+        is not cached.
+    settings: dict
+        The network settings, added to the cache key.
+
+    Returns
+    -------
+    torch.jit.ScriptModule
+        The traced module.
+    """
+    fname = None
+    if checkpoint_filepath is not None and cache_dir is not None:
+        key = get_cache_key(
+            checkpoint_filepath, input_shape, repr(network), settings
+        )
+        fname = Path(cache_dir) / f"{Path(checkpoint_filepath).stem}_{key}.pt"
+        if fname.is_file():
+            logger.info(f"Loading traced network at {fname}")
+            return torch.jit.load(fname.as_posix(), map_location="cpu")
+
+    network.eval()
+    network.to("cpu")
+    with torch.no_grad():
+        traced = torch.jit.trace(network, torch.randn(input_shape))
+
+    if fname is not None:
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        # concurrent workers must not read a partially written module
+        tmp_fname = fname.with_suffix(f".{os.getpid()}.tmp")
+        torch.jit.save(traced, tmp_fname.as_posix())
+        os.replace(tmp_fname, fname)
+        logger.info(f"Saved traced network at {fname}")
+    return traced
+
+
+def set_backend(
+    network: AbstractNet,
+    backend: str,
+    input_shape: Tuple[int],
+    checkpoint_filepath: Path = None,
+    cache_dir: Path = None,
+    settings: dict = None,
+) -> AbstractNet:
+    """Sets the module called by the network inference passes.
+
+    Parameters
+    ----------
+    network: AbstractNet
+        The network.
+    backend: str
+        Available options eager | torchscript | compile.
+    input_shape: Tuple[int]
+        The inference input shape: (N,C,H,W). The torchscript backend is traced
+        with this shape.
+    checkpoint_filepath: Path
+        The `.pth` checkpoint containing the network weights, used as cache key.
+    cache_dir: Path
+        The directory containing the cached torchscript modules.
+    settings: dict
+        The network settings, added to the torchscript cache key.
+
+    Returns
+    -------
+    AbstractNet
+        The network, with the ``inference_module`` attribute set.
+
+    Raises
+    ------
+    NotImplementedError
+        If the backend is not available.
+    """
+    if backend == "eager":
+        network.set_inference_module(None)
+    elif backend == "torchscript":
+        traced = trace_network(
+            network, input_shape, checkpoint_filepath, cache_dir, settings
+        )
+        network.set_inference_module(FixedBatchModule(traced, input_shape[0]))
+    elif backend == "compile":
+        if not hasattr(torch, "compile"):
+            raise NotImplementedError(
+                f"Compile backend requires torch>=2.0, found {torch.__version__}"
+            )
+        network.set_inference_module(torch.compile(network))
+    else:
+        raise NotImplementedError(
+            f"Backend {backend} not implemented, available options: {BACKENDS}"
+        )
+    return network
@@ -125,6 +125,7 @@ class GcnnDataset(BaseGcnnDataset):
         if self.training:
             logger.error("`to_crops()` method should not be called when training")
 
+        self.planes_shape = self.noisy.shape
         self.noisy = self.converter.planes2tiles(self.noisy)
         self.clear = self.converter.planes2tiles(self.clear)
 
@@ -132,8 +133,8 @@ class GcnnDataset(BaseGcnnDataset):
         """Converts crops into planes."""
         if self.training:
             logger.error("`to_planes()` method should not be called when training")
-        self.noisy = self.converter.tiles2planes(self.noisy)
-        self.clear = self.converter.tiles2planes(self.clear)
+        self.noisy = self.converter.tiles2planes(self.noisy, self.planes_shape)
+        self.clear = self.converter.tiles2planes(self.clear, self.planes_shape)
 
     def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor]:
         """
@@ -147,6 +148,154 @@ class GcnnDataset(BaseGcnnDataset):
         return self.noisy[index], self.clear[index]
 
 
+class GcnnCropSamplingDataset(BaseGcnnDataset):
+    """Samples training crops on the fly from memory-mapped planes.
+
+    Replaces the precomputed training crops: every epoch draws fresh crops,
+    balanced between signal and background as in
+    ``dunedn.preprocessing.putils.get_crop``. The first ``nb_crops * pct``
+    examples of each plane are centered on signal pixels, the other ones on
+    background pixels.
+
+    A single pass over the planes at construction stores the planes medians and
+    the flat signal pixel indices. Planes are opened lazily, so that each
+    ``DataLoader`` worker maps the files on its own, and crops are read from
+    disk on demand. Crop centers are drawn with the torch random generator,
+    seeded differently by each worker.
+    """
+
+    def __init__(
+        self,
+        dataset_type: str,
+        task: str,
+        channel: str,
+        dsetup: dict,
+        batch_size: int,
+        chunk_size: int = 16,
+    ):
+        """
+        Parameters
+        ----------
+        dataset_type: str
+            Available options train | val | test
+        task: str
+            Available options dn | roi.
+        channel: str
+            Available options induction | collection
+        dsetup: dict
+            The dataset settings dictionary.
+        batch_size: int
+            The number of examples to be batched.
+        chunk_size: int
+            The number of planes loaded at once by the initial pass.
+        """
+        super().__init__(dataset_type, task, channel, dsetup, batch_size)
+
+        self.planes_folder = self.dsetup["data_folder"] / dataset_type / "planes"
+        self.nb_crops = self.dsetup["nb_crops"]
+        self.nb_signal_crops = int(self.nb_crops * self.dsetup["pct"])
+        self.nb_background_crops = int(self.nb_crops * (1 - self.dsetup["pct"]))
+        self.crops_per_plane = self.nb_signal_crops + self.nb_background_crops
+        self.window = (self.crop_size[0] // 2 * 2, self.crop_size[1] // 2 * 2)
+
+        self.clear_fname = self.planes_folder / f"{channel}_clear.npy"
+        self.noisy_fname = self.planes_folder / f"{channel}_noisy.npy"
+        self.clear = None
+        self.noisy = None
+
+        clear = np.load(self.clear_fname, mmap_mode="r")
+        noisy = np.load(self.noisy_fname, mmap_mode="r")
+        self.nb_planes = len(clear)
+        self.planes_shape = clear.shape[2:]
+
+        medians = []
+        signal = []
+        for start in range(0, self.nb_planes, chunk_size):
+            medians.append(
+                np.median(noisy[start : start + chunk_size], axis=[1, 2, 3])
+            )
+            chunk = np.asarray(clear[start : start + chunk_size, 0])
+            for plane in chunk:
+                signal.append(np.flatnonzero(plane).astype(np.int32))
+        self.medians = np.concatenate(medians)
+
+        # flat signal indices of all the planes, stored contiguously
+        counts = np.array([len(indices) for indices in signal])
+        self.signal_counts = counts
+        self.signal_starts = np.cumsum(counts) - counts
+        self.signal_indices = np.concatenate(signal)
+
+        plane_size = np.prod(self.planes_shape)
+        if (self.nb_signal_crops > 0 and not counts.all()) or (
+            self.nb_background_crops > 0 and (counts == plane_size).any()
+        ):
+            raise ValueError(
+                "Cannot sample crops: found a plane without signal or background"
+            )
+
+    def __len__(self):
+        return self.nb_planes * self.crops_per_plane
+
+    def open_planes(self):
+        """Memory-maps the planes files, once in each process."""
+        self.clear = np.load(self.clear_fname, mmap_mode="r")
+        self.noisy = np.load(self.noisy_fname, mmap_mode="r")
+
+    def sample_center(self, plane: int, is_signal: bool) -> Tuple[int, int]:
+        """Draws a signal or background pixel of a plane.
+
+        Parameters
+        ----------
+        plane: int
+            The plane index.
+        is_signal: bool
+            Wether to draw a signal pixel.
+
+        Returns
+        -------
+        Tuple[int, int]
+            The pixel row and column.
+        """
+        height, width = self.planes_shape
+        if is_signal:
+            choice = torch.randint(self.signal_counts[plane], (1,)).item()
+            pixel = self.signal_indices[self.signal_starts[plane] + choice]
+            return divmod(int(pixel), width)
+        # background pixels dominate the planes: rejection sampling is cheap
+        while True:
+            row = torch.randint(height, (1,)).item()
+            col = torch.randint(width, (1,)).item()
+            if self.clear[plane, 0, row, col] == 0:
+                return row, col
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns
+        -------
+        noisy: torch.Tensor
+            A single noisy example, of shape=(1,H,W).
+        clear: torch.Tensor
+            A single clear example, of shape=(1,H,W).
+        """
+        if self.clear is None:
+            self.open_planes()
+
+        plane, crop = divmod(index, self.crops_per_plane)
+        row, col = self.sample_center(plane, crop < self.nb_signal_crops)
+
+        # crops centers are clamped to keep crops inside the plane
+        (height, width), (edge_h, edge_w) = self.planes_shape, self.window
+        top = min(max(row, edge_h // 2), height - edge_h // 2) - edge_h // 2
+        left = min(max(col, edge_w // 2), width - edge_w // 2) - edge_w // 2
+        rows, cols = slice(top, top + edge_h), slice(left, left + edge_w)
+
+        clear = np.array(self.clear[plane, :, rows, cols])
+        noisy = self.noisy[plane, :, rows, cols] - self.medians[plane]
+        if self.task == "roi":
+            clear = get_hits_from_clear_images(clear, self.threshold)
+        return torch.Tensor(noisy), torch.Tensor(clear)
+
+
 class GcnnPlanesDataset(BaseGcnnDataset):
     """Loads the dataset for CNN and GCNN networks."""
 
@@ -190,13 +339,14 @@ class GcnnPlanesDataset(BaseGcnnDataset):
         if self.training:
             logger.error("`to_crops()` method should not be called when training")
 
+        self.planes_shape = self.noisy.shape
         self.noisy = self.converter.planes2tiles(self.noisy)
 
     def to_planes(self):
         """Converts crops into planes."""
         if self.training:
             logger.error("`to_planes()` method should not be called when training")
-        self.noisy = self.converter.tiles2planes(self.noisy)
+        self.noisy = self.converter.tiles2planes(self.noisy, self.planes_shape)
 
     def __getitem__(self, index: int) -> Tuple[torch.Tensor, int]:
         """
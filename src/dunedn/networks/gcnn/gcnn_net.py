@@ -9,8 +9,9 @@ from pathlib import Path
 from time import time as tm
 import torch
 from torch import nn
+import torch.nn.functional as F
 from ..abstract_net import AbstractNet
-from ..utils import BatchProfiler
+from ..utils import BatchIterator, BatchProfiler, fuse_conv_bn
 from .gcnn_dataloading import BaseGcnnDataset
 from .gcnn_net_blocks import (
     PreProcessBlock,
@@ -20,6 +21,7 @@ from .gcnn_net_blocks import (
     PostProcessBlock,
     NonLocalGraph,
 )
+from .gcnn_net_utils import calculate_pad, tiles_gate_mask
 from .utils import gcnn_inference_pass
 from dunedn import PACKAGE
 
@@ -37,6 +39,9 @@ class GcnnNet(AbstractNet):
         input_channels: int,
         hidden_channels: int,
         k: int = None,
+        knn_memory: float = None,
+        knn_strategy: str = "exact",
+        knn_window: int = 5,
     ):
         """
         Parameters
@@ -53,6 +58,15 @@ class GcnnNet(AbstractNet):
             Convolutions hidden filters number.
         k: int
             Nearest neighbor number. None if model is cnn..
+        knn_memory: float
+            Memory budget in MB for the blocked k-NN search. If None, the dense
+            distance matrix is used.
+        knn_strategy: str
+            Nearest neighbors search strategy. Available options exact | window.
+            The window strategy approximates the graph searching neighbors
+            within ``knn_window`` pixels only.
+        knn_window: int
+            Search window half size for the window strategy.
         """
         super(GcnnNet, self).__init__()
         self.crop_size = (crop_edge,) * 2
@@ -61,11 +75,22 @@ class GcnnNet(AbstractNet):
         ic = input_channels
         hc = hidden_channels
         self.k = k
+        self.knn_memory = knn_memory
+        self.knn_strategy = knn_strategy
+        self.knn_window = knn_window
 
         self.input_shape = (1,) + self.crop_size
 
         self.getgraph_fn = (
-            NonLocalGraph(k, self.crop_size) if self.model == "gcnn" else lambda x: None
+            NonLocalGraph(
+                k,
+                self.crop_size,
+                max_memory=knn_memory,
+                strategy=knn_strategy,
+                window=knn_window,
+            )
+            if self.model == "gcnn"
+            else lambda x: None
         )
         # self.norm_fn = choose_norm(dataset_dir, channel, normalization)
         self.roi = ROI(7, ic, hc, self.getgraph_fn, self.model)
@@ -89,6 +114,53 @@ class GcnnNet(AbstractNet):
 
         self.combine = lambda x, y: x + y
 
+    def train(self, mode: bool = True):
+        """Sets the module in training or evaluation mode.
+
+        In evaluation mode, the non-local graph returns the neighbours
+        differences already averaged, so that the aggregators project a single
+        vector per pixel instead of K.
+
+        Parameters
+        ----------
+        mode: bool
+            Wether to set training mode (True) or evaluation mode (False).
+
+        Returns
+        -------
+        GcnnNet
+            The network itself.
+        """
+        super(GcnnNet, self).train(mode)
+        if self.model == "gcnn":
+            self.getgraph_fn.reduce_neighbours = not mode
+        return self
+
+    def fuse_for_inference(self) -> "GcnnNet":
+        """Folds the batch normalization layers into the preceding layers.
+
+        Batch normalization layers following convolutions, in the ``HPF`` and
+        ``LPF`` blocks, and following graph convolutions, in the ``LPF`` and
+        ``PostProcessBlock`` blocks, are folded into the convolution weights and
+        replaced by identities. Convolutions are then directly followed by their
+        activations, that onnxruntime fuses at graph optimization time.
+
+        The network is set in evaluation mode and must not be trained anymore.
+
+        Returns
+        -------
+        GcnnNet
+            The network itself.
+        """
+        self.eval()
+        fuse_conv_bn(self)
+        for block in [*self.lpfs, self.post_process_block]:
+            for i, (bn, gc) in enumerate(zip(block.bns, block.gcs)):
+                if isinstance(bn, nn.BatchNorm2d):
+                    gc.fold_bn(bn)
+                    block.bns[i] = nn.Identity()
+        return self
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """Gcnn forward pass.
 
@@ -122,6 +194,8 @@ class GcnnNet(AbstractNet):
         no_metrics: bool = False,
         verbose: int = 1,
         profiler: BatchProfiler = None,
+        gate_threshold: float = None,
+        gate_statistic: str = "max",
     ) -> Tuple[torch.Tensor, list[Tuple[float, float]], float]:
         """Gcnn network inference.
 
@@ -142,6 +216,11 @@ class GcnnNet(AbstractNet):
 
         profiler: BatchProfiler
             The profiler object to record batch inference time.
+        gate_threshold: float
+            If not None, only crops whose ``gate_statistic`` exceeds this value
+            are forwarded to the network. The other crops output zeros.
+        gate_statistic: str
+            The per crop statistic used for gating. Available options max | rms.
 
         Returns
         -------
@@ -157,18 +236,33 @@ class GcnnNet(AbstractNet):
         # shouldn't be possible to call the inference without `to_crops()` and
         # `to_planes()` methods
         generator.to_crops()
-        test_loader = torch.utils.data.DataLoader(
-            dataset=generator,
-            batch_size=generator.batch_size,
-        )
+
+        noisy = generator.noisy
+        if gate_threshold is not None:
+            mask = tiles_gate_mask(noisy, gate_threshold, gate_statistic)
+            skip_ratio = 1 - mask.float().mean().item()
+            logger.info(f"Gating skips {100 * skip_ratio:.1f}% of the crops")
+            noisy = noisy[mask]
+
+        test_loader = BatchIterator(noisy, generator.batch_size)
 
         # inference pass
         start = tm()
-        output = gcnn_inference_pass(test_loader, self, dev, verbose, profiler=profiler)
+        if gate_threshold is None:
+            output = gcnn_inference_pass(
+                test_loader, self, dev, verbose, profiler=profiler
+            )
+        else:
+            # scatter network outputs back, skipped crops are set to zero
+            output = torch.zeros_like(generator.noisy)
+            if len(noisy) > 0:
+                output[mask] = gcnn_inference_pass(
+                    test_loader, self, dev, verbose, profiler=profiler
+                )
         inference_time = tm() - start
 
         # convert back to planes
-        y_pred = generator.converter.tiles2planes(output)
+        y_pred = generator.converter.tiles2planes(output, generator.planes_shape)
         generator.to_planes()
 
         if no_metrics:
@@ -241,24 +335,148 @@ class GcnnNet(AbstractNet):
         step_logs.update({"loss": loss.item()})
         return step_logs
 
-    def onnx_export(self, fname: Path):
+    def onnx_export(
+        self,
+        fname: Path,
+        planes_shape: Tuple[int] = None,
+        threshold: float = None,
+        batch_size: int = None,
+    ):
         """Export model to ONNX format.
 
         Parameters
         ----------
         fname: Path
             The path to save the `.onnx` network.
+        planes_shape: Tuple[int]
+            If given, exports the whole-plane network taking a single input
+            plane of shape=(1,C,H,W), see ``GcnnPlanesNet``. Otherwise, exports
+            the network acting on tiles, with a dynamic batch axis.
+        threshold: float
+            The whole-plane network output threshold. Ignored for the tiles
+            network.
+        batch_size: int
+            The number of tiles processed at once by the whole-plane network.
+            Ignored for the tiles network.
         """
-        # produce dummy inputs
-        inputs = torch.randn(1, 1, *self.crop_size)
+        if planes_shape is None:
+            network = self
+            # produce dummy inputs
+            inputs = torch.randn(1, 1, *self.crop_size)
+            dynamic_axes = {"input": {0: "batch_size"}, "output": {0: "batch_size"}}
+        else:
+            self.eval()
+            network = GcnnPlanesNet(self, planes_shape[-2:], threshold, batch_size)
+            inputs = torch.randn(1, *planes_shape[1:])
+            # tiles batches are unrolled for a single plane: static shapes
+            dynamic_axes = None
 
         # export network
         torch.onnx.export(
-            self,
+            network,
             inputs,
             fname,
             verbose=False,
             input_names=["input"],
             output_names=["output"],
-            dynamic_axes={"input": {0: "batch_size"}, "output": {0: "batch_size"}},
+            dynamic_axes=dynamic_axes,
         )
+
+
+class GcnnPlanesNet(nn.Module):
+    """Whole-plane wrapper of CNN and GCNN networks.
+
+    Chains median subtraction, padding, tiling, the network forward pass,
+    untiling and the optional output thresholding in a single module. Every
+    step is written with plain tensor operations, so the wrapper can be
+    exported to a single ONNX graph. Plane dimensions are fixed at
+    construction, so tiling reshapes are static.
+
+    Tiles go through the network in batches of ``batch_size``, bounding the
+    memory of the k-NN search. The batches loop is unrolled in the ONNX graph,
+    which is exported for a single plane.
+    """
+
+    def __init__(
+        self,
+        network: GcnnNet,
+        plane_size: Tuple[int],
+        threshold: float = None,
+        batch_size: int = None,
+    ):
+        """
+        Parameters
+        ----------
+        network: GcnnNet
+            The network acting on tiles.
+        plane_size: Tuple[int]
+            The input planes dimensions: (H,W).
+        threshold: float
+            If given, output values whose absolute value does not exceed the
+            threshold are put to zero.
+        batch_size: int
+            The number of tiles in each network forward pass. If None, all the
+            tiles are processed at once.
+        """
+        super().__init__()
+        self.network = network
+        self.plane_size = plane_size
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.pad = calculate_pad((1, 1, *plane_size), network.crop_size)
+        # static mask of the plane interior within the padded plane
+        interior = torch.ones(1, 1, *plane_size, dtype=torch.bool)
+        self.register_buffer("interior", F.pad(interior, self.pad), persistent=False)
+
+    def forward(self, planes: torch.Tensor) -> torch.Tensor:
+        """Denoises the input planes.
+
+        Parameters
+        ----------
+        planes: torch.Tensor
+            Raw planes, of shape=(N,C,H,W).
+
+        Returns
+        -------
+        torch.Tensor
+            Output planes, of shape=(N,C',H,W).
+        """
+        edge_h, edge_w = self.network.crop_size
+        height, width = self.plane_size
+        nb_channels = planes.shape[1]
+        pad = self.pad
+        a_x = (height + pad[2] + pad[3]) // edge_h
+        a_y = (width + pad[0] + pad[1]) // edge_w
+
+        # median as mean of the two central values, as ``np.median``
+        values = planes.flatten(1).sort(dim=1)[0]
+        nb_values = values.shape[1]
+        medians = 0.5 * (values[:, (nb_values - 1) // 2] + values[:, nb_values // 2])
+        planes = planes - medians.view(-1, 1, 1, 1)
+
+        # pad each plane with its own mean, as ``Converter.planes2tiles``,
+        # leaving the interior values untouched
+        mean = planes.mean(dim=(1, 2, 3), keepdim=True)
+        planes = torch.where(self.interior, F.pad(planes, pad), mean)
+        tiles = planes.reshape(-1, nb_channels, a_x, edge_h, a_y, edge_w)
+        tiles = tiles.permute(0, 2, 4, 1, 3, 5).reshape(-1, nb_channels, edge_h, edge_w)
+
+        if self.batch_size is None:
+            out = self.network(tiles)
+        else:
+            out = torch.cat(
+                [
+                    self.network(tiles[start : start + self.batch_size])
+                    for start in range(0, tiles.shape[0], self.batch_size)
+                ]
+            )
+
+        nb_channels = out.shape[1]
+        out = out.reshape(-1, a_x, a_y, nb_channels, edge_h, edge_w)
+        out = out.permute(0, 3, 1, 4, 2, 5)
+        out = out.reshape(-1, nb_channels, a_x * edge_h, a_y * edge_w)
+        out = out[..., pad[2] : pad[2] + height, pad[0] : pad[0] + width]
+
+        if self.threshold is not None:
+            out = out * (out.abs() > self.threshold).to(out.dtype)
+        return out
@@ -3,8 +3,12 @@
 """
 import torch
 from torch import nn
+from dunedn.networks.utils import bn_scale_shift, scale_layer
 from dunedn.networks.gcnn.gcnn_net_utils import (
     pairwise_dist,
+    blocked_pairwise_dist,
+    window_dist,
+    window_neighbours,
     batched_index_select,
     local_mask,
 )
@@ -140,15 +144,67 @@ class PostProcessBlock(nn.Module):
 class NonLocalGraph:
     """Non-local graph layer."""
 
-    def __init__(self, k, crop_size):
+    def __init__(
+        self,
+        k,
+        crop_size,
+        reduce_neighbours=False,
+        max_memory=None,
+        strategy="exact",
+        window=5,
+    ):
         """
         Parameters
         ----------
             - k: int, nearest neighbor number.
             - crop_size: tuple, (edge_h, edge_w)
+            - reduce_neighbours: bool, wether to return the neighbours
+              differences averaged over the K axis
+            - max_memory: float, memory budget in MB for the exact k-NN search.
+              If None, the dense distance matrix is computed at once
+            - strategy: str, k-NN search strategy. Available options:
+
+                - exact: neighbours are searched over the whole crop
+                - window: approximate search within ``window`` pixels from
+                  each pixel
+
+            - window: int, search window half size for the window strategy
+
+        Raises
+        ------
+            - NotImplementedError if strategy is not in ['exact', 'window']
+            - ValueError if the search window holds less than k candidates
         """
         self.k = k
+        self.crop_size = crop_size
         self.local_mask = local_mask(crop_size)
+        self.reduce_neighbours = reduce_neighbours
+        self.max_memory = max_memory
+        if strategy not in ["exact", "window"]:
+            raise NotImplementedError(f"k-NN strategy not implemented, got {strategy}")
+        self.strategy = strategy
+        # corner pixels have the fewest candidates in the window
+        if strategy == "window" and (window + 1) ** 2 - 3 < k:
+            raise ValueError(
+                f"Search window of half size {window} too small for k={k} neighbours"
+            )
+        self.window = window_neighbours(crop_size, window)
+
+    def knn(self, arr):
+        """
+        Parameters
+        ----------
+            - arr: torch.Tensor, input tensor of shape=(N,H*W,C)
+
+        Returns
+        -------
+            - torch.Tensor, nearest neighbors indices of shape=(N,H*W,K)
+        """
+        if self.strategy == "window":
+            return window_dist(arr, self.k, self.crop_size, self.window)
+        if self.max_memory is None:
+            return pairwise_dist(arr, self.k, self.local_mask)
+        return blocked_pairwise_dist(arr, self.k, self.local_mask, self.max_memory)
 
     def __call__(self, arr):
         """
@@ -158,16 +214,22 @@ class NonLocalGraph:
 
         Returns
         -------
-            - torch.Tensor, output tensor of shape=(N,H*W*K,C)
+            - torch.Tensor, output tensor of shape=(N,H*W,K,C) or (N,H*W,C) if
+              ``reduce_neighbours`` is True
         """
-        arr = arr.data.permute(0, 2, 3, 1)
+        # detach, not .data: tracing records .data as a constant, freezing the
+        # graph built from the tracing input
+        arr = arr.detach().permute(0, 2, 3, 1)
         b, h, w, f = arr.shape
         arr = arr.view(b, h * w, f)
         hw = h * w
-        dists = pairwise_dist(arr, self.k, self.local_mask)
+        dists = self.knn(arr)
         selected = batched_index_select(arr, 1, dists.view(dists.shape[0], -1)).view(
             b, hw, self.k, f
         )
+        if self.reduce_neighbours:
+            # mean of differences is the difference with the neighbours mean
+            return arr - torch.mean(selected, dim=-2)
         diff = arr.unsqueeze(2) - selected
         return diff
 
@@ -219,6 +281,19 @@ class GConv(nn.Module):
     def forward(self, x, graph):
         return torch.mean(torch.stack([self.conv1(x), self.nla(x, graph)]), dim=0)
 
+    def fold_bn(self, bn):
+        """
+        Folds a following batch normalization layer into the layer weights.
+
+        Parameters
+        ----------
+            - bn: nn.BatchNorm2d, the batch normalization layer
+        """
+        scale, shift = bn_scale_shift(bn)
+        # both branches are shifted, so that their mean is shifted as well
+        scale_layer(self.conv1, scale, shift)
+        self.nla.fold_bn(scale, shift)
+
 
 class Conv(nn.Module):
     """GConv layer."""
@@ -238,6 +313,19 @@ class Conv(nn.Module):
     def forward(self, x, graph):
         return torch.mean(torch.stack([self.conv1(x), self.conv2(x)]), dim=0)
 
+    def fold_bn(self, bn):
+        """
+        Folds a following batch normalization layer into the layer weights.
+
+        Parameters
+        ----------
+            - bn: nn.BatchNorm2d, the batch normalization layer
+        """
+        scale, shift = bn_scale_shift(bn)
+        # both branches are shifted, so that their mean is shifted as well
+        scale_layer(self.conv1, scale, shift)
+        scale_layer(self.conv2, scale, shift)
+
 
 class NonLocalAggregator(nn.Module):
     """NonLocalAggregator layer."""
@@ -259,7 +347,8 @@ class NonLocalAggregator(nn.Module):
         Parameters
         ----------
             - x: torch.Tensor, of shape=(N,C,H,W)
-            - graph: torch.Tensor
+            - graph: torch.Tensor, neighbours differences of shape=(N,H*W,K,C)
+              or their mean over K, of shape=(N,H*W,C)
 
         Returns
         -------
@@ -270,9 +359,28 @@ class NonLocalAggregator(nn.Module):
         x = x.view(b, h * w, f)
 
         # closest_graph = get_graph(x, self.k, local_mask) #this builds the graph
-        agg_weights = self.diff_fc(graph)  # look closer
+        if graph.dim() == 4:
+            # neighbours differences, of shape=(N,H*W,K,C)
+            agg_weights = torch.mean(self.diff_fc(graph), dim=-2)  # look closer
+        else:
+            # the layer is affine: averaging over K first gives the same result
+            # with K times fewer multiply-adds
+            agg_weights = self.diff_fc(graph)
         agg_self = self.w_self(x)
 
-        x_new = torch.mean(agg_weights, dim=-2) + agg_self  # + self.bias
+        x_new = agg_weights + agg_self  # + self.bias
 
         return x_new.view(b, h, w, x_new.shape[-1]).permute(0, 3, 1, 2)
+
+    def fold_bn(self, scale, shift):
+        """
+        Multiplies the layer outputs by ``scale`` and adds ``shift``.
+
+        Parameters
+        ----------
+            - scale: torch.Tensor, per channel scale of shape=(C,)
+            - shift: torch.Tensor, per channel shift of shape=(C,)
+        """
+        # outputs are the sum of the two projections: shift only one of them
+        scale_layer(self.diff_fc, scale)
+        scale_layer(self.w_self, scale, shift)
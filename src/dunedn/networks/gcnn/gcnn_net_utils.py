@@ -33,6 +33,121 @@ def pairwise_dist(arr, k, local_mask):
     return d.topk(k=k, dim=-1)[1]  # (B,N,K)
 
 
+def blocked_pairwise_dist(arr, k, local_mask, max_memory):
+    """
+    Computes the same nearest neighbors as ``pairwise_dist`` in blocks of query
+    pixels, bounding the peak memory of the distance matrix.
+
+    Each block holds complete distance rows, so the top-k selection of every
+    pixel is computed on exactly the same values as in the dense version.
+
+    Parameters
+    ----------
+        - arr: torch.Tensor, of shape=(N,H*W,C)
+        - k: int, nearest neighbor number
+        - local_mask: torch.Tensor, of shape=(1,H*W,H*W)
+        - max_memory: float, memory budget in MB for the distance blocks
+
+    Returns
+    -------
+        - torch.Tensor, nearest neighbors indices of shape=(N,H*W,K)
+    """
+    dev = arr.get_device()
+    dev = "cpu" if dev == -1 else dev
+    local_mask = local_mask.to(dev)
+    b, nb_pixels, _ = arr.shape
+    # product, distances and masked distances are alive at the same time
+    row_bytes = 3 * b * nb_pixels * arr.element_size()
+    block = max(1, int(max_memory * 2**20) // row_bytes)
+    r_arr = torch.sum(arr * arr, dim=2, keepdim=True)  # (B,N,1)
+    arr_t = arr.permute(0, 2, 1)
+    r_arr_t = r_arr.permute(0, 2, 1)
+    idxs = []
+    for start in range(0, nb_pixels, block):
+        end = min(start + block, nb_pixels)
+        mul = torch.matmul(arr[:, start:end], arr_t)  # (B,block,N)
+        d = -(r_arr[:, start:end] - 2 * mul + r_arr_t)  # (B,block,N)
+        mask = local_mask[:, start:end]
+        d = d * mask - (1 - mask)
+        idxs.append(d.topk(k=k, dim=-1)[1])
+        del mul, d
+    return torch.cat(idxs, dim=1)  # (B,N,K)
+
+
+def window_neighbours(crop_size, radius):
+    """
+    Computes the candidate neighbours of each pixel within a square search
+    window centered on it.
+
+    Consistently with ``local_mask``, the 8 adjacent pixels are excluded, while
+    the pixel itself is a candidate.
+
+    Parameters
+    ----------
+        - crop_size: tuple, (H,W)
+        - radius: int, half size of the search window
+
+    Returns
+    -------
+        - list, the (dy,dx) window offsets of length M
+        - torch.Tensor, candidate neighbours flat indices of shape=(H*W,M)
+        - torch.Tensor, boolean mask of candidates inside the crop, of
+          shape=(H*W,M)
+    """
+    x, y = crop_size
+    steps = torch.arange(-radius, radius + 1)
+    dy, dx = torch.meshgrid(steps, steps, indexing="ij")
+    dy, dx = dy.flatten(), dx.flatten()
+    keep = (dy.abs() > 1) | (dx.abs() > 1) | ((dy == 0) & (dx == 0))
+    dy, dx = dy[keep], dx[keep]
+
+    rows = torch.arange(x).repeat_interleave(y).unsqueeze(1) + dy  # (H*W,M)
+    cols = torch.arange(y).repeat(x).unsqueeze(1) + dx  # (H*W,M)
+    valid = (rows >= 0) & (rows < x) & (cols >= 0) & (cols < y)
+    idxs = rows.clamp(0, x - 1) * y + cols.clamp(0, y - 1)
+    offsets = list(zip(dy.tolist(), dx.tolist()))
+    return offsets, idxs, valid
+
+
+def window_dist(arr, k, crop_size, window):
+    """
+    Approximates ``pairwise_dist`` restricting the nearest neighbors search to
+    a square window around each pixel.
+
+    The cost scales with the window area M instead of the number of pixels in
+    the crop.
+
+    Parameters
+    ----------
+        - arr: torch.Tensor, of shape=(N,H*W,C)
+        - k: int, nearest neighbor number
+        - crop_size: tuple, (H,W)
+        - window: tuple, the output of ``window_neighbours``
+
+    Returns
+    -------
+        - torch.Tensor, nearest neighbors indices of shape=(N,H*W,K)
+    """
+    offsets, idxs, valid = window
+    dev = arr.get_device()
+    dev = "cpu" if dev == -1 else dev
+    b, hw, c = arr.shape
+    h, w = crop_size
+    radius = max(max(abs(dy), abs(dx)) for dy, dx in offsets)
+
+    x = arr.view(b, h, w, c).permute(0, 3, 1, 2)  # (B,C,H,W)
+    padded = F.pad(x, (radius,) * 4)
+    d = []
+    for dy, dx in offsets:
+        top, left = radius + dy, radius + dx
+        shifted = padded[:, :, top : top + h, left : left + w]
+        d.append(-torch.sum((x - shifted) ** 2, dim=1))
+    d = torch.stack(d, dim=-1).view(b, hw, -1)  # (B,N,M)
+    d = d.masked_fill(~valid.to(dev), float("-inf"))
+    selected = d.topk(k=k, dim=-1)[1]  # (B,N,K)
+    return torch.gather(idxs.to(dev).expand(b, -1, -1), 2, selected)
+
+
 def batched_index_select(t, dim, inds):
     """
     Selects K nearest neighbors indices for each pixel respecting batch dimension.
@@ -109,6 +224,47 @@ def local_mask(crop_size):
     return local_mask.unsqueeze(0)
 
 
+def tiles_gate_mask(
+    tiles: torch.Tensor, threshold: float, statistic: str = "max"
+) -> torch.Tensor:
+    """
+    Selects the tiles carrying enough input energy to be worth a forward pass.
+
+    Median subtracted tiles containing only noise produce outputs that are
+    zeroed by the inference thresholding anyway.
+
+    Parameters
+    ----------
+    tiles: torch.Tensor
+        Tiles, of shape=(N,C,edge_h,edge_w).
+    threshold: float
+        The statistic value above which a tile is selected.
+    statistic: str
+        The per tile statistic. Available options max | rms:
+
+        - max: maximum absolute ADC value.
+        - rms: root mean square of the ADC values.
+
+    Returns
+    -------
+    torch.Tensor
+        The boolean selection mask, of shape=(N,).
+
+    Raises
+    ------
+    NotImplementedError
+        If ``statistic`` is not in ["max", "rms"].
+    """
+    flat = tiles.reshape(len(tiles), -1)
+    if statistic == "max":
+        stat = flat.abs().amax(dim=-1)
+    elif statistic == "rms":
+        stat = flat.square().mean(dim=-1).sqrt()
+    else:
+        raise NotImplementedError(f"Gate statistic not implemented, got {statistic}")
+    return stat > threshold
+
+
 def calculate_pad(plane_size, crop_size):
     """
     Given plane and crop shape, compute the needed padding to obtain exact
@@ -144,7 +300,13 @@ def calculate_pad(plane_size, crop_size):
 
 
 class Converter:
-    """Groups image to tiles converter functions"""
+    """Groups image to tiles converter functions.
+
+    Tiles are extracted from strided views of the padded planes. Each plane is
+    padded with its own mean, so that the tiles of a plane do not depend on the
+    other planes in the batch. The converter holds no state besides the tile
+    size, so it can be shared across threads.
+    """
 
     def __init__(self, crop_size: Tuple[int]):
         """
@@ -160,7 +322,7 @@ class Converter:
         Parameters
         ----------
         planes: torch.Tensor
-            Planes, of shape=(N,C,W,H).
+            Planes, of shape=(N,C,H,W).
 
         Returns
         -------
@@ -169,43 +331,49 @@ class Converter:
             With ``N' = N * ceil(H/edge_h) * ceil(W/edge_w)``
         """
         edge_h, edge_w = self.crop_size
-        nb_channels = planes.shape[1]
-        self.pad = calculate_pad(planes.shape, self.crop_size)
-        planes = F.pad(planes, self.pad, mode="constant", value=planes.mean())
-
-        splits = torch.stack(torch.split(planes, edge_w, -1), 1)
-        splits = torch.stack(torch.split(splits, edge_h, -2), 1)
-
-        self.splits_shape = splits.shape
-
-        return splits.view(-1, nb_channels, edge_h, edge_w)
-
-    def tiles2planes(self, splits: torch.Tensor) -> torch.Tensor:
+        nb_planes, nb_channels, height, width = planes.shape
+        pad = calculate_pad(planes.shape, self.crop_size)
+        padded = planes.new_empty(
+            nb_planes, nb_channels, height + pad[2] + pad[3], width + pad[0] + pad[1]
+        )
+        padded.copy_(planes.mean(dim=(1, 2, 3), keepdim=True).expand_as(padded))
+        padded[..., pad[2] : pad[2] + height, pad[0] : pad[0] + width] = planes
+        planes = padded
+
+        # (N,C,a_x,a_y,edge_h,edge_w) view, copied once by the reshape
+        tiles = planes.unfold(2, edge_h, edge_h).unfold(3, edge_w, edge_w)
+        tiles = tiles.permute(0, 2, 3, 1, 4, 5)
+        return tiles.reshape(-1, nb_channels, edge_h, edge_w)
+
+    def tiles2planes(
+        self, tiles: torch.Tensor, planes_shape: Tuple[int]
+    ) -> torch.Tensor:
         """
         Parameters
         ----------
-        splits: torch.Tensor
-            Tiles, of shape (N',C,edge_h,edge_w).
+        tiles: torch.Tensor
+            Tiles, of shape (N',C',edge_h,edge_w).
+        planes_shape: Tuple[int]
+            The shape of the planes the tiles were extracted from: (N,C,H,W).
+            The number of channels C' of the tiles may differ from C.
 
         Returns
         -------
         torch.Tensor
-            Planes, of shape=(N,C,H,W).
+            Planes, of shape=(N,C',H,W).
         """
-        b, a_x, a_y, nb_channels, p_x, p_y = self.splits_shape
-        nb_channels = splits.shape[1]
-        splits_shape = (b, a_x, a_y, nb_channels, p_x, p_y)
-
-        splits = splits.reshape(splits_shape)
-        splits = splits.permute(0, 1, 4, 3, 2, 5)
-        img = splits.reshape(-1, a_x * p_x, nb_channels, a_y * p_y)
-        img = img.permute(0, 2, 1, 3)
-
-        output_shape = (
-            slice(None),
-            slice(None),
-            slice(self.pad[-2], -self.pad[-1]),
-            slice(self.pad[0], -self.pad[1]),
+        edge_h, edge_w = self.crop_size
+        nb_planes, _, height, width = planes_shape
+        nb_channels = tiles.shape[1]
+        pad = calculate_pad(planes_shape, self.crop_size)
+        a_x = (height + pad[2] + pad[3]) // edge_h
+        a_y = (width + pad[0] + pad[1]) // edge_w
+
+        # write tiles straight into the padded planes buffer
+        planes = tiles.new_empty(nb_planes, nb_channels, a_x * edge_h, a_y * edge_w)
+        planes.view(nb_planes, nb_channels, a_x, edge_h, a_y, edge_w).copy_(
+            tiles.reshape(nb_planes, a_x, a_y, nb_channels, edge_h, edge_w).permute(
+                0, 3, 1, 4, 2, 5
+            )
         )
-
-        return img[output_shape]
+        return planes[..., pad[2] : pad[2] + height, pad[0] : pad[0] + width]
@@ -2,9 +2,10 @@
 import logging
 from pathlib import Path
 import torch
-from .gcnn_dataloading import GcnnDataset
+from .gcnn_dataloading import GcnnCropSamplingDataset, GcnnDataset
 from .gcnn_net import GcnnNet
 from .utils import make_dict_compatible
+from ..utils import no_weight_init
 from dunedn import PACKAGE
 from dunedn.training.losses import get_loss
 from dunedn.training.metrics import DN_METRICS
@@ -31,8 +32,12 @@ def load_and_compile_gcnn_network(
     network: GcnnNet
         The loaded neural network.
     """
-
-    network = GcnnNet(**msetup["net_dict"])
+    if checkpoint_filepath:
+        # weights are overwritten by the checkpoint: skip initialization
+        with no_weight_init():
+            network = GcnnNet(**msetup["net_dict"])
+    else:
+        network = GcnnNet(**msetup["net_dict"])
 
     if checkpoint_filepath:
         logger.info(f"Loading weights at {checkpoint_filepath}")
@@ -78,7 +83,12 @@ def gcnn_training(modeltype: str, setup: dict):
         "channel": channel,
         "dsetup": setup["dataset"],
     }
-    train_generator = GcnnDataset(
+    # crops are either precomputed or sampled from planes at each epoch
+    if setup["dataset"].get("sample_crops", False):
+        train_dataset_cls = GcnnCropSamplingDataset
+    else:
+        train_dataset_cls = GcnnDataset
+    train_generator = train_dataset_cls(
         "train", batch_size=msetup["batch_size"], **gen_kwargs
     )
     val_generator = GcnnDataset(
@@ -94,6 +104,7 @@ def gcnn_training(modeltype: str, setup: dict):
         epochs=setup["model"]["epochs"],
         val_generator=val_generator,
         dev=setup["dev"],
+        num_workers=setup["dataset"].get("num_workers", 0),
     )
 
     # testing
@@ -1,5 +1,6 @@
 """This module implements utility functions for the `networks.gcnn` subpackage."""
 from collections import OrderedDict
+from collections.abc import Iterable
 from dunedn.networks.utils import BatchProfiler
 from tqdm.auto import tqdm
 import torch
@@ -56,7 +57,7 @@ def make_dict_compatible(state_dict: OrderedDict):
 
 
 def gcnn_inference_pass(
-    test_loader: torch.utils.data.DataLoader,
+    test_loader: Iterable,
     network: AbstractNet,
     dev: str,
     verbose: int = 1,
@@ -66,8 +67,9 @@ def gcnn_inference_pass(
 
     Parameters
     ----------
-    test_loader: torch.utils.data.DataLoader
-        The inference dataset generator.
+    test_loader: Iterable
+        The inference batches, as ``(inputs, labels)`` pairs. For example a
+        ``BatchIterator`` or a ``torch.utils.data.DataLoader``.
     network: AbstractNet
         The denoising network.
     dev: str
@@ -87,14 +89,17 @@ def gcnn_inference_pass(
         Denoised data, of shape=(N,1,H,W).
     """
     network.eval()
+    # networks already pinned on `dev` are not moved around
+    network_dev = next(network.parameters()).device
     network.to(dev)
     outs = []
     wrap = tqdm(test_loader, desc="gcnn.predict") if verbose else test_loader
     if profiler is not None:
         wrap = profiler.set_iterable(wrap)
-    for noisy, _ in wrap:
-        out = network(noisy.to(dev)).detach().cpu()
-        outs.append(out)
+    with torch.no_grad():
+        for noisy, _ in wrap:
+            out = network.inference_module(noisy.to(dev)).cpu()
+            outs.append(out)
     output = torch.cat(outs)
-    network.to("cpu")
+    network.to(network_dev)
     return output
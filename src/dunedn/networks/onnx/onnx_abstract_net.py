@@ -1,13 +1,22 @@
+import os
 from typing import Callable
 from pathlib import Path
 import onnxruntime as ort
 from dunedn.training.metrics import MetricsList
+from .utils import get_session_options
 
 
 class OnnxNetwork(ort.InferenceSession):
     """Subclass"""
 
-    def __init__(self, ckpt: Path, metrics: MetricsList, providers: list[str] = None):
+    def __init__(
+        self,
+        ckpt: Path,
+        metrics: MetricsList,
+        providers: list[str] = None,
+        session_options: dict = None,
+        cache_optimized_graph: bool = False,
+    ):
         """
         Parameters
         ----------
@@ -17,6 +26,38 @@ class OnnxNetwork(ort.InferenceSession):
             List of callable metrics.
         providers: list[str]
             List of providers.
+        session_options: dict
+            The onnxruntime session settings, see ``get_session_options``.
+        cache_optimized_graph: bool
+            Wether to save the optimized graph in a `.opt.onnx` file next to
+            ``ckpt``. When an up to date file exists, it is loaded with graph
+            optimizations disabled. The optimized graph may contain hardware
+            specific operators: share it between workers with the same
+            providers and hardware only.
         """
-        super().__init__(ckpt, providers=providers)
+        sess_options = get_session_options(session_options)
+        model_path = Path(ckpt)
+        opt_path = model_path.with_suffix(".opt.onnx")
+        tmp_path = None
+        if cache_optimized_graph:
+            if is_up_to_date(opt_path, model_path):
+                model_path = opt_path
+                sess_options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                )
+            else:
+                # concurrent workers must not read a partially written graph
+                tmp_path = opt_path.with_suffix(f".{os.getpid()}.tmp")
+                sess_options.optimized_model_filepath = tmp_path.as_posix()
+
+        super().__init__(
+            model_path.as_posix(), sess_options=sess_options, providers=providers
+        )
+        if tmp_path is not None:
+            os.replace(tmp_path, opt_path)
         self.metrics = metrics
+
+
+def is_up_to_date(target: Path, source: Path) -> bool:
+    """Wether the ``target`` file exists and is newer than ``source``."""
+    return target.is_file() and target.stat().st_mtime >= source.stat().st_mtime
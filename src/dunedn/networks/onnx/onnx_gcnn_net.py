@@ -1,16 +1,25 @@
 from pathlib import Path
 from dunedn.networks.utils import BatchProfiler
+import numpy as np
 import torch
 from ..gcnn.gcnn_dataloading import GcnnDataset
 from .onnx_abstract_net import OnnxNetwork
-from .utils import gcnn_onnx_inference_pass
+from .utils import gcnn_onnx_binding_pass, np_planes2tiles, np_tiles2planes
 from dunedn.training.metrics import MetricsList
+from dunedn.utils.utils import median_subtraction
 
 
 class OnnxGcnnNetwork(OnnxNetwork):
     """Subclass"""
 
-    def __init__(self, ckpt: Path, metrics: MetricsList, providers: list[str] = None):
+    def __init__(
+        self,
+        ckpt: Path,
+        metrics: MetricsList,
+        providers: list[str] = None,
+        session_options: dict = None,
+        cache_optimized_graph: bool = False,
+    ):
         """
         Parameters
         ----------
@@ -20,8 +29,20 @@ class OnnxGcnnNetwork(OnnxNetwork):
             List of callable metrics.
         providers: list[str]
             List of providers.
+        session_options: dict
+            The onnxruntime session settings.
+        cache_optimized_graph: bool
+            Wether to save and reuse the optimized graph.
         """
-        super().__init__(ckpt, metrics, providers=providers)
+        super().__init__(
+            ckpt,
+            metrics,
+            providers=providers,
+            session_options=session_options,
+            cache_optimized_graph=cache_optimized_graph,
+        )
+        # the network input has shape=(N,C,edge_h,edge_w)
+        self.crop_size = tuple(self.get_inputs()[0].shape[-2:])
 
     def predict(
         self, generator: GcnnDataset, profiler: BatchProfiler = None
@@ -41,11 +62,128 @@ class OnnxGcnnNetwork(OnnxNetwork):
             Output tensor of shape=(N,C,H,W).
         """
         generator.to_crops()
-        test_loader = torch.utils.data.DataLoader(
-            dataset=generator,
-            batch_size=generator.batch_size,
+        # numpy views share the tensors memory
+        output = gcnn_onnx_binding_pass(
+            generator.noisy.numpy(), self, generator.batch_size, profiler=profiler
+        )
+        y_pred = generator.converter.tiles2planes(
+            torch.from_numpy(output), generator.planes_shape
         )
-        output = gcnn_onnx_inference_pass(test_loader, self, profiler=profiler)
-        y_pred = generator.converter.tiles2planes(output)
         generator.to_planes()
         return y_pred
+
+    def predict_numpy(
+        self, planes: np.ndarray, batch_size: int, verbose: int = 0
+    ) -> np.ndarray:
+        """ONNX GCNN network inference on numpy planes.
+
+        The whole data path, from median subtraction to tiling and network
+        inference, is implemented with numpy and onnxruntime only.
+
+        Parameters
+        ----------
+        planes: np.ndarray
+            The noisy planes, of shape=(N,C,H,W).
+        batch_size: int
+            The number of tiles in each batch.
+        verbose: int
+            Switch to log information. Defaults to 0.
+
+        Returns
+        -------
+        np.ndarray
+            Denoised planes, of shape=(N,C,H,W).
+        """
+        planes = median_subtraction(planes.astype(np.float32))
+        tiles = np_planes2tiles(planes, self.crop_size)
+        output = gcnn_onnx_binding_pass(tiles, self, batch_size, verbose=verbose)
+        return np_tiles2planes(output, planes.shape, self.crop_size)
+
+
+class OnnxGcnnPlanesNetwork(OnnxNetwork):
+    """Whole-plane ONNX CNN or GCNN network.
+
+    The graph, exported from ``GcnnPlanesNet``, takes a raw plane and contains
+    median subtraction, tiling, batched tiles inference, untiling and
+    thresholding: inference is a ``run`` call for each plane.
+    """
+
+    def __init__(
+        self,
+        ckpt: Path,
+        metrics: MetricsList,
+        providers: list[str] = None,
+        session_options: dict = None,
+        cache_optimized_graph: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        ckpt: Path
+            `.onnx` file path.
+        metrics: MetricsList
+            List of callable metrics.
+        providers: list[str]
+            List of providers.
+        session_options: dict
+            The onnxruntime session settings.
+        cache_optimized_graph: bool
+            Wether to save and reuse the optimized graph.
+        """
+        super().__init__(
+            ckpt,
+            metrics,
+            providers=providers,
+            session_options=session_options,
+            cache_optimized_graph=cache_optimized_graph,
+        )
+
+    def predict(
+        self, generator: GcnnDataset, profiler: BatchProfiler = None
+    ) -> torch.Tensor:
+        """ONNX whole-plane network inference.
+
+        Parameters
+        ----------
+        generator: GcnnDataset
+            The inference generator. Its planes are already median subtracted,
+            hence the in-graph median subtraction leaves them unchanged.
+        profiler: BatchProfiler
+            The profiler object to record the inference time of each plane.
+
+        Returns
+        -------
+        torch.Tensor
+            Output tensor of shape=(N,C,H,W).
+        """
+        planes = generator.noisy.numpy()
+        wrap = range(len(planes))
+        if profiler is not None:
+            wrap = profiler.set_iterable(wrap)
+        output = None
+        for i in wrap:
+            out = self.predict_numpy(planes[i : i + 1])
+            if output is None:
+                output = np.empty((len(planes),) + out.shape[1:], dtype=out.dtype)
+            output[i : i + 1] = out
+        return torch.from_numpy(output)
+
+    def predict_numpy(self, planes: np.ndarray) -> np.ndarray:
+        """ONNX whole-plane network inference on numpy planes.
+
+        Parameters
+        ----------
+        planes: np.ndarray
+            The raw planes, of shape=(N,C,H,W).
+
+        Returns
+        -------
+        np.ndarray
+            Output planes, of shape=(N,C,H,W).
+        """
+        planes = planes.astype(np.float32, copy=False)
+        # the graph takes a single plane
+        outputs = [
+            self.run(None, {"input": planes[i : i + 1]})[0] for i in range(len(planes))
+        ]
+        return np.concatenate(outputs)
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from pathlib import Path
+from typing import Type
+import torch
+from torch.utils.data import Dataset
+from dunedn.networks.utils import BatchProfiler
+from dunedn.training.metrics import MetricsList
+from .onnx_abstract_net import OnnxNetwork
+
+
+class OnnxSessionPool:
+    """Pool of ONNX sessions sharing one process.
+
+    The planes of a dataset are dispatched round-robin to the sessions, that
+    run concurrently on a thread pool: onnxruntime releases the GIL during
+    ``run``. Planes are tiled and padded independently of each other, so the
+    pooled outputs match the single session ones. Each session owns its
+    intra-op thread pool, whose size is bounded by ``session_threads``.
+
+    Example
+    -------
+
+    >>> from dunedn.networks.onnx.onnx_gcnn_net import OnnxGcnnNetwork
+    >>> from dunedn.networks.onnx.onnx_pool import OnnxSessionPool
+    >>> pool = OnnxSessionPool(OnnxGcnnNetwork, ckpt, metrics, 4, 2)
+    >>> output = pool.predict(generator)
+    """
+
+    def __init__(
+        self,
+        network_cls: Type[OnnxNetwork],
+        ckpt: Path,
+        metrics: MetricsList,
+        pool_size: int,
+        session_threads: int = None,
+        session_options: dict = None,
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        network_cls: Type[OnnxNetwork]
+            The class of the pooled sessions.
+        ckpt: Path
+            `.onnx` file path.
+        metrics: MetricsList
+            List of callable metrics.
+        pool_size: int
+            The number of sessions.
+        session_threads: int
+            The intra-op threads of each session. If None or 0, the
+            ``session_options`` setting is kept.
+        session_options: dict
+            The onnxruntime session settings, shared by all the sessions.
+        kwargs:
+            Additional ``network_cls`` keyword arguments.
+        """
+        session_options = dict(session_options or {})
+        if session_threads:
+            session_options["intra_op_num_threads"] = session_threads
+        self.sessions = [
+            network_cls(ckpt, metrics, session_options=session_options, **kwargs)
+            for _ in range(pool_size)
+        ]
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="dunedn-onnx"
+        )
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def predict(
+        self, generator: Dataset, profiler: BatchProfiler = None, **kwargs
+    ) -> torch.Tensor:
+        """Pooled ONNX network inference.
+
+        Parameters
+        ----------
+        generator: Dataset
+            The inference generator, holding the planes in the ``noisy``
+            attribute.
+        profiler: BatchProfiler
+            The profiler object to record batch inference time. Profiling is
+            not thread safe: profiled inference runs on the first session only.
+        kwargs:
+            Additional pooled sessions ``predict`` keyword arguments.
+
+        Returns
+        -------
+        torch.Tensor
+            Output tensor of shape=(N,C,H,W).
+        """
+        nb_planes = len(generator.noisy)
+        nb_sessions = min(len(self.sessions), nb_planes)
+        if profiler is not None or nb_sessions == 1:
+            return self.sessions[0].predict(generator, profiler=profiler, **kwargs)
+
+        # the session i processes planes i, i + nb_sessions, ...
+        futures = []
+        for i, session in enumerate(self.sessions[:nb_sessions]):
+            subset = copy(generator)
+            subset.noisy = generator.noisy[i::nb_sessions]
+            futures.append(self.executor.submit(session.predict, subset, **kwargs))
+        outputs = [future.result() for future in futures]
+
+        output = outputs[0].new_empty(nb_planes, *outputs[0].shape[1:])
+        for i, out in enumerate(outputs):
+            output[i::nb_sessions] = out
+        return output
@@ -0,0 +1,93 @@
+from pathlib import Path
+from dunedn.networks.utils import BatchIterator, BatchProfiler
+import numpy as np
+import torch
+from ..uscg.uscg_dataloading import UscgDataset
+from .onnx_abstract_net import OnnxNetwork
+from .utils import uscg_onnx_inference_pass
+from dunedn.training.metrics import MetricsList
+
+
+class OnnxUscgNetwork(OnnxNetwork):
+    """Subclass"""
+
+    def __init__(
+        self,
+        ckpt: Path,
+        metrics: MetricsList,
+        w: int,
+        stride: int,
+        providers: list[str] = None,
+        session_options: dict = None,
+        cache_optimized_graph: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        ckpt: Path
+            `.onnx` file path.
+        metrics: MetricsList
+            List of callable metrics.
+        w: int
+            Width of the time windows the network was exported with.
+        stride: int
+            Steps between time windows.
+        providers: list[str]
+            List of providers.
+        session_options: dict
+            The onnxruntime session settings.
+        cache_optimized_graph: bool
+            Wether to save and reuse the optimized graph.
+        """
+        super().__init__(
+            ckpt,
+            metrics,
+            providers=providers,
+            session_options=session_options,
+            cache_optimized_graph=cache_optimized_graph,
+        )
+        self.w = w
+        self.stride = stride
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        """Runs the network on a batch of time windows.
+
+        Parameters
+        ----------
+        x: torch.Tensor
+            Input tensor of shape=(N,C,H,w).
+
+        Returns
+        -------
+        torch.Tensor
+            Output tensor of shape=(N,C,H,w).
+        """
+        out = self.run(None, {"input": x.numpy().astype(np.float32)})[0]
+        return torch.from_numpy(out)
+
+    def predict(
+        self,
+        generator: UscgDataset,
+        profiler: BatchProfiler = None,
+        batch_windows: bool = False,
+    ) -> torch.Tensor:
+        """ONNX USCG network inference.
+
+        Parameters
+        ----------
+        generator: UscgDataset
+            The inference generator.
+        profiler: BatchProfiler
+            The profiler object to record batch inference time.
+        batch_windows: bool
+            Wether to forward all the time windows of a batch at once.
+
+        Returns
+        -------
+        torch.Tensor
+            Output tensor of shape=(N,C,H,W).
+        """
+        test_loader = BatchIterator(generator.noisy, generator.batch_size)
+        return uscg_onnx_inference_pass(
+            test_loader, self, profiler=profiler, batch_windows=batch_windows
+        )
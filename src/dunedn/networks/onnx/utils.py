@@ -1,12 +1,74 @@
+from collections.abc import Iterable
+from typing import Tuple
 from dunedn.networks.utils import BatchProfiler
 from tqdm.auto import tqdm
 import numpy as np
 import torch
 import onnxruntime as ort
+from ..gcnn.gcnn_net_utils import calculate_pad
+from ..uscg.utils import forward_windows
+
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def get_session_options(options: dict = None) -> ort.SessionOptions:
+    """Builds the onnxruntime session options from a settings dictionary.
+
+    Keys are ``ort.SessionOptions`` attribute names, for example
+    ``intra_op_num_threads``, ``inter_op_num_threads``,
+    ``enable_cpu_mem_arena``, ``enable_mem_pattern`` or
+    ``optimized_model_filepath``. Enumerations are given by name:
+
+    - execution_mode: sequential | parallel
+    - graph_optimization_level: disable | basic | extended | all
+
+    Parameters
+    ----------
+    options: dict
+        The session settings. If None, onnxruntime defaults are used.
+
+    Returns
+    -------
+    sess_options: ort.SessionOptions
+        The session options object.
+
+    Raises
+    ------
+    NotImplementedError
+        If an enumeration value or an option name is not available.
+    """
+    sess_options = ort.SessionOptions()
+    enums = {
+        "execution_mode": EXECUTION_MODES,
+        "graph_optimization_level": GRAPH_OPTIMIZATION_LEVELS,
+    }
+    for name, value in (options or {}).items():
+        if name in enums:
+            if value not in enums[name]:
+                raise NotImplementedError(
+                    f"{name} not implemented, got {value}, "
+                    f"available options are {list(enums[name])}"
+                )
+            value = enums[name][value]
+        elif not hasattr(sess_options, name):
+            raise NotImplementedError(f"Unknown onnxruntime session option {name}")
+        setattr(sess_options, name, value)
+    return sess_options
 
 
 def gcnn_onnx_inference_pass(
-    test_loader: torch.utils.data.DataLoader,
+    test_loader: Iterable,
     ort_session: ort.InferenceSession,
     verbose: int = 1,
     profiler: BatchProfiler = None,
@@ -14,8 +76,9 @@ def gcnn_onnx_inference_pass(
     """
     Parameters
     ----------
-    generator: torch.utils.data.DataLoader
-        The inference dataset generator.
+    test_loader: Iterable
+        The inference batches, as ``(inputs, labels)`` pairs. For example a
+        ``BatchIterator`` or a ``torch.utils.data.DataLoader``.
     ort_session: ort.InferenceSession
         The onnxruntime inference session.
     verbose: int
@@ -44,3 +107,164 @@ def gcnn_onnx_inference_pass(
         outs.append(torch.Tensor(out))
     output = torch.cat(outs)
     return output
+
+
+def gcnn_onnx_binding_pass(
+    tiles: np.ndarray,
+    ort_session: ort.InferenceSession,
+    batch_size: int,
+    verbose: int = 1,
+    profiler: BatchProfiler = None,
+) -> np.ndarray:
+    """Consumes tiles through an ONNX CNN or GCNN network with IO binding.
+
+    Inputs are bound as views of the ``tiles`` array and outputs are written
+    by onnxruntime straight into the returned buffer: no copies or tensor
+    conversions are made per batch.
+
+    Parameters
+    ----------
+    tiles: np.ndarray
+        The input tiles, of shape=(N,C,H,W).
+    ort_session: ort.InferenceSession
+        The onnxruntime inference session.
+    batch_size: int
+        The number of tiles in each batch.
+    verbose: int
+        Switch to log information. Defaults to 1. Available options:
+
+        - 0: no logs.
+        - 1: display progress bar.
+
+    profiler: BatchProfiler
+            The profiler object to record batch inference time.
+
+    Returns
+    -------
+    np.ndarray
+        Output tiles of shape=(N,C,H,W).
+    """
+    # no copy if tiles are already contiguous float32
+    tiles = np.ascontiguousarray(tiles, dtype=np.float32)
+    output = np.empty_like(tiles)
+    binding = ort_session.io_binding()
+    starts = range(0, len(tiles), batch_size)
+    wrap = tqdm(starts, desc="onnx.predict") if verbose else starts
+    if profiler is not None:
+        wrap = profiler.set_iterable(wrap)
+    for start in wrap:
+        inputs = tiles[start : start + batch_size]
+        outputs = output[start : start + batch_size]
+        binding.bind_input(
+            "input", "cpu", 0, np.float32, inputs.shape, inputs.ctypes.data
+        )
+        binding.bind_output(
+            "output", "cpu", 0, np.float32, outputs.shape, outputs.ctypes.data
+        )
+        ort_session.run_with_iobinding(binding)
+    return output
+
+
+def np_planes2tiles(planes: np.ndarray, crop_size: Tuple[int]) -> np.ndarray:
+    """Numpy implementation of ``Converter.planes2tiles``.
+
+    Parameters
+    ----------
+    planes: np.ndarray
+        Planes, of shape=(N,C,H,W).
+    crop_size: Tuple[int]
+        The tile dimensions: (edge_h, edge_w).
+
+    Returns
+    -------
+    np.ndarray
+        Tiles of shape=(N',C,edge_h,edge_w).
+    """
+    edge_h, edge_w = crop_size
+    n, c, h, w = planes.shape
+    pad = calculate_pad(planes.shape, crop_size)
+    # each plane is padded with its own mean
+    padded = np.empty(
+        (n, c, h + pad[2] + pad[3], w + pad[0] + pad[1]), dtype=planes.dtype
+    )
+    padded[...] = planes.mean(axis=(1, 2, 3), keepdims=True)
+    padded[..., pad[2] : pad[2] + h, pad[0] : pad[0] + w] = planes
+    planes = padded
+    n, c, h, w = planes.shape
+    tiles = planes.reshape(n, c, h // edge_h, edge_h, w // edge_w, edge_w)
+    # the reshape of the transposed view is the only copy
+    return tiles.transpose(0, 2, 4, 1, 3, 5).reshape(-1, c, edge_h, edge_w)
+
+
+def np_tiles2planes(
+    tiles: np.ndarray, planes_shape: Tuple[int], crop_size: Tuple[int]
+) -> np.ndarray:
+    """Numpy implementation of ``Converter.tiles2planes``.
+
+    Parameters
+    ----------
+    tiles: np.ndarray
+        Tiles, of shape (N',C',edge_h,edge_w).
+    planes_shape: Tuple[int]
+        The shape of the planes the tiles were extracted from: (N,C,H,W).
+    crop_size: Tuple[int]
+        The tile dimensions: (edge_h, edge_w).
+
+    Returns
+    -------
+    np.ndarray
+        Planes, of shape=(N,C',H,W).
+    """
+    edge_h, edge_w = crop_size
+    n, _, h, w = planes_shape
+    c = tiles.shape[1]
+    pad = calculate_pad(planes_shape, crop_size)
+    a_x = (h + pad[2] + pad[3]) // edge_h
+    a_y = (w + pad[0] + pad[1]) // edge_w
+    planes = np.empty((n, c, a_x * edge_h, a_y * edge_w), dtype=tiles.dtype)
+    planes.reshape(n, c, a_x, edge_h, a_y, edge_w)[...] = tiles.reshape(
+        n, a_x, a_y, c, edge_h, edge_w
+    ).transpose(0, 3, 1, 4, 2, 5)
+    return planes[..., pad[2] : pad[2] + h, pad[0] : pad[0] + w]
+
+
+def uscg_onnx_inference_pass(
+    test_loader: Iterable,
+    network: ort.InferenceSession,
+    verbose: int = 1,
+    profiler: BatchProfiler = None,
+    batch_windows: bool = False,
+) -> torch.Tensor:
+    """
+    Parameters
+    ----------
+    test_loader: Iterable
+        The inference batches, as ``(inputs, labels)`` pairs. For example a
+        ``BatchIterator`` or a ``torch.utils.data.DataLoader``.
+    network: ort.InferenceSession
+        The onnxruntime USCG network, exposing the time windows ``w`` and
+        ``stride`` attributes.
+    verbose: int
+        Switch to log information. Defaults to 1. Available options:
+
+        - 0: no logs.
+        - 1: display progress bar.
+
+    profiler: BatchProfiler
+            The profiler object to record batch inference time.
+    batch_windows: bool
+        Wether to forward all the time windows of a batch at once.
+
+    Returns
+    -------
+    torch.Tensor
+        Output tensor of shape=(N,C,H,W).
+    """
+    outs = []
+    wrap = tqdm(test_loader, desc="onnx.predict") if verbose else test_loader
+    if profiler is not None:
+        wrap = profiler.set_iterable(wrap)
+    for noisy, _ in wrap:
+        outs.append(forward_windows(network, noisy, "cpu", batch_windows))
+    output = torch.cat(outs)
+    return output
@@ -6,6 +6,7 @@ import torch
 from .uscg_dataloading import UscgDataset
 from .uscg_net import UscgNet
 from .utils import make_dict_compatible
+from ..utils import no_weight_init
 from dunedn import PACKAGE
 from dunedn.training.metrics import DN_METRICS
 from dunedn.training.losses import get_loss
@@ -32,7 +33,14 @@ def load_and_compile_uscg_network(
     network: UscgNet
         The loaded neural network.
     """
-    network = UscgNet(channel, **msetup["net_dict"])
+    if checkpoint_filepath:
+        # weights are overwritten by the checkpoint: skip the pretrained resnet
+        # download and the parameters initialization
+        net_dict = dict(msetup["net_dict"], pretrained=False)
+        with no_weight_init():
+            network = UscgNet(channel, **net_dict)
+    else:
+        network = UscgNet(channel, **msetup["net_dict"])
 
     if checkpoint_filepath:
         logger.info(f"Loading weights at {checkpoint_filepath}")
@@ -149,7 +149,7 @@ class UscgPlanesDataset(BaseUscgDataset):
             The number of examples to be batched.
         """
         noisy = noisy.astype(np.float32)
-        self.noisy = median_subtraction(noisy)
+        self.noisy = torch.from_numpy(median_subtraction(noisy))
         super().__init__(
             "test",
             task,
@@ -8,6 +8,7 @@ from torch import nn
 from math import ceil
 from torchvision.models import resnext50_32x4d
 from ..abstract_net import AbstractNet
+from ..utils import BatchIterator, BatchProfiler, fuse_conv_bn
 from .uscg_dataloading import UscgDataset
 from .uscg_net_blocks import (
     SCG_Block,
@@ -170,12 +171,30 @@ class UscgNet(AbstractNet):
         return x * i
         # return self.act(x * i)
 
+    def fuse_for_inference(self) -> "UscgNet":
+        """Folds the batch normalization layers into the preceding layers.
+
+        Covers the ResNeXt downsampling layers, the ``Pooling_Block`` and the
+        graph convolution layers. Folded layers are replaced by identities.
+
+        The network is set in evaluation mode and must not be trained anymore.
+
+        Returns
+        -------
+        UscgNet
+            The network itself.
+        """
+        self.eval()
+        return fuse_conv_bn(self)
+
     def predict(
         self,
         generator: UscgDataset,
         dev: str = "cpu",
         no_metrics: bool = False,
         verbose: int = 1,
+        profiler: BatchProfiler = None,
+        batch_windows: bool = False,
     ) -> Tuple[torch.Tensor, dict]:
         """Uscg network inference.
 
@@ -194,6 +213,11 @@ class UscgNet(AbstractNet):
             - 0: no logs.
             - 1: display progress bar.
 
+        profiler: BatchProfiler
+            The profiler object to record batch inference time.
+        batch_windows: bool
+            Wether to forward all the time windows of a batch at once.
+
         Returns
         -------
         y_pred: torch.Tensor
@@ -203,15 +227,18 @@ class UscgNet(AbstractNet):
         """
         self.check_network_is_compiled()
 
-        # convert planes to crops
-        test_loader = torch.utils.data.DataLoader(
-            dataset=generator,
-            batch_size=generator.batch_size,
-        )
+        test_loader = BatchIterator(generator.noisy, generator.batch_size)
 
         # inference pass
         start = tm()
-        y_pred = uscg_inference_pass(test_loader, self, dev, verbose)
+        y_pred = uscg_inference_pass(
+            test_loader,
+            self,
+            dev,
+            verbose,
+            profiler=profiler,
+            batch_windows=batch_windows,
+        )
         inference_time = tm() - start
 
         if no_metrics:
@@ -290,14 +317,16 @@ class UscgNet(AbstractNet):
     def onnx_export(self, fname: Path):
         """Export model to ONNX format.
 
+        The exported network processes a single time window: inputs have
+        shape=(N,1,H,w).
+
         Parameters
         ----------
         fname: Path
             The path to save the `.onnx` network.
         """
-        raise NotImplementedError(
-            "Currently, UscgNet cannot be exported to `onnx` format."
-        )
+        self.eval()
+
         # produce dummy inputs
         inputs = torch.randn(1, 1, self.h, self.w)
 
@@ -1,6 +1,7 @@
 """
     This module contains the USCG Net building blocks.
 """
+from math import ceil
 import torch
 from torch import nn
 
@@ -55,10 +56,9 @@ class SCG_Block(nn.Module):
             )
         loss = kl_loss - dl_loss if self.training else None
         if self.add_diag:
-            diag = []
-            for i in range(Ad.shape[0]):
-                diag.append(torch.diag(Ad[i, :]).unsqueeze(0))
-            A = A + gamma * torch.cat(diag, 0)
+            # batched diagonal matrices, of shape=(B,N,N)
+            diag = Ad.unsqueeze(-1) * torch.eye(self.nodes, device=Ad.device)
+            A = A + gamma * diag
         A = self.laplacian_matrix(A, self_loop=True)
         z_hat = (
             gamma.mean()
@@ -117,6 +117,10 @@ class Pooling_Block(nn.Module):
         )
 
     def forward(self, x):
+        if torch.onnx.is_in_onnx_export():
+            # ONNX supports adaptive pooling only for divisible input sizes
+            x = adaptive_max_pool2d(x, self.pooling[0].output_size)
+            return self.pooling[1:](x)
         return self.pooling(x)
 
 
@@ -139,6 +143,60 @@ class Recombination_Layer(nn.Module):
 # functions and classes to be called within this module only
 
 
+def adaptive_max_pool2d(x, output_size):
+    """
+    Adaptive max pooling with bins computed from the static input shape.
+
+    Equivalent to ``torch.nn.functional.adaptive_max_pool2d``, but made of
+    gather and reduce operations only, that can be exported to ONNX for any
+    input and output sizes.
+
+    Parameters
+    ----------
+        - x: torch.Tensor, input tensor of shape=(N,C,H,W)
+        - output_size: tuple, (out_h, out_w)
+
+    Returns
+    -------
+        - torch.Tensor, output tensor of shape=(N,C,out_h,out_w)
+    """
+    for dim, out_size in zip([2, 3], output_size):
+        x = max_over_bins(x, dim, int(x.shape[dim]), out_size)
+    return x
+
+
+def max_over_bins(x, dim, in_size, out_size):
+    """
+    Max reduction over the adaptive pooling bins of one axis.
+
+    Bin ``i`` spans ``[floor(i*in/out), ceil((i+1)*in/out))``. Shorter bins are
+    padded repeating their last index, which leaves the maximum unchanged.
+
+    Parameters
+    ----------
+        - x: torch.Tensor, input tensor
+        - dim: int, the pooled axis
+        - in_size: int, the input size along ``dim``
+        - out_size: int, the output size along ``dim``
+
+    Returns
+    -------
+        - torch.Tensor, output tensor with ``out_size`` elements along ``dim``
+    """
+    starts = [(i * in_size) // out_size for i in range(out_size)]
+    ends = [ceil((i + 1) * in_size / out_size) for i in range(out_size)]
+    kernel = max(end - start for start, end in zip(starts, ends))
+    idxs = [
+        [min(start + k, end - 1) for k in range(kernel)]
+        for start, end in zip(starts, ends)
+    ]
+    idxs = torch.tensor(idxs, device=x.device).flatten()
+    x = x.index_select(dim, idxs)
+    shape = list(x.shape)
+    shape[dim : dim + 1] = [out_size, kernel]
+    return x.reshape(shape).amax(dim + 1)
+
+
 class BatchNorm_GCN(nn.BatchNorm1d):
     """Batch normalization over GCN features"""
 
@@ -1,10 +1,13 @@
 """This module implements utility functions for the `networks.uscg` subpackage."""
 from typing import Tuple
+from collections.abc import Iterable
+from functools import lru_cache
 from tqdm.auto import tqdm
 from math import ceil
 import torch
 from collections import OrderedDict
 from ..abstract_net import AbstractNet
+from ..utils import BatchProfiler
 
 
 def make_dict_compatible(state_dict: OrderedDict):
@@ -72,18 +75,96 @@ def time_windows(
     return divisions, windows, idxs
 
 
+@lru_cache(maxsize=None)
+def window_map(width: int, w: int, stride: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Computes the time windows indices and the overlap divisions.
+
+    Results are cached, since they depend on the planes width only.
+
+    Parameters
+    ----------
+    width: int
+        The planes width.
+    w: int
+        Width of the time windows.
+    stride: int
+        Steps between time windows.
+
+    Returns
+    -------
+    idxs: torch.Tensor
+        Time indices of each window, of shape=(nb windows,w).
+    divisions: torch.Tensor
+        Number of windows covering each time index, of shape=(width,).
+    """
+    n = ceil((width - w) / stride) + 1
+    idxs = torch.arange(n).unsqueeze(1) * stride + torch.arange(w)
+    if idxs[-1, -1] >= width:
+        raise ValueError(
+            f"Time windows of width {w} and stride {stride} do not tile "
+            f"planes of width {width}"
+        )
+    divisions = torch.bincount(idxs.flatten(), minlength=width).float()
+    return idxs, divisions
+
+
+def forward_windows(
+    network: AbstractNet, planes: torch.Tensor, dev: str, batch_windows: bool
+) -> torch.Tensor:
+    """Denoises planes averaging the network outputs on overlapping windows.
+
+    Parameters
+    ----------
+    network: AbstractNet
+        The denoising network.
+    planes: torch.Tensor
+        The noisy planes, of shape=(N,C,H,W).
+    dev: str
+        The device hosting the computation.
+    batch_windows: bool
+        Wether to stack the windows along the batch axis and run a single
+        forward pass, instead of one pass per window.
+
+    Returns
+    -------
+    torch.Tensor
+        Denoised planes, of shape=(N,C,H,W).
+    """
+    idxs, divisions = window_map(planes.shape[-1], network.w, network.stride)
+    # onnx networks are called directly
+    module = getattr(network, "inference_module", network)
+    out = torch.zeros_like(planes)
+    if batch_windows:
+        nb_windows = len(idxs)
+        n, c, h, _ = planes.shape
+        # (N,C,H,nb windows,w) -> (nb windows * N,C,H,w)
+        windows = planes[..., idxs].permute(3, 0, 1, 2, 4).reshape(-1, c, h, network.w)
+        outputs = module(windows.to(dev)).cpu()
+        outputs = outputs.view(nb_windows, n, c, h, network.w).permute(1, 2, 3, 0, 4)
+        # overlap-add in a single scatter
+        out.index_add_(3, idxs.flatten(), outputs.reshape(n, c, h, -1))
+    else:
+        for idx in idxs:
+            start, end = idx[0].item(), idx[-1].item() + 1
+            out[..., start:end] += module(planes[..., start:end].to(dev)).cpu()
+    return out / divisions
+
+
 def uscg_inference_pass(
-    test_loader: torch.utils.data.DataLoader,
+    test_loader: Iterable,
     network: AbstractNet,
     dev: str,
     verbose: int = 1,
+    profiler: BatchProfiler = None,
+    batch_windows: bool = False,
 ) -> torch.Tensor:
     """Consumes data through USCG network and gives outputs.
 
     Parameters
     ----------
-    test_loader: torch.utils.data.Dataloader
-        The inference dataset generator.
+    test_loader: Iterable
+        The inference batches, as ``(inputs, labels)`` pairs. For example a
+        ``BatchIterator`` or a ``torch.utils.data.DataLoader``.
     network: AbstractNet
         The denoising network.
     dev: str
@@ -94,22 +175,28 @@ def uscg_inference_pass(
         - 0: no logs.
         - 1: display progress bar.
 
+    profiler: BatchProfiler
+            The profiler object to record batch inference time.
+    batch_windows: bool
+        Wether to forward all the time windows of a batch at once. The network
+        input batch grows by the number of windows.
+
     Returns
     -------
     output: torch.Tensor
         Denoised data, of shape=(N,1,H,W).
     """
-    w = network.w
     network.eval()
+    # networks already pinned on `dev` are not moved around
+    network_dev = next(network.parameters()).device
     network.to(dev)
     outs = []
     wrap = tqdm(test_loader, desc="uscg.predict") if verbose else test_loader
-    for noisy, _ in wrap:
-        div, nwindows, idxs = time_windows(noisy, w, network.stride)
-        out = torch.zeros_like(noisy)
-        for nwindow, (start, end) in zip(nwindows, idxs):
-            out[..., start:end] = network(nwindow.to(dev)).detach().cpu()
-        outs.append(out / div)
+    if profiler is not None:
+        wrap = profiler.set_iterable(wrap)
+    with torch.no_grad():
+        for noisy, _ in wrap:
+            outs.append(forward_windows(network, noisy, dev, batch_windows))
     output = torch.cat(outs)
-    network.to("cpu")
+    network.to(network_dev)
     return output
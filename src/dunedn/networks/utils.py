@@ -1,12 +1,33 @@
 """This module implements utility function for all the networks."""
 from logging import Logger
+from math import ceil
 from typing import Tuple
 from collections.abc import Iterable
+from contextlib import contextmanager
 from time import time as tm
 import numpy as np
+import torch
+from torch import nn
+from torch.nn.modules.batchnorm import _BatchNorm
+from torchvision.models.resnet import BasicBlock, Bottleneck
 
 supported_models = ["uscg", "cnn", "gcnn"]
 
+# parameter initializers called by torch and torchvision layers constructors
+_init_fns = [
+    "uniform_",
+    "normal_",
+    "trunc_normal_",
+    "constant_",
+    "ones_",
+    "zeros_",
+    "xavier_uniform_",
+    "xavier_normal_",
+    "kaiming_uniform_",
+    "kaiming_normal_",
+    "orthogonal_",
+]
+
 
 class BatchProfiler:
     """Class to profile for loops steps.
@@ -96,6 +117,196 @@ class BatchProfiler:
         return self
 
 
+class BatchIterator:
+    """Iterates over contiguous batches of a tensor.
+
+    Drop-in replacement of ``torch.utils.data.DataLoader`` at inference time:
+    batches are zero-copy views of the input tensor, instead of stacks of
+    single examples. Each step yields a ``(batch, None)`` pair, mimicking the
+    ``(inputs, labels)`` loader outputs.
+
+    Example
+    -------
+
+    >>> from dunedn.networks.utils import BatchIterator
+    >>> import torch
+    >>> loader = BatchIterator(torch.zeros(10, 1, 32, 32), batch_size=4)
+    >>> len(loader)
+    3
+    >>> for batch, _ in loader:
+    ...     print(batch.shape)
+    """
+
+    def __init__(self, data: torch.Tensor, batch_size: int):
+        """
+        Parameters
+        ----------
+        data: torch.Tensor
+            The examples to be batched, of shape=(N,C,H,W).
+        batch_size: int
+            The number of examples in each batch.
+        """
+        self.data = data
+        self.batch_size = int(batch_size)
+
+    def __len__(self) -> int:
+        return ceil(len(self.data) / self.batch_size)
+
+    def __iter__(self):
+        for start in range(0, len(self.data), self.batch_size):
+            yield self.data[start : start + self.batch_size], None
+
+
+@contextmanager
+def no_weight_init():
+    """Builds networks with uninitialized parameters.
+
+    Within the context, the ``torch.nn.init`` functions leave tensors untouched.
+    This saves the initialization time when the weights are loaded from a
+    checkpoint right after the network construction.
+
+    Note
+    ----
+
+    The initializers are patched globally: layers built concurrently by other
+    threads are not initialized either.
+
+    Example
+    -------
+
+    >>> from dunedn.networks.utils import no_weight_init
+    >>> with no_weight_init():
+    ...     network = GcnnNet(**net_dict)
+    >>> network.load_state_dict(state_dict)
+    """
+    originals = {name: getattr(nn.init, name) for name in _init_fns}
+    try:
+        for name in _init_fns:
+            setattr(nn.init, name, lambda tensor, *args, **kwargs: tensor)
+        yield
+    finally:
+        for name, fn in originals.items():
+            setattr(nn.init, name, fn)
+
+
+def bn_scale_shift(bn: _BatchNorm) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Computes the affine map applied by a batch normalization layer at
+    inference time.
+
+    Parameters
+    ----------
+    bn: _BatchNorm
+        The batch normalization layer.
+
+    Returns
+    -------
+    scale: torch.Tensor
+        The per channel scale, of shape=(C,).
+    shift: torch.Tensor
+        The per channel shift, of shape=(C,).
+    """
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    if bn.affine:
+        scale = bn.weight * scale
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        shift = shift + bn.bias
+    return scale, shift
+
+
+def scale_layer(
+    layer: nn.Module, scale: torch.Tensor, shift: torch.Tensor = None
+) -> nn.Module:
+    """Multiplies the output channels of a layer by ``scale`` and adds ``shift``.
+
+    Parameters
+    ----------
+    layer: nn.Module
+        A ``nn.Conv2d`` or ``nn.Linear`` layer, with output channels along the
+        first weight axis.
+    scale: torch.Tensor
+        The per channel scale, of shape=(C,).
+    shift: torch.Tensor
+        The per channel shift, of shape=(C,). If None, no shift is added.
+
+    Returns
+    -------
+    nn.Module
+        The layer, modified in place.
+    """
+    with torch.no_grad():
+        layer.weight.mul_(scale.view(-1, *[1] * (layer.weight.dim() - 1)))
+        if layer.bias is None:
+            layer.bias = nn.Parameter(torch.zeros_like(scale))
+        layer.bias.mul_(scale)
+        if shift is not None:
+            layer.bias.add_(shift)
+    return layer
+
+
+def fuse_conv_bn(module: nn.Module) -> nn.Module:
+    """Folds batch normalization layers into the preceding linear layers.
+
+    Folds every ``nn.BatchNorm1d`` or ``nn.BatchNorm2d`` layer that directly
+    follows a ``nn.Conv2d`` or ``nn.Linear`` one, either in a ``nn.Sequential``
+    container or in a torchvision residual block. Folded layers are replaced by
+    ``nn.Identity``, hence the module must be used in evaluation mode only.
+
+    Parameters
+    ----------
+    module: nn.Module
+        The module to be fused.
+
+    Returns
+    -------
+    nn.Module
+        The module, modified in place.
+    """
+    linears = (nn.Conv2d, nn.Linear)
+    for child in list(module.modules()):
+        if isinstance(child, nn.Sequential):
+            for i in range(len(child) - 1):
+                layer, bn = child[i], child[i + 1]
+                if isinstance(layer, linears) and isinstance(bn, _BatchNorm):
+                    scale_layer(layer, *bn_scale_shift(bn))
+                    child[i + 1] = nn.Identity()
+        elif isinstance(child, (BasicBlock, Bottleneck)):
+            for i in range(1, 4):
+                conv = getattr(child, f"conv{i}", None)
+                bn = getattr(child, f"bn{i}", None)
+                if isinstance(bn, _BatchNorm):
+                    scale_layer(conv, *bn_scale_shift(bn))
+                    setattr(child, f"bn{i}", nn.Identity())
+    return module
+
+
+def throughput_summary(latencies: np.ndarray, wall_time: float) -> str:
+    """Human-readable message on a multi-event inference run.
+
+    Parameters
+    ----------
+    latencies: np.ndarray
+        The per-event processing times, of shape=(nb events,).
+    wall_time: float
+        The total elapsed time of the run.
+
+    Returns
+    -------
+    message: str
+        The message with throughput, mean and 95th percentile latency.
+    """
+    nb_events = len(latencies)
+    if nb_events == 0:
+        return "No events processed"
+    msg = (
+        f"Processed {nb_events} events in {wall_time:.3f} s. "
+        f"Throughput: {nb_events / wall_time:.3f} events/s, "
+        f"latency mean: {latencies.mean():.3e} s, "
+        f"p95: {np.percentile(latencies, 95):.3e} s"
+    )
+    return msg
+
+
 def get_supported_models():
     """Returns the names of the supported models.
 
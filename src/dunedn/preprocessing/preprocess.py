@@ -10,7 +10,7 @@
     .. code-block:: text
 
         $ dunedn preprocess --help
-        usage: dunedn preprocess [-h] [--output OUTPUT] [--force] [--save_sample] runcard
+        usage: dunedn preprocess [-h] [--output OUTPUT] [--force] [--save_sample] [--workers WORKERS] runcard
 
         Preprocess dataset of protoDUNE events: dumps planes and training crops.
 
@@ -23,6 +23,7 @@
                                 the output folder
           --force               overwrite existing files if present
           --save_sample         extract a smaller dataset
+          --workers WORKERS     number of processes decoding the events
 """
 from pathlib import Path
 from argparse import ArgumentParser, Namespace
@@ -57,6 +58,13 @@ def add_arguments_preprocessing(parser: ArgumentParser):
     parser.add_argument(
         "--save_sample", action="store_true", help="extract a smaller dataset"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of processes decoding the events",
+        default=1,
+        dest="nb_workers",
+    )
     parser.set_defaults(func=preprocess)
 
 
@@ -79,10 +87,11 @@ def preprocess(args: Namespace):
     preprocess_main(
         setup["dataset"],
         args.save_sample,
+        nb_workers=args.nb_workers,
     )
 
 
-def preprocess_main(dsetup: dict, save_sample: bool):
+def preprocess_main(dsetup: dict, save_sample: bool, nb_workers: int = 1):
     """Preprocessing main function.
 
     Loads an input event from file, makes inference and saves the ouptut.
@@ -98,18 +107,32 @@ def preprocess_main(dsetup: dict, save_sample: bool):
         - nb_crops: int, number of crops from each plane
         - crop_edge: int, crop edge size
         - pct: float, signal / background crop balance
+        - norm_chunk_size: int, planes loaded at once by the normalization
+        - crop_block_size: int, planes cropped at once
+        - sample_crops: bool, skip crops, sampled on the fly at training time
+
+    nb_workers: int
+        The number of processes decoding the events.
     """
     for folder in ["train", "val", "test"]:
         dname = dsetup["data_folder"] / folder
         (dname / "planes").mkdir(parents=True, exist_ok=True)
-        if folder == "train":
+        if folder == "train" and not dsetup.get("sample_crops", False):
             (dname / "crops").mkdir(exist_ok=True)
-        get_planes_and_dump(dname, save_sample)
+        get_planes_and_dump(dname, save_sample, nb_workers=nb_workers)
     for channel in ["induction", "collection"]:
-        save_normalization_info(dsetup["data_folder"], channel)
+        save_normalization_info(
+            dsetup["data_folder"],
+            channel,
+            chunk_size=dsetup.get("norm_chunk_size"),
+        )
+    if dsetup.get("sample_crops", False):
+        # training crops are sampled from planes, see GcnnCropSamplingDataset
+        return
     crop_planes_and_dump(
         dsetup["data_folder"] / "train",
         dsetup["nb_crops"],
         dsetup["crop_size"],
         dsetup["pct"],
+        block_size=dsetup.get("crop_block_size", 4),
     )
@@ -3,10 +3,13 @@
     This module contains the utility functions for the preprocessing step.
 """
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from typing import Tuple
 from pathlib import Path
 from glob import glob
 import numpy as np
+from numpy.lib.format import open_memmap
+from numpy.lib.stride_tricks import sliding_window_view
 from dunedn.configdn import PACKAGE
 from dunedn.geometry.helpers import evt2planes
 from dunedn.utils.utils import median_subtraction
@@ -14,37 +17,91 @@ from dunedn.utils.utils import median_subtraction
 # instantiate logger
 logger = logging.getLogger(PACKAGE + ".preprocess")
 
+# event file name prefixes, for each planes kind
+EVENT_FILE_PREFIXES = {
+    "clear": "rawdigit_noiseoff",
+    "noisy": "rawdigit",
+    "simch": "simch_labels",
+}
 
-def save_normalization_info(dir_name: Path, channel: str):
+# bytes of float64 buffers used by the normalization statistics
+NORMALIZATION_MEMORY_BUDGET = 256 * 2**20
+
+
+def save_normalization_info(dir_name: Path, channel: str, chunk_size: int = None):
     """Stores on disk useful information to apply dataset normalization.
 
     Available normalizations are MinMax | Zscore | Mednorm
 
+    Statistics are accumulated in a single pass over the memory-mapped training
+    planes, loading ``chunk_size`` planes at a time:
+
+    - running minimum and maximum.
+    - mean and standard deviation, merging the chunks moments with Welford's
+      parallel update.
+    - range of the planes after subtracting each plane median, the median
+      being found with a partition.
+
     Parameters
     ----------
     dir_name: Path
         Directory path to datasets.
     channel: str
         Induction | collection.
+    chunk_size: int
+        The number of planes loaded at once. Bounds the memory usage. If None,
+        the planes fitting in ``NORMALIZATION_MEMORY_BUDGET`` bytes, at least
+        one.
     """
     logger.info("Saving normalization info to %s", dir_name)
     fname = dir_name / f"train/planes/{channel}_noisy.npy"
-    n = np.load(fname).flatten()
-
+    planes = np.load(fname, mmap_mode="r")
+
+    if chunk_size is None:
+        # a float64 copy of the chunk and a temporary of the same size
+        plane_bytes = 2 * np.dtype(np.float64).itemsize * np.prod(planes.shape[1:])
+        chunk_size = max(1, int(NORMALIZATION_MEMORY_BUDGET // plane_bytes))
+
+    count, mean, m2 = 0, 0.0, 0.0
+    n_min, n_max = np.inf, -np.inf
+    med_min, med_max = np.inf, -np.inf
+    for start in range(0, len(planes), chunk_size):
+        chunk = np.array(planes[start : start + chunk_size], dtype=np.float64)
+        chunk = chunk.reshape([len(chunk), -1])
+
+        n_min = min(n_min, chunk.min())
+        n_max = max(n_max, chunk.max())
+
+        chunk_count = chunk.size
+        chunk_mean = chunk.mean()
+        chunk_m2 = np.square(chunk - chunk_mean).sum()
+        delta = chunk_mean - mean
+        total = count + chunk_count
+        mean += delta * chunk_count / total
+        m2 += chunk_m2 + delta**2 * count * chunk_count / total
+        count = total
+
+        # per-plane medians, partition sorts the chunk in place
+        chunk_range = chunk.max(axis=1), chunk.min(axis=1)
+        size = chunk.shape[1]
+        kth = [(size - 1) // 2, size // 2]
+        chunk.partition(kth, axis=1)
+        medians = chunk[:, kth].mean(axis=1)
+        med_min = min(med_min, (chunk_range[1] - medians).min())
+        med_max = max(med_max, (chunk_range[0] - medians).max())
+
+    # statistics are saved in float64: integer ADC planes must not truncate them
     # MinMax
     fname = dir_name / f"{channel}_minmax"
-    np.save(fname, [n.min(), n.max()])
+    np.save(fname, np.array([n_min, n_max], dtype=np.float64))
 
     # Zscore
     fname = dir_name / f"{channel}_zscore"
-    np.save(fname, [n.mean(), n.std()])
+    np.save(fname, np.array([mean, np.sqrt(m2 / count)], dtype=np.float64))
 
     # Mednorm
-    medians = np.median(n.reshape([n.shape[0], -1]), axis=1)
-    med_min = (n - medians).min()
-    med_max = (n - medians).max()
     fname = dir_name / f"{channel}_mednorm"
-    np.save(fname, [med_min, med_max])
+    np.save(fname, np.array([med_min, med_max], dtype=np.float64))
 
 
 def get_crop(
@@ -101,107 +158,258 @@ def get_crop(
     return (idx_h, idx_w)
 
 
-def get_planes_and_dump(dname: Path, save_sample: bool):
-    """
-    Populates the ``<dname>/planes`` directory with APA planes arrays.
-
-    Planes  come from events in the ``<dname>/events`` directory.
-    Planes arrays have shape=(N,C,H,W).
+def get_event_paths(dname: Path) -> list[dict]:
+    """Lists the events in the ``<dname>/evts`` directory.
 
     Parameters
     ----------
     dname: Path
         Path to train|val|test dataset subfolder.
-    save_sample: bool
-        Wether to save a smaller dataset from the original one.
+
+    Returns
+    -------
+    list[dict]
+        The sorted events, each as a dictionary with the clear, noisy and simch
+        file paths.
     """
-    # TODO: this function could probably be shortened
-    iclear = []
-    inoisy = []
-    isimch = []
-    cclear = []
-    cnoisy = []
-    csimch = []
-
-    paths_clear = glob((dname / "evts/*noiseoff*").as_posix())
+    paths_clear = sorted(glob((dname / "evts/*noiseoff*").as_posix()))
     assert len(paths_clear) != 0
+    return [
+        {
+            kind: Path(path_clear.replace("rawdigit_noiseoff", prefix))
+            for kind, prefix in EVENT_FILE_PREFIXES.items()
+        }
+        for path_clear in paths_clear
+    ]
 
-    logger.info("Fetching files from %s", dname)
-    for path_clear in paths_clear:
-        path_noisy = Path(path_clear.replace("rawdigit_noiseoff", "rawdigit"))
-        path_simch = Path(path_clear.replace("rawdigit_noiseoff", "simch_labels"))
-        path_clear = Path(path_clear)
 
-        logger.debug("  %s", path_clear.name)
-        logger.debug("  %s", path_noisy.name)
-        logger.debug("  %s", path_simch.name)
+def open_planes_memmaps(dname: Path, shapes: dict = None, dtypes: dict = None) -> dict:
+    """Opens the memory-mapped planes outputs in ``<dname>/planes``.
 
-        c = np.load(path_clear)[:, 2:]
-        n = np.load(path_noisy)[:, 2:]
-        s = np.load(path_simch)[:, 2:]
+    Parameters
+    ----------
+    dname: Path
+        Path to train|val|test dataset subfolder.
+    shapes: dict
+        The induction and collection planes output shapes, of shape=(N,C,H,W).
+        If None, existing outputs are opened in read-write mode, otherwise new
+        ones are created.
+    dtypes: dict
+        The planes data type of each kind: clear | noisy | simch. Ignored when
+        opening existing outputs.
 
-        induction_c, collection_c = evt2planes(c)
-        iclear.append(induction_c)
-        cclear.append(collection_c)
+    Returns
+    -------
+    dict
+        The memory-mapped arrays, with (channel, kind) keys.
+    """
+    outputs = {}
+    for channel in ["induction", "collection"]:
+        for kind in EVENT_FILE_PREFIXES:
+            fname = dname / f"planes/{channel}_{kind}.npy"
+            if shapes is None:
+                outputs[channel, kind] = open_memmap(fname, mode="r+")
+            else:
+                outputs[channel, kind] = open_memmap(
+                    fname, mode="w+", dtype=dtypes[kind], shape=shapes[channel]
+                )
+    return outputs
+
+
+def write_event_planes(paths: dict, outputs: dict, index: int):
+    """Loads an event and writes its planes into the outputs.
 
-        induction_n, collection_n = evt2planes(n)
-        inoisy.append(induction_n)
-        cnoisy.append(collection_n)
+    Parameters
+    ----------
+    paths: dict
+        The event clear, noisy and simch file paths.
+    outputs: dict
+        The memory-mapped planes outputs, see ``open_planes_memmaps``.
+    index: int
+        The event position in the outputs.
+    """
+    for kind, path in paths.items():
+        logger.debug("  %s", path.name)
+        planes = evt2planes(np.load(path)[:, 2:])
+        for channel, plane in zip(["induction", "collection"], planes):
+            nb_planes = len(plane)
+            start = index * nb_planes
+            outputs[channel, kind][start : start + nb_planes] = plane
 
-        induction_s, collection_s = evt2planes(s)
-        isimch.append(induction_s)
-        csimch.append(collection_s)
 
-    reshape = lambda x: x.reshape((-1,) + x.shape[2:])
-    iclear = reshape(np.stack(iclear))
-    cclear = reshape(np.stack(cclear))
+def dump_events(dname: Path, paths: list[dict], indices: list[int]):
+    """Writes the planes of a subset of events into existing outputs.
 
-    inoisy = reshape(np.stack(inoisy))
-    cnoisy = reshape(np.stack(cnoisy))
+    Worker function of the ``get_planes_and_dump`` process pool.
 
-    isimch = reshape(np.stack(isimch))
-    csimch = reshape(np.stack(csimch))
+    Parameters
+    ----------
+    dname: Path
+        Path to train|val|test dataset subfolder.
+    paths: list[dict]
+        All the events file paths, see ``get_event_paths``.
+    indices: list[int]
+        The indices of the events to be written.
+    """
+    outputs = open_planes_memmaps(dname)
+    for index in indices:
+        write_event_planes(paths[index], outputs, index)
+    for output in outputs.values():
+        output.flush()
 
-    # at this point planes have shape=(nb_events,N,1,H,W)
-    # with N being the number of induction|collection planes in each event
 
-    logger.info("Saving planes to %s/planes", dname)
+def get_planes_and_dump(dname: Path, save_sample: bool, nb_workers: int = 1):
+    """
+    Populates the ``<dname>/planes`` directory with APA planes arrays.
 
-    logger.debug("  collection clear planes: %s", cclear.shape)
-    logger.debug("  collection noisy planes: %s", cnoisy.shape)
-    logger.debug("  collection sim::SimChannel planes: %s", csimch.shape)
-    logger.debug("  induction clear planes: %s", iclear.shape)
-    logger.debug("  induction noisy planes: %s", inoisy.shape)
-    logger.debug("  induction sim::SimChannel planes: %s", isimch.shape)
+    Planes  come from events in the ``<dname>/evts`` directory.
+    Planes arrays have shape=(N,C,H,W).
 
-    # stack all the planes from different events together
-    save = lambda x, y: np.save(dname / f"planes/{x}", y)
+    Outputs are streamed to disk: a first pass counts the events and sizes
+    memory-mapped `.npy` outputs, then each event planes are written in place
+    as soon as the event is read. Memory usage does not depend on the dataset
+    size.
 
-    save("induction_clear", iclear)
-    save("collection_clear", cclear)
+    With more than one worker, contiguous blocks of events are decoded by a
+    process pool. Each worker writes at the fixed offsets of its events, so the
+    outputs do not depend on the number of workers.
 
-    save("induction_noisy", inoisy)
-    save("collection_noisy", cnoisy)
+    Parameters
+    ----------
+    dname: Path
+        Path to train|val|test dataset subfolder.
+    save_sample: bool
+        Wether to save a smaller dataset from the original one.
+    nb_workers: int
+        The number of worker processes.
+    """
+    logger.info("Fetching files from %s", dname)
+    paths = get_event_paths(dname)
+    nb_events = len(paths)
+
+    # all the events share the planes shape, inferred from the first one, while
+    # each kind keeps the data type of its own files
+    event = np.load(paths[0]["clear"], mmap_mode="r")[:, 2:]
+    shapes = {
+        channel: (nb_events * len(planes),) + planes.shape[1:]
+        for channel, planes in zip(["induction", "collection"], evt2planes(event))
+    }
+    dtypes = {
+        kind: np.load(path, mmap_mode="r").dtype for kind, path in paths[0].items()
+    }
+    outputs = open_planes_memmaps(dname, shapes, dtypes)
+    del event
 
-    save("induction_simch", isimch)
-    save("collection_simch", csimch)
+    logger.info("Saving planes to %s/planes", dname)
+    for channel, shape in shapes.items():
+        logger.debug("  %s planes: %s", channel, shape)
+
+    if nb_workers > 1:
+        # workers reopen the outputs: sizes and headers must be on disk
+        for output in outputs.values():
+            output.flush()
+        blocks = np.array_split(np.arange(nb_events), min(nb_workers, nb_events))
+        with ProcessPoolExecutor(max_workers=len(blocks)) as executor:
+            futures = [
+                executor.submit(dump_events, dname, paths, block.tolist())
+                for block in blocks
+            ]
+            for future in futures:
+                future.result()
+    else:
+        for index, event_paths in enumerate(paths):
+            write_event_planes(event_paths, outputs, index)
+
+    for output in outputs.values():
+        output.flush()
 
     if save_sample:
         # extract a small collection sample from dataset
         logger.info("Saving sample dataset to %s/planes", dname)
-        save("sample_collection_clear", cclear[:10])
-        save("sample_collection_noisy", cnoisy[:10])
-        save("sample_collection_simch", csimch[:10])
+        for kind in EVENT_FILE_PREFIXES:
+            fname = dname / f"planes/sample_collection_{kind}"
+            np.save(fname, outputs["collection", kind][:10])
+
+
+def sample_crop_corners(
+    clear_planes: np.ndarray, nb_crops: int, crop_size: list[int], pct: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Samples the crops positions in a block of clear planes.
+
+    Vectorized version of ``get_crop``: crop centers are drawn uniformly from
+    the flat signal and background pixel indices of the whole block, then
+    clamped so that crops lie inside the planes.
+
+    Parameters
+    ----------
+    clear_planes: np.ndarray
+        Clear planes of shape=(N,H,W).
+    nb_crops: int
+        Number of crops from a single plane.
+    crop_size: list[int]
+        Crop size, (height, width).
+    pct: float
+        Signal / background crops balancing.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        The crops plane indices, top rows and left columns, each of
+        shape=(N * crops per plane,). For each plane, signal crops come first.
+
+    Raises
+    ------
+    ValueError
+        If a plane has no pixels of a kind to be sampled.
+    """
+    nb_planes, height, width = clear_planes.shape
+    c_x, c_y = crop_size[0] // 2, crop_size[1] // 2
+    plane_size = height * width
+    is_signal = (clear_planes != 0).reshape(-1)
+
+    planes = []
+    pixels = []
+    for mask, nb in [
+        (is_signal, int(nb_crops * pct)),
+        (~is_signal, int(nb_crops * (1 - pct))),
+    ]:
+        # flat indices are sorted, hence grouped by plane
+        indices = np.flatnonzero(mask)
+        counts = np.bincount(indices // plane_size, minlength=nb_planes)
+        if nb > 0 and not counts.all():
+            raise ValueError(
+                "Cannot sample crops: found a plane without signal or background"
+            )
+        starts = np.cumsum(counts) - counts
+        plane_idx = np.repeat(np.arange(nb_planes), nb)
+        choice = (np.random.random(len(plane_idx)) * counts[plane_idx]).astype(int)
+        planes.append(plane_idx)
+        pixels.append(indices[starts[plane_idx] + choice] - plane_idx * plane_size)
+
+    planes = np.concatenate(planes)
+    order = np.argsort(planes, kind="stable")
+    rows, cols = np.divmod(np.concatenate(pixels)[order], width)
+    rows = np.clip(rows, c_x, height - c_x) - c_x
+    cols = np.clip(cols, c_y, width - c_y) - c_y
+    return planes[order], rows, cols
 
 
 def crop_planes_and_dump(
-    dir_name: Path, nb_crops: int, crop_size: list[int], pct: float
+    dir_name: Path,
+    nb_crops: int,
+    crop_size: list[int],
+    pct: float,
+    block_size: int = 4,
 ):
     """Populates the ``<dir_name>/crop`` folder.
 
     For each plane stored in ``<dir_name>/planes`` generate ``nb_crops`` of size
     ``crop_size`` according to fixed signal to background percentage.
 
+    Planes are processed in blocks: crops positions are sampled at once for the
+    whole block, see ``sample_crop_corners``, and crops are gathered from the
+    block sliding windows view straight into memory-mapped `.npy` outputs.
+
     Parameters
     ----------
     dir_name: Path
@@ -212,35 +420,42 @@ def crop_planes_and_dump(
         Crop size, (height, width).
     pct: float
         Signal to background crops balancing.
+    block_size: int
+        The number of planes cropped at once. Bounds the memory usage.
     """
+    window = (crop_size[0] // 2 * 2, crop_size[1] // 2 * 2)
+    crops_per_plane = int(nb_crops * pct) + int(nb_crops * (1 - pct))
     for s in ["induction", "collection"]:
 
         fname = dir_name / f"planes/{s}_clear.npy"
-        cplanes = np.load(fname)[:, 0]
+        cplanes = np.load(fname, mmap_mode="r")
 
         fname = dir_name / f"planes/{s}_noisy.npy"
-        nplanes = np.load(fname)
+        nplanes = np.load(fname, mmap_mode="r")
 
         logger.info("Cropping %s planes at %s", s, fname)
 
-        nplanes = median_subtraction(nplanes)[:, 0]
-
-        ccrops = []
-        ncrops = []
-        for cplane, nplane in zip(cplanes, nplanes):
-            idx = get_crop(cplane, nb_crops=nb_crops, crop_size=crop_size, pct=pct)
-            ccrops.append(cplane[idx][:, None])
-            ncrops.append(nplane[idx][:, None])
-
-        ccrops = np.concatenate(ccrops, 0)
-        ncrops = np.concatenate(ncrops, 0)
-
-        fname = dir_name / f"crops/{s}_noisy_{crop_size[0]}_{pct}"
         logger.info("Saving crops to %s", dir_name)
-
-        logger.debug("%s{s} clear crops: %s", s, ccrops.shape)
-        logger.debug("%s{s} noisy crops: %s", s, ncrops.shape)
-        np.save(fname, ncrops)
-
-        fname = dir_name / f"crops/{s}_clear_{crop_size[0]}_{pct}"
-        np.save(fname, ccrops)
+        shape = (len(cplanes) * crops_per_plane, 1) + window
+        fname = dir_name / f"crops/{s}_clear_{crop_size[0]}_{pct}.npy"
+        ccrops = open_memmap(fname, mode="w+", dtype=cplanes.dtype, shape=shape)
+        fname = dir_name / f"crops/{s}_noisy_{crop_size[0]}_{pct}.npy"
+        # median subtracted integer ADC counts are not integers
+        ndtype = np.promote_types(nplanes.dtype, np.float32)
+        ncrops = open_memmap(fname, mode="w+", dtype=ndtype, shape=shape)
+
+        logger.debug("%s clear crops: %s", s, ccrops.shape)
+        logger.debug("%s noisy crops: %s", s, ncrops.shape)
+
+        for start in range(0, len(cplanes), block_size):
+            cblock = np.asarray(cplanes[start : start + block_size, 0])
+            nblock = median_subtraction(nplanes[start : start + block_size])[:, 0]
+            idx = sample_crop_corners(cblock, nb_crops, crop_size, pct)
+
+            stop = start + len(cblock)
+            out = slice(start * crops_per_plane, stop * crops_per_plane)
+            ccrops[out, 0] = sliding_window_view(cblock, window, axis=(1, 2))[idx]
+            ncrops[out, 0] = sliding_window_view(nblock, window, axis=(1, 2))[idx]
+
+        ccrops.flush()
+        ncrops.flush()
@@ -10,16 +10,17 @@
     .. code-block:: text
     
         $ dunedn --help
-        usage: dunedn [-h] {preprocess,train,inference,analysis} ...
+        usage: dunedn [-h] {preprocess,train,inference,analysis,quantize} ...
 
         dunedn
 
         positional arguments:
-          {preprocess,train,inference,analysis}
+          {preprocess,train,inference,analysis,quantize}
             preprocess          preprocess dataset of protodune events
             train               train model loading settings from configcard
             inference           load event and make inference with saved model
             analysis            load reconstructed and target events and compute accuracy metrics
+            quantize            quantize onnx models to int8 and compare them against fp32 ones
 
         optional arguments:
           -h, --help            show this help message and exit
@@ -32,6 +33,7 @@ from dunedn.preprocessing.preprocess import add_arguments_preprocessing
 from dunedn.training.denoise_training import add_arguments_training
 from dunedn.inference.inference import add_arguments_inference
 from dunedn.inference.analysis import add_arguments_analysis
+from dunedn.inference.quantize import add_arguments_quantize
 
 
 def main():
@@ -72,6 +74,15 @@ def main():
     )
     add_arguments_analysis(dn_subparser)
 
+    # quantize
+    q_msg = "Quantize ONNX models to int8 and compare them against fp32 ones."
+    q_subparser = subparsers.add_parser(
+        "quantize",
+        description=q_msg,
+        help=q_msg.lower().strip("."),
+    )
+    add_arguments_quantize(q_subparser)
+
     args = parser.parse_args()
 
     start = tm()
@@ -0,0 +1,328 @@
+"""
+    Ensures the GCNN inference optimizations are numerically equivalent to the
+    reference implementation.
+"""
+import onnxruntime as ort
+import pytest
+import torch
+from dunedn.networks.backends import get_cache_key, set_backend
+from dunedn.networks.onnx.onnx_pool import OnnxSessionPool
+from dunedn.networks.onnx.utils import np_planes2tiles, np_tiles2planes
+from dunedn.networks.gcnn.gcnn_dataloading import GcnnPlanesDataset
+from dunedn.networks.gcnn.gcnn_net import GcnnNet, GcnnPlanesNet
+from dunedn.networks.gcnn.gcnn_net_blocks import NonLocalGraph, NonLocalAggregator
+from dunedn.networks.gcnn.gcnn_net_utils import (
+    Converter,
+    blocked_pairwise_dist,
+    calculate_pad,
+    local_mask,
+    pairwise_dist,
+    window_dist,
+    window_neighbours,
+)
+from dunedn.training.metrics import DN_METRICS
+from dunedn.utils.utils import median_subtraction
+
+CROP_EDGE = 16
+K = 8
+
+
+def test_nonlocal_aggregator_mean_first():
+    """Averaging neighbours before the linear layer matches the full path."""
+    torch.manual_seed(0)
+    x = torch.randn(4, 8, CROP_EDGE, CROP_EDGE)
+    aggregator = NonLocalAggregator(8, 16)
+
+    getgraph_fn = NonLocalGraph(K, (CROP_EDGE, CROP_EDGE))
+    full = aggregator(x, getgraph_fn(x))
+
+    getgraph_fn.reduce_neighbours = True
+    graph = getgraph_fn(x)
+    assert graph.shape == (4, CROP_EDGE * CROP_EDGE, 8)
+    reduced = aggregator(x, graph)
+
+    assert torch.allclose(full, reduced, atol=1e-5)
+
+
+def test_gcnn_mean_first_inference():
+    """The GcnnNet evaluation mode uses the mean first path."""
+    torch.manual_seed(0)
+    network = GcnnNet("gcnn", "dn", CROP_EDGE, 1, 4, k=K)
+    x = torch.randn(2, 1, CROP_EDGE, CROP_EDGE)
+
+    network.eval()
+    assert network.getgraph_fn.reduce_neighbours
+    with torch.no_grad():
+        reduced = network(x)
+
+        network.getgraph_fn.reduce_neighbours = False
+        full = network(x)
+
+    assert torch.allclose(full, reduced, atol=1e-4)
+
+    network.train()
+    assert not network.getgraph_fn.reduce_neighbours
+
+
+def test_blocked_pairwise_dist():
+    """Blocked k-NN search returns the same neighbours as the dense one."""
+    torch.manual_seed(0)
+    arr = torch.randn(3, CROP_EDGE * CROP_EDGE, 8)
+    mask = local_mask((CROP_EDGE, CROP_EDGE))
+    dense = pairwise_dist(arr, K, mask)
+
+    # budgets giving single row, uneven and single block tiling
+    for max_memory in [1e-6, 0.05, 1e3]:
+        blocked = blocked_pairwise_dist(arr, K, mask, max_memory)
+        assert torch.equal(dense, blocked)
+
+
+def test_window_dist():
+    """A search window covering the crop finds the exact neighbours."""
+    torch.manual_seed(0)
+    # small features: masked adjacent pixels are never among the closest
+    arr = 0.01 * torch.randn(3, CROP_EDGE * CROP_EDGE, 8)
+    mask = local_mask((CROP_EDGE, CROP_EDGE))
+    dense = pairwise_dist(arr, K, mask)
+
+    window = window_neighbours((CROP_EDGE, CROP_EDGE), CROP_EDGE - 1)
+    approx = window_dist(arr, K, (CROP_EDGE, CROP_EDGE), window)
+    assert torch.equal(dense.sort(dim=-1)[0], approx.sort(dim=-1)[0])
+
+
+def test_converter_roundtrip():
+    """Tiling and untiling planes gives back the original planes."""
+    torch.manual_seed(0)
+    converter = Converter((CROP_EDGE, CROP_EDGE))
+    planes = torch.randn(2, 1, 5 * CROP_EDGE + 3, 7 * CROP_EDGE + 10)
+    tiles = converter.planes2tiles(planes)
+    assert tiles.shape == (2 * 6 * 8, 1, CROP_EDGE, CROP_EDGE)
+
+    # tiles are ordered by plane, then row-major within the plane
+    top, left = (CROP_EDGE - 3) // 2, (CROP_EDGE - 10) // 2
+    rows = slice(0, CROP_EDGE - top)
+    cols = slice(CROP_EDGE - left, 2 * CROP_EDGE - left)
+    assert torch.equal(tiles[1, 0, top:], planes[0, 0, rows, cols])
+    assert torch.equal(converter.tiles2planes(tiles, planes.shape), planes)
+
+
+def test_numpy_converter():
+    """The numpy tiling matches the Converter one."""
+    torch.manual_seed(0)
+    crop_size = (CROP_EDGE, CROP_EDGE)
+    converter = Converter(crop_size)
+    planes = torch.randn(2, 1, 5 * CROP_EDGE + 3, 7 * CROP_EDGE + 10)
+    tiles = converter.planes2tiles(planes)
+
+    np_tiles = np_planes2tiles(planes.numpy(), crop_size)
+    assert torch.allclose(tiles, torch.from_numpy(np_tiles))
+    np_planes = np_tiles2planes(np_tiles, planes.shape, crop_size)
+    assert torch.equal(planes, torch.from_numpy(np_planes))
+
+
+class TilesMeanSession:
+    """Session stand-in whose border tiles outputs depend on the padding."""
+
+    def __init__(self, ckpt, metrics, session_options=None):
+        pass
+
+    def predict(self, generator):
+        generator.to_crops()
+        tiles = generator.noisy
+        output = tiles - tiles.mean(dim=(1, 2, 3), keepdim=True)
+        output = generator.converter.tiles2planes(output, generator.planes_shape)
+        generator.to_planes()
+        return output
+
+
+def test_onnx_session_pool():
+    """Pooled sessions outputs match the single session ones."""
+    torch.manual_seed(0)
+    # skewed planes: means after median subtraction differ across planes
+    planes = torch.randn(5, 1, 3 * CROP_EDGE + 3, 4 * CROP_EDGE + 7).square()
+    planes *= torch.arange(1, 6).view(-1, 1, 1, 1)
+    dsetup = {"crop_size": (CROP_EDGE, CROP_EDGE), "threshold": 3.5}
+    generator = GcnnPlanesDataset(planes.numpy(), "dn", "collection", dsetup, 4)
+
+    expected = TilesMeanSession(None, None).predict(generator)
+    pool = OnnxSessionPool(TilesMeanSession, None, None, pool_size=2)
+    assert torch.allclose(pool.predict(generator), expected, atol=1e-6)
+
+
+def test_gated_predict():
+    """Gated inference matches the ungated one on selected tiles, zeros elsewhere."""
+    torch.manual_seed(0)
+    network = GcnnNet("cnn", "dn", CROP_EDGE, 1, 4)
+    network.compile(None, None, DN_METRICS)
+    network.eval()
+    planes = 0.1 * torch.randn(2, 1, 2 * CROP_EDGE, 3 * CROP_EDGE)
+
+    # the second tile of the second tiles row carries signal, in plane
+    # coordinates after removing the Converter padding
+    pad = calculate_pad(planes.shape, (CROP_EDGE, CROP_EDGE))
+    top, left = CROP_EDGE - pad[2], CROP_EDGE - pad[0]
+    signal = (
+        slice(None),
+        slice(None),
+        slice(max(top, 0), top + CROP_EDGE),
+        slice(max(left, 0), left + CROP_EDGE),
+    )
+    center = top + CROP_EDGE // 2, left + CROP_EDGE // 2
+    planes[:, :, center[0] - 2 : center[0] + 2, center[1] - 2 : center[1] + 2] = 10
+    dsetup = {"crop_size": (CROP_EDGE, CROP_EDGE), "threshold": 3.5}
+    generator = GcnnPlanesDataset(planes.numpy(), "dn", "collection", dsetup, 4)
+
+    kwargs = {"no_metrics": True, "verbose": 0}
+    with torch.no_grad():
+        expected = network.predict(generator, **kwargs)
+        ungated = network.predict(generator, gate_threshold=-1, **kwargs)
+        gated = network.predict(generator, gate_threshold=1, **kwargs)
+    torch.testing.assert_close(ungated, expected)
+
+    torch.testing.assert_close(gated[signal], expected[signal])
+    gated[signal] = 0
+    assert torch.count_nonzero(gated) == 0
+
+
+@pytest.mark.parametrize("model", ["cnn", "gcnn"])
+def test_gcnn_planes_net(model):
+    """The whole-plane wrapper matches the tiling inference pipeline."""
+    torch.manual_seed(0)
+    network = GcnnNet(model, "dn", CROP_EDGE, 1, 4, k=K)
+    network.eval()
+    plane_size = (3 * CROP_EDGE + 3, 4 * CROP_EDGE)
+    planes = torch.randn(2, 1, *plane_size)
+    threshold = 0.1
+
+    converter = Converter((CROP_EDGE, CROP_EDGE))
+    noisy = torch.Tensor(median_subtraction(planes.numpy()))
+    with torch.no_grad():
+        tiles = network(converter.planes2tiles(noisy))
+        expected = converter.tiles2planes(tiles, noisy.shape)
+        expected[expected.abs() <= threshold] = 0
+
+        output = GcnnPlanesNet(network, plane_size, threshold)(planes)
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_gcnn_planes_net_batches():
+    """Tiles batches of the whole-plane wrapper match the unbatched pipeline."""
+    torch.manual_seed(0)
+    network = GcnnNet("gcnn", "dn", CROP_EDGE, 1, 4, k=K)
+    network.eval()
+    plane_size = (3 * CROP_EDGE + 3, 4 * CROP_EDGE)
+    # 3 planes of 16 tiles, in batches of 5 tiles
+    planes = torch.randn(3, 1, *plane_size)
+
+    converter = Converter((CROP_EDGE, CROP_EDGE))
+    noisy = torch.Tensor(median_subtraction(planes.numpy()))
+    with torch.no_grad():
+        tiles = network(converter.planes2tiles(noisy))
+        expected = converter.tiles2planes(tiles, noisy.shape)
+
+        output = GcnnPlanesNet(network, plane_size, batch_size=5)(planes)
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_torchscript_backend(tmp_path):
+    """The traced network matches the eager one and is reloaded from cache."""
+    torch.manual_seed(0)
+    network = GcnnNet("gcnn", "dn", CROP_EDGE, 1, 4, k=K)
+    network.eval()
+    ckpt = tmp_path / "gcnn_dn_collection.pth"
+    torch.save(network.state_dict(), ckpt)
+    input_shape = (4, 1, CROP_EDGE, CROP_EDGE)
+    cache_dir = tmp_path / "torchscript"
+
+    # batches are chunked and padded to the traced batch size
+    x = torch.randn(6, 1, CROP_EDGE, CROP_EDGE)
+    with torch.no_grad():
+        expected = network(x)
+        set_backend(network, "torchscript", input_shape, ckpt, cache_dir)
+        assert len(list(cache_dir.glob("*.pt"))) == 1
+        assert torch.allclose(network.inference_module(x), expected, atol=1e-5)
+
+        reloaded = GcnnNet("gcnn", "dn", CROP_EDGE, 1, 4, k=K)
+        set_backend(reloaded, "torchscript", input_shape, ckpt, cache_dir)
+        assert torch.allclose(reloaded.inference_module(x), expected, atol=1e-5)
+
+
+def assert_mostly_close(output, expected, tol=1e-6):
+    """Checks outputs match up to rare k-NN ties broken differently.
+
+    Ties perturb a few values only, while graphs frozen to other inputs change
+    all of them: the mean absolute deviation tells the two apart.
+    """
+    deviation = (output - expected).abs().mean().item()
+    assert deviation < tol, f"mean absolute deviation {deviation:.2e}"
+
+
+def test_traced_graph_fresh_inputs(tmp_path):
+    """Traced and exported GCNN networks build the graph of their inputs."""
+    torch.manual_seed(0)
+    network = GcnnNet("gcnn", "dn", CROP_EDGE, 1, 4, k=K)
+    network.eval()
+    plane_size = (2 * CROP_EDGE, 2 * CROP_EDGE)
+    fname = tmp_path / "gcnn.onnx"
+    planes_fname = tmp_path / "gcnn_planes.onnx"
+    network.onnx_export(fname)
+    network.onnx_export(planes_fname, (1, 1, *plane_size), batch_size=3)
+    session = ort.InferenceSession(fname.as_posix())
+    planes_session = ort.InferenceSession(planes_fname.as_posix())
+    planes_network = GcnnPlanesNet(network, plane_size, batch_size=3)
+
+    with torch.no_grad():
+        set_backend(network, "torchscript", (4, 1, CROP_EDGE, CROP_EDGE))
+        # inputs other than the random tracing ones
+        for _ in range(2):
+            x = torch.randn(4, 1, CROP_EDGE, CROP_EDGE)
+            expected = network(x)
+            traced = network.inference_module(x)
+            torch.testing.assert_close(traced, expected)
+            exported = session.run(None, {"input": x.numpy()})[0]
+            assert_mostly_close(torch.from_numpy(exported), expected)
+
+            planes = torch.randn(1, 1, *plane_size)
+            expected = planes_network(planes)
+            exported = planes_session.run(None, {"input": planes.numpy()})[0]
+            assert_mostly_close(torch.from_numpy(exported), expected)
+
+
+def test_cache_key_settings(tmp_path):
+    """Networks traced with different k-NN settings have different cache keys."""
+    ckpt = tmp_path / "gcnn_dn_collection.pth"
+    torch.save(GcnnNet("gcnn", "dn", CROP_EDGE, 1, 4, k=K).state_dict(), ckpt)
+    input_shape = (4, 1, CROP_EDGE, CROP_EDGE)
+    net_dict = {"model": "gcnn", "k": K, "knn_strategy": "exact", "knn_window": 5}
+    key = get_cache_key(ckpt, input_shape, settings=net_dict)
+    assert key == get_cache_key(ckpt, input_shape, settings=dict(net_dict))
+    net_dict["knn_strategy"] = "window"
+    assert key != get_cache_key(ckpt, input_shape, settings=net_dict)
+
+
+def test_fuse_for_inference():
+    """Folding batch normalization layers leaves the outputs unchanged."""
+    torch.manual_seed(0)
+    # double precision: folding only reorders the floating point operations
+    x = torch.randn(2, 1, CROP_EDGE, CROP_EDGE, dtype=torch.float64)
+    for model in ["cnn", "gcnn"]:
+        network = GcnnNet(model, "dn", CROP_EDGE, 1, 4, k=K).double()
+        for layer in network.modules():
+            if isinstance(layer, torch.nn.BatchNorm2d):
+                layer.running_mean.uniform_(-1, 1)
+                layer.running_var.uniform_(0.5, 2)
+                torch.nn.init.uniform_(layer.weight, 0.5, 2)
+                torch.nn.init.uniform_(layer.bias, -1, 1)
+        network.eval()
+
+        with torch.no_grad():
+            expected = network(x)
+            network.fuse_for_inference()
+            output = network(x)
+        # the unused pre-processing layers are left untouched
+        assert not any(
+            isinstance(layer, torch.nn.BatchNorm2d)
+            for block in [network.hpf, *network.lpfs, network.post_process_block]
+            for layer in block.modules()
+        )
+        torch.testing.assert_close(output, expected)
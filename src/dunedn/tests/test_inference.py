@@ -0,0 +1,146 @@
+"""
+    Ensures the inference scheduling options leave the outputs unchanged.
+"""
+from pathlib import Path
+import threading
+from time import sleep
+import numpy as np
+import pytest
+import torch
+from dunedn.inference import hitreco
+from dunedn.inference.hitreco import DnModel
+from dunedn.inference.pipeline import EventPipeline
+from dunedn.inference.quantize import PlanesCalibrationReader, quantize_model
+from dunedn.utils.utils import load_runcard
+
+
+def test_concurrent_branches(monkeypatch):
+    """Concurrent branches match sequential ones and restore the threads."""
+    torch.manual_seed(0)
+    setup = load_runcard(Path("runcards/default.yaml"))
+    model = DnModel(setup, "cnn", should_run_concurrently=True, torch_threads=2)
+    model.verbose = 0
+
+    # small planes: skip the event reassembly
+    monkeypatch.setattr(hitreco, "planes2evt", lambda i, c, out=None: (i, c))
+    rng = np.random.default_rng(0)
+    iplanes = rng.normal(size=(2, 1, 40, 70)).astype(np.float32)
+    cplanes = rng.normal(size=(1, 1, 48, 70)).astype(np.float32)
+    idataset = model.induction_generator(iplanes)
+    cdataset = model.collection_generator(cplanes)
+
+    expected = (
+        model.predict_branch(model.inetwork, idataset),
+        model.predict_branch(model.cnetwork, cdataset),
+    )
+    # both branches share the whole PyTorch threads budget
+    branch_threads = []
+    predict_branch = model.predict_branch
+
+    def record_threads(*args, **kwargs):
+        branch_threads.append(torch.get_num_threads())
+        return predict_branch(*args, **kwargs)
+
+    monkeypatch.setattr(model, "predict_branch", record_threads)
+    nb_threads = torch.get_num_threads()
+    iout, cout = model.predict_datasets(idataset, cdataset)
+    assert branch_threads == [2, 2]
+    assert torch.get_num_threads() == nb_threads
+    torch.testing.assert_close(iout, expected[0])
+    torch.testing.assert_close(cout, expected[1])
+
+
+def test_dynamic_quantization(tmp_path):
+    """Dynamically quantized networks are loaded in place of the fp32 ones."""
+    torch.manual_seed(0)
+    setup = load_runcard(Path("runcards/default.yaml"))
+    DnModel(setup, "cnn").onnx_export(tmp_path)
+    for channel in ["induction", "collection"]:
+        fname = tmp_path / f"{channel}/cnn_dn.onnx"
+        output = quantize_model(fname, "dynamic")
+        assert output == tmp_path / f"{channel}/cnn_dn_dynamic.onnx"
+        # the fp32 networks cannot be loaded by mistake
+        fname.unlink()
+
+    setup["onnx"]["variant"] = "dynamic"
+    model = DnModel(setup, "cnn", tmp_path, should_use_onnx=True)
+    rng = np.random.default_rng(0)
+    iplanes = rng.normal(size=(2, 1, 40, 70)).astype(np.float32)
+    cplanes = rng.normal(size=(1, 1, 48, 70)).astype(np.float32)
+    iout = model.predict_branch(model.inetwork, model.induction_generator(iplanes))
+    cout = model.predict_branch(model.cnetwork, model.collection_generator(cplanes))
+    assert iout.shape == iplanes.shape
+    assert cout.shape == cplanes.shape
+
+
+@pytest.mark.parametrize("nb_batches, sizes", [(2, [3, 3]), (5, [3, 3, 3, 1])])
+def test_calibration_reader(nb_batches, sizes):
+    """The calibration reader yields at most ``nb_batches`` float32 batches."""
+    tiles = np.arange(10 * 16, dtype=np.float64).reshape(10, 1, 4, 4)
+    reader = PlanesCalibrationReader(tiles, batch_size=3, nb_batches=nb_batches)
+    batches = []
+    while (batch := reader.get_next()) is not None:
+        batches.append(batch["input"])
+    assert [len(batch) for batch in batches] == sizes
+    assert all(batch.dtype == np.float32 for batch in batches)
+    np.testing.assert_array_equal(np.concatenate(batches), tiles[: sum(sizes)])
+
+
+def run_with_timeout(pipeline, items, timeout=10):
+    """Runs the pipeline in a thread, failing if it does not return in time.
+
+    Returns
+    -------
+    dict
+        The ``latencies`` returned by ``run`` or the ``error`` it raised.
+    """
+    result = {}
+
+    def target():
+        try:
+            result["latencies"] = pipeline.run(items)
+        except Exception as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not shut down"
+    return result
+
+
+def test_pipeline_order():
+    """Items leave the pipeline in order and all the stage threads exit."""
+    outputs = []
+    stages = [
+        ("load", lambda x: x),
+        # uneven stage times, to interleave the stages
+        ("forward", lambda x: sleep(0.001 * (x % 3)) or 2 * x),
+        ("save", outputs.append),
+    ]
+    nb_threads = threading.active_count()
+    result = run_with_timeout(EventPipeline(stages, queue_size=1), range(20))
+    assert len(result["latencies"]) == 20
+    assert outputs == [2 * x for x in range(20)]
+    assert threading.active_count() == nb_threads
+
+
+def fail_on(value):
+    """Returns a stage function raising on ``value``."""
+
+    def fn(x):
+        if x == value:
+            raise ValueError(f"stage failed on {x}")
+        return x
+
+    return fn
+
+
+@pytest.mark.parametrize("failing_stage", [0, 1, 2])
+def test_pipeline_error(failing_stage):
+    """A stage error stops the pipeline and is re-raised by ``run``."""
+    stages = [(f"stage{i}", lambda x: x) for i in range(3)]
+    stages[failing_stage] = ("failing", fail_on(3))
+    # more items than buffered: upstream stages block on full queues
+    result = run_with_timeout(EventPipeline(stages, queue_size=1), range(100))
+    assert isinstance(result.get("error"), ValueError)
@@ -7,7 +7,7 @@ import torch
 from dunedn.configdn import PACKAGE
 from dunedn.networks.gcnn.training import load_and_compile_gcnn_network
 from dunedn.networks.uscg.training import load_and_compile_uscg_network
-from dunedn.networks.utils import get_supported_models
+from dunedn.networks.utils import get_supported_models, no_weight_init
 from dunedn.utils.utils import load_runcard
 
 # instantiate logger
@@ -154,5 +154,16 @@ def test_networks():
         run_test(modeltype)
 
 
+def test_no_weight_init():
+    """Initializers are disabled within the context and restored after it."""
+    original = torch.nn.init.kaiming_uniform_
+    weight = torch.zeros(4, 4)
+    with no_weight_init():
+        torch.nn.init.ones_(weight)
+        assert torch.nn.init.kaiming_uniform_ is not original
+    assert torch.count_nonzero(weight) == 0
+    assert torch.nn.init.kaiming_uniform_ is original
+
+
 if __name__ == "__main__":
     test_networks()
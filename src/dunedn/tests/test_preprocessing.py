@@ -0,0 +1,164 @@
+"""
+    Ensures the streaming preprocessing steps match the in-memory reference.
+"""
+import numpy as np
+import pytest
+import torch
+from dunedn.geometry.helpers import evt2planes
+from dunedn.geometry.pdune import nb_event_channels
+from dunedn.networks.gcnn.gcnn_dataloading import GcnnCropSamplingDataset
+from dunedn.preprocessing.putils import (
+    EVENT_FILE_PREFIXES,
+    crop_planes_and_dump,
+    get_planes_and_dump,
+    save_normalization_info,
+)
+
+NB_EVENTS = 3
+NB_TICKS = 16
+
+
+def make_events(dname, nb_events=NB_EVENTS, dtypes=None):
+    """Saves synthetic events in ``<dname>/evts``.
+
+    Events are saved in float32, unless ``dtypes`` maps their kind to another
+    data type.
+
+    Returns
+    -------
+    dict
+        The events of each kind, of shape=(nb_events, nb channels, nb ticks).
+    """
+    rng = np.random.default_rng(0)
+    (dname / "evts").mkdir(parents=True)
+    (dname / "planes").mkdir()
+    events = {kind: [] for kind in EVENT_FILE_PREFIXES}
+    for i in range(nb_events):
+        for kind, prefix in EVENT_FILE_PREFIXES.items():
+            dtype = (dtypes or {}).get(kind, np.float32)
+            event = rng.normal(scale=100, size=(nb_event_channels, NB_TICKS + 2))
+            event = event.astype(dtype)
+            np.save(dname / f"evts/{prefix}_evt{i}.npy", event)
+            events[kind].append(event[:, 2:])
+    return events
+
+
+@pytest.mark.parametrize("nb_workers", [1, 2])
+def test_get_planes_and_dump(tmp_path, nb_workers):
+    """Streamed planes match the stacked planes of each event."""
+    events = make_events(tmp_path)
+    get_planes_and_dump(tmp_path, save_sample=True, nb_workers=nb_workers)
+
+    for kind, kind_events in events.items():
+        planes = [evt2planes(event) for event in kind_events]
+        for i, channel in enumerate(["induction", "collection"]):
+            expected = np.concatenate([p[i] for p in planes])
+            output = np.load(tmp_path / f"planes/{channel}_{kind}.npy")
+            np.testing.assert_array_equal(output, expected)
+
+        sample = np.load(tmp_path / f"planes/sample_collection_{kind}.npy")
+        np.testing.assert_array_equal(sample, output[:10])
+
+
+def test_get_planes_and_dump_dtypes(tmp_path):
+    """Each planes kind keeps the data type of its own events."""
+    dtypes = {"clear": np.float32, "noisy": np.int16, "simch": np.float64}
+    events = make_events(tmp_path, dtypes=dtypes)
+    get_planes_and_dump(tmp_path, save_sample=False, nb_workers=2)
+
+    for kind, kind_events in events.items():
+        planes = [evt2planes(event) for event in kind_events]
+        for i, channel in enumerate(["induction", "collection"]):
+            output = np.load(tmp_path / f"planes/{channel}_{kind}.npy")
+            assert output.dtype == dtypes[kind]
+            expected = np.concatenate([p[i] for p in planes])
+            np.testing.assert_array_equal(output, expected)
+
+
+@pytest.mark.parametrize("chunk_size", [2, None])
+@pytest.mark.parametrize("dtype", [np.float32, np.int16])
+def test_save_normalization_info(tmp_path, chunk_size, dtype):
+    """Streamed normalization statistics match the in-memory ones."""
+    rng = np.random.default_rng(0)
+    planes = rng.normal(100, 3, size=(5, 1, 8, NB_TICKS)).astype(dtype)
+    (tmp_path / "train/planes").mkdir(parents=True)
+    np.save(tmp_path / "train/planes/collection_noisy.npy", planes)
+    save_normalization_info(tmp_path, "collection", chunk_size=chunk_size)
+
+    n = planes.flatten().astype(np.float64)
+    minmax = np.load(tmp_path / "collection_minmax.npy")
+    assert minmax.dtype == np.float64
+    np.testing.assert_array_equal(minmax, [n.min(), n.max()])
+    zscore = np.load(tmp_path / "collection_zscore.npy")
+    np.testing.assert_allclose(zscore, [n.mean(), n.std()], rtol=1e-5)
+
+    n = planes.reshape([len(planes), -1]).astype(np.float64)
+    medians = np.median(n, axis=1, keepdims=True)
+    mednorm = np.load(tmp_path / "collection_mednorm.npy")
+    expected = [(n - medians).min(), (n - medians).max()]
+    np.testing.assert_allclose(mednorm, expected, rtol=1e-5)
+
+
+def test_crop_planes_and_dump(tmp_path):
+    """Crops are windows around signal and background pixels of each plane."""
+    nb_crops, pct, crop_size = 10, 0.4, [4, 6]
+    rng = np.random.default_rng(0)
+    shape = (5, 1, 12, NB_TICKS)
+    clear = rng.normal(size=shape) * (rng.random(shape) < 0.1)
+    (tmp_path / "planes").mkdir()
+    (tmp_path / "crops").mkdir()
+    for channel in ["induction", "collection"]:
+        np.save(tmp_path / f"planes/{channel}_clear.npy", clear)
+    # noisy planes have zero median: median subtraction leaves them unchanged
+    np.save(tmp_path / "planes/collection_noisy.npy", clear)
+    # integer ADC counts, whose median is 95.5
+    adc = np.arange(np.prod(shape[2:]), dtype=np.int16).reshape(shape[1:])
+    np.save(tmp_path / "planes/induction_noisy.npy", np.stack([adc] * len(clear)))
+    crop_planes_and_dump(tmp_path, nb_crops, crop_size, pct, block_size=2)
+
+    ncrops = np.load(tmp_path / f"crops/induction_noisy_4_{pct}.npy")
+    assert ncrops.dtype == np.float32
+    np.testing.assert_array_equal(ncrops % 1, 0.5)
+
+    ccrops = np.load(tmp_path / f"crops/collection_clear_4_{pct}.npy")
+    ncrops = np.load(tmp_path / f"crops/collection_noisy_4_{pct}.npy")
+    assert ccrops.shape == (len(clear) * nb_crops, 1, *crop_size)
+    np.testing.assert_array_equal(ncrops, ccrops)
+
+    crops = ccrops.reshape(len(clear), nb_crops, -1)
+    nb_sgn = int(nb_crops * pct)
+    assert (crops[:, :nb_sgn] != 0).any(-1).all()
+    assert (crops[:, nb_sgn:] == 0).any(-1).all()
+
+
+def test_crop_sampling_dataset(tmp_path):
+    """Sampled crops are balanced windows of the median subtracted planes."""
+    rng = np.random.default_rng(0)
+    shape = (3, 1, 12, NB_TICKS)
+    clear = rng.normal(size=shape) * (rng.random(shape) < 0.1)
+    (tmp_path / "train/planes").mkdir(parents=True)
+    np.save(tmp_path / "train/planes/collection_clear.npy", clear)
+    # noisy planes medians are 3: median subtraction recovers clear planes
+    np.save(tmp_path / "train/planes/collection_noisy.npy", clear + 3)
+    dsetup = {
+        "data_folder": tmp_path,
+        "crop_size": [4, 6],
+        "threshold": 3.5,
+        "nb_crops": 10,
+        "pct": 0.4,
+    }
+    dataset = GcnnCropSamplingDataset("train", "dn", "collection", dsetup, 5)
+    assert len(dataset) == len(clear) * 10
+
+    torch.manual_seed(0)
+    for index in range(len(dataset)):
+        noisy, clear_crop = dataset[index]
+        assert clear_crop.shape == (1, 4, 6)
+        torch.testing.assert_close(noisy, clear_crop)
+        if index % 10 < 4:
+            assert (clear_crop != 0).any()
+        else:
+            assert (clear_crop == 0).any()
+
+    loader = torch.utils.data.DataLoader(dataset, batch_size=5, num_workers=2)
+    assert sum(len(noisy) for noisy, _ in loader) == len(dataset)
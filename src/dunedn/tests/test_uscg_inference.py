@@ -0,0 +1,91 @@
+"""
+    Ensures the USCG inference optimizations match the reference
+    implementation.
+"""
+import torch
+from torch import nn
+from torchvision.models.resnet import Bottleneck
+from dunedn.networks.utils import fuse_conv_bn
+from dunedn.networks.uscg.uscg_net_blocks import (
+    GCN_Layer,
+    Pooling_Block,
+    adaptive_max_pool2d,
+)
+from dunedn.networks.uscg.utils import forward_windows
+
+
+class WindowNetwork(nn.Module):
+    """Pixel-wise network with the time windows attributes of UscgNet."""
+
+    def __init__(self, w, stride):
+        super().__init__()
+        self.w = w
+        self.stride = stride
+        self.conv = nn.Conv2d(1, 1, 1)
+
+    def forward(self, x):
+        return self.conv(x)
+
+
+def test_batched_windows():
+    """Batched and sequential windows give the overlap average."""
+    torch.manual_seed(0)
+    network = WindowNetwork(w=32, stride=16)
+    planes = torch.randn(3, 1, 8, 96)
+
+    with torch.no_grad():
+        expected = network(planes)
+        sequential = forward_windows(network, planes, "cpu", batch_windows=False)
+        batched = forward_windows(network, planes, "cpu", batch_windows=True)
+
+    # pixel-wise network: averaging overlapping windows is the identity
+    assert torch.allclose(sequential, expected, atol=1e-6)
+    assert torch.allclose(batched, expected, atol=1e-6)
+
+
+def test_static_adaptive_max_pool():
+    """The ONNX exportable pooling matches the torch adaptive one."""
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, 30, 63)
+    # downsampling, upsampling and mixed non divisible output sizes
+    for output_size in [(28, 28), (37, 125), (7, 100)]:
+        expected = nn.functional.adaptive_max_pool2d(x, output_size)
+        assert torch.equal(adaptive_max_pool2d(x, output_size), expected)
+
+
+def randomize_bn_stats(module):
+    """Sets non trivial batch normalization statistics and parameters."""
+    for layer in module.modules():
+        if isinstance(layer, nn.modules.batchnorm._BatchNorm):
+            layer.running_mean.uniform_(-1, 1)
+            layer.running_var.uniform_(0.5, 2)
+            nn.init.uniform_(layer.weight, 0.5, 2)
+            nn.init.uniform_(layer.bias, -1, 1)
+
+
+def test_fuse_conv_bn():
+    """Folding batch normalization layers leaves the outputs unchanged."""
+    torch.manual_seed(0)
+    downsample = nn.Sequential(nn.Conv2d(8, 16, 1), nn.BatchNorm2d(16))
+    modules = [
+        (Pooling_Block(8, 4, 4), torch.randn(2, 8, 13, 17)),
+        (Bottleneck(8, 4, downsample=downsample), torch.randn(2, 8, 9, 9)),
+    ]
+    for module, x in modules:
+        randomize_bn_stats(module)
+        module.eval()
+        with torch.no_grad():
+            expected = module(x)
+            fuse_conv_bn(module)
+            output = module(x)
+        assert not any(isinstance(m, nn.BatchNorm2d) for m in module.modules())
+        assert torch.allclose(output, expected, atol=1e-5)
+
+    layer = GCN_Layer(8, 4)
+    randomize_bn_stats(layer)
+    layer.eval()
+    x, adj = torch.randn(2, 5, 8), torch.rand(2, 5, 5)
+    with torch.no_grad():
+        expected = layer([x, adj])[0]
+        fuse_conv_bn(layer)
+        assert torch.allclose(layer([x, adj])[0], expected, atol=1e-5)